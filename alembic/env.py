@@ -11,10 +11,13 @@ sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 # add temporarily at the top of alembic/env.py
 print("ALEMBIC URL:", context.config.get_main_option("sqlalchemy.url"))
 
+from backend.app.settings import settings
 from backend.infra.db import Base
 target_metadata = Base.metadata
 
 config = context.config
+# migrate the same database the app uses (NSO_DATABASE_URL)
+config.set_main_option("sqlalchemy.url", settings.database_url)
 
 if config.config_file_name:
     try:
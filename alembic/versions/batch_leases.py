@@ -0,0 +1,22 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'batch_leases'
+down_revision = 'add_resultraw'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('batches', sa.Column('lease_owner', sa.String(128), nullable=True))
+    op.add_column('batches', sa.Column('lease_expires_at', sa.DateTime, nullable=True))
+    op.add_column('batches', sa.Column('attempts', sa.Integer, nullable=False, server_default='0'))
+    op.create_index('ix_batches_lease_expires_at', 'batches', ['lease_expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_batches_lease_expires_at', table_name='batches')
+    op.drop_column('batches', 'attempts')
+    op.drop_column('batches', 'lease_expires_at')
+    op.drop_column('batches', 'lease_owner')
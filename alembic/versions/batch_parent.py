@@ -0,0 +1,18 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'batch_parent'
+down_revision = 'result_cache'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('batches', sa.Column('parent_id', sa.Integer, sa.ForeignKey('batches.id'), nullable=True))
+    op.create_index('ix_batches_parent_id', 'batches', ['parent_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_batches_parent_id', table_name='batches')
+    op.drop_column('batches', 'parent_id')
@@ -0,0 +1,16 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'batch_progress'
+down_revision = 'project_weight'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('batches', sa.Column('progress', sa.JSON, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('batches', 'progress')
@@ -0,0 +1,16 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'batch_stage'
+down_revision = 'scan_target_cursor'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('batches', sa.Column('stage', sa.String(16), nullable=False, server_default='scan'))
+
+
+def downgrade() -> None:
+    op.drop_column('batches', 'stage')
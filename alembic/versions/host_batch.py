@@ -0,0 +1,18 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'host_batch'
+down_revision = 'batch_progress'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('hosts', sa.Column('batch_id', sa.Integer, sa.ForeignKey('batches.id'), nullable=True))
+    op.create_index('ix_hosts_batch_id', 'hosts', ['batch_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_hosts_batch_id', table_name='hosts')
+    op.drop_column('hosts', 'batch_id')
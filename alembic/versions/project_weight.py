@@ -0,0 +1,16 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'project_weight'
+down_revision = 'batch_parent'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('projects', sa.Column('weight', sa.Float, nullable=False, server_default='1.0'))
+
+
+def downgrade() -> None:
+    op.drop_column('projects', 'weight')
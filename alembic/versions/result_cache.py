@@ -0,0 +1,31 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'result_cache'
+down_revision = 'batch_stage'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('projects', sa.Column('cache_max_age', sa.Float, nullable=True))
+    op.create_table(
+        'result_cache',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_id', sa.Integer, sa.ForeignKey('projects.id'), nullable=False),
+        sa.Column('flags_key', sa.String(512), nullable=False),
+        sa.Column('addr_key', sa.String(255), nullable=False),
+        sa.Column('scan_id', sa.Integer, sa.ForeignKey('scans.id'), nullable=False),
+        sa.Column('host_id', sa.Integer, sa.ForeignKey('hosts.id'), nullable=True),
+        sa.Column('scanned_at', sa.DateTime, nullable=False),
+    )
+    op.create_index('ux_result_cache_key', 'result_cache', ['project_id', 'flags_key', 'addr_key'], unique=True)
+    op.create_index('ix_result_cache_fresh', 'result_cache', ['project_id', 'flags_key', 'scanned_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_result_cache_fresh', table_name='result_cache')
+    op.drop_index('ux_result_cache_key', table_name='result_cache')
+    op.drop_table('result_cache')
+    op.drop_column('projects', 'cache_max_age')
@@ -0,0 +1,21 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'result_cache_hash'
+down_revision = 'host_batch'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # entries keyed by the raw flags never match the hashed keys again
+    op.execute('DELETE FROM result_cache')
+    with op.batch_alter_table('result_cache') as batch:
+        batch.alter_column('flags_key', type_=sa.String(64), existing_type=sa.String(512), existing_nullable=False)
+
+
+def downgrade() -> None:
+    op.execute('DELETE FROM result_cache')
+    with op.batch_alter_table('result_cache') as batch:
+        batch.alter_column('flags_key', type_=sa.String(512), existing_type=sa.String(64), existing_nullable=False)
@@ -0,0 +1,18 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'scan_flags_key'
+down_revision = 'result_cache_hash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('scans', sa.Column('flags_key', sa.String(64), nullable=True))
+    op.create_index('ix_scans_flags_key', 'scans', ['flags_key'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_scans_flags_key', table_name='scans')
+    op.drop_column('scans', 'flags_key')
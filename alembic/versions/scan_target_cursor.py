@@ -0,0 +1,16 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'scan_target_cursor'
+down_revision = 'batch_leases'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('scans', sa.Column('target_cursor', sa.Integer, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('scans', 'target_cursor')
@@ -0,0 +1,60 @@
+"""Standalone scan agent.
+
+Runs on any machine that can reach the shared database, leases ``queued``
+batches and runs them with the local nmap. Start as many as the network can
+take::
+
+    NSO_DATABASE_URL=postgresql+psycopg://... python -m backend.agent --workers 4
+
+``--once`` drains whatever is runnable and exits instead of polling forever.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import signal
+from .app.settings import settings
+from .domain.parse_pool import PARSER
+from .domain.scan_worker import ScanWorkerPool, default_owner
+from .infra.ws_hub import ws_manager
+
+log = logging.getLogger("backend.agent")
+
+
+async def run_agent(workers: int, owner: str, poll_interval: float, once: bool) -> None:
+    pool = ScanWorkerPool(workers=workers, owner=owner, poll_interval=poll_interval)
+    log.info("agent %s: %d workers on %s", owner, workers, settings.database_url.split("@")[-1])
+    # with NSO_WS_PUBSUB_URL set, live output reaches the API's WebSocket clients
+    await ws_manager.start()
+    try:
+        if once:
+            await pool.run_until_idle()
+            return
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await pool.start()
+        await stop.wait()
+        # running batches go back to the queue for other agents
+        await pool.stop()
+    finally:
+        PARSER.shutdown()
+        await ws_manager.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lease and run queued scan batches.")
+    parser.add_argument("--workers", type=int, default=settings.scan_workers, help="concurrent nmap batches")
+    parser.add_argument("--agent-id", default=None, help="lease owner name (default: agent-<host>-<pid>)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between queue polls when idle")
+    parser.add_argument("--once", action="store_true", help="exit when nothing is left to claim")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    asyncio.run(run_agent(args.workers, args.agent_id or default_owner("agent"), args.poll_interval, args.once))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 from __future__ import annotations
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.encoders import jsonable_encoder
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 import time
@@ -10,11 +11,13 @@ from ..infra.db import SessionLocal
 from ..app.settings import settings
 from ..infra import models
 from ..infra.ws_hub import ws_manager
-from ..domain.scan_coordinator import start_scan
-from ..domain.task_registry import TASKS
+from ..domain.scan_coordinator import DEFAULT_DISCOVERY_FLAGS, DEFAULT_SERVICE_FLAGS, start_scan, stop_scan
+from ..domain.scan_worker import WORKERS
 from ..domain.runner import run_nmap_batch
-from ..domain.target_expander import expand_targets
-from ..domain.xml_parser import parse_nmap_xml
+from ..domain.target_expander import TargetSet, normalize_targets
+from ..domain.parse_pool import PARSER
+from ..domain.progress import scan_progress
+from ..domain.xml_parser import host_from_record
 
 router = APIRouter()
 
@@ -25,10 +28,16 @@ async def get_db():
 class ProjectIn(BaseModel):
     name: str
     description: str | None = None
+    # reuse results of targets scanned with the same flags this recently (seconds)
+    cache_max_age: float | None = None
+    # relative share of the scan workers when several projects have work queued
+    weight: float = Field(1.0, gt=0)
 
 @router.post("/projects")
 async def create_project(payload: ProjectIn, db: AsyncSession = Depends(get_db)):
-    p = models.Project(name=payload.name, description=payload.description)
+    p = models.Project(
+        name=payload.name, description=payload.description, cache_max_age=payload.cache_max_age, weight=payload.weight,
+    )
     db.add(p); await db.commit(); await db.refresh(p)
     return {"id": p.id, "name": p.name}
 
@@ -43,6 +52,13 @@ async def list_project_scans(project_id: int, db: AsyncSession = Depends(get_db)
     rows = (await db.execute(query)).mappings().all()
     return rows
 
+@router.get("/scans/{scan_id}/progress")
+async def get_scan_progress(scan_id: int, db: AsyncSession = Depends(get_db)):
+    progress = await scan_progress(db, scan_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return progress
+
 @router.get("/scans/{scan_id}/batches")
 async def list_scan_batches(scan_id: int, db: AsyncSession = Depends(get_db)):
     query = models.Batch.__table__.select().where(models.Batch.scan_id == scan_id)
@@ -99,18 +115,64 @@ async def get_target_history(address: str, db: AsyncSession = Depends(get_db)):
 class ExpandTargetsIn(BaseModel):
     targets: list[str]
 
+# most addresses one /targets/expand page may hold
+EXPAND_PAGE_MAX = 65536
+
+def _stream_targets_json(targets: TargetSet, per_write: int = 4096):
+    yield '{"targets":['
+    sep = ""
+    for part in targets.chunks(per_write):
+        yield sep + ",".join(f'"{t}"' for t in part)
+        sep = ","
+    yield "]}"
+
 @router.post("/targets/expand")
-async def expand_targets_api(payload: ExpandTargetsIn):
-    expanded = expand_targets(payload.targets)
-    return {"targets": expanded}
+async def expand_targets_api(
+    payload: ExpandTargetsIn,
+    offset: int = Query(0, ge=0),
+    limit: int | None = Query(None, ge=1, le=EXPAND_PAGE_MAX),
+):
+    """Expand targets to IP addresses: streamed in full, or one page with ``limit``."""
+    targets = TargetSet.parse(payload.targets, allow_hostnames=False)
+    if limit is not None:
+        page = list(targets[offset:offset + limit])
+        end = offset + len(page)
+        return {
+            "targets": page,
+            "total": targets.size,
+            "offset": offset,
+            "next_offset": end if end < targets.size else None,
+        }
+    return StreamingResponse(
+        _stream_targets_json(targets),
+        media_type="application/json",
+        headers={"X-Total-Count": str(targets.size)},
+    )
 
 class StartScanIn(BaseModel):
     project_id: int
     nmap_flags: list[str] = ["-T4", "-Pn", "-sS"]
     targets: list[str]
+    # same syntax as targets; removed before batching (nmap --exclude)
+    exclude: list[str] = []
     runner: str = "asyncio"
     chunk_size: int = 256
     concurrency: int = 6
+    # size batches to run about this long, learning from finished batches
+    # (chunk_size becomes the first guess when no earlier scan used these flags)
+    batch_seconds: float | None = None
+    # two-stage pipeline: a cheap discovery pass first, then nmap_flags
+    # against the hosts found up only
+    discovery: bool = False
+    discovery_flags: list[str] = DEFAULT_DISCOVERY_FLAGS
+    discovery_chunk_size: int = 4096
+    # follow-up version detection on the open ports each batch found
+    service_detection: bool = False
+    service_flags: list[str] = DEFAULT_SERVICE_FLAGS
+    # overrides the project's cache_max_age; 0 scans everything again
+    cache_max_age: float | None = None
+    # among this project's scans, higher priorities get free workers first
+    priority: int = 0
 
 
 class NmapRunIn(BaseModel):
@@ -125,8 +187,8 @@ async def nmap_run(payload: NmapRunIn):
     lines: list[str] = []
     stderr_path = out_dir / f"batch_{batch_id}.stderr.log"
     try:
-        async for line in run_nmap_batch(batch_id, payload.targets, payload.nmap_flags, out_dir=out_dir):
-            lines.append(line)
+        async for batch in run_nmap_batch(batch_id, payload.targets, payload.nmap_flags, out_dir=out_dir):
+            lines.extend(batch)
     except Exception as e:
         err_text = ""
         if stderr_path.exists():
@@ -149,24 +211,40 @@ async def nmap_run(payload: NmapRunIn):
     hosts = []
     xml_path = out_dir / f"batch_{batch_id}.xml"
     if xml_path.exists():
-        xml_content = xml_path.read_text(errors="ignore")
-        hosts = parse_nmap_xml(xml_content)
+        hosts = [host_from_record(r) for r in await PARSER.hosts(xml_path, with_ports=True)]
 
     return {"stdout": "\n".join(lines), "hosts": jsonable_encoder(hosts)}
 
 @router.post("/scans/start")
 async def scans_start(payload: StartScanIn, db: AsyncSession = Depends(get_db)):
+    targets = normalize_targets(payload.targets, payload.exclude)
+    if targets.size > settings.max_scan_targets:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{targets.size} targets exceed the limit of {settings.max_scan_targets} per scan",
+        )
     scan_id = await start_scan(
         db=db,
         project_id=payload.project_id,
         nmap_flags=payload.nmap_flags,
-        targets=payload.targets,
+        targets=targets,
         runner=payload.runner,
         chunk_size=payload.chunk_size,
         concurrency=payload.concurrency,
+        batch_seconds=payload.batch_seconds,
+        discovery_flags=payload.discovery_flags if payload.discovery else None,
+        discovery_chunk_size=payload.discovery_chunk_size,
+        service_flags=payload.service_flags if payload.service_detection else None,
+        cache_max_age=payload.cache_max_age,
+        priority=payload.priority,
     )
+    WORKERS.notify()
     return {"scan_id": scan_id, "status": "started"}
 
+@router.get("/queue")
+async def queue_stats():
+    return await WORKERS.stats()
+
 @router.get("/scans/{scan_id}/hosts")
 async def list_scan_hosts(scan_id: int, db: AsyncSession = Depends(get_db)):
     query = select(models.Host).where(models.Host.scan_id == scan_id)
@@ -182,19 +260,27 @@ async def get_host_details(host_id: int, db: AsyncSession = Depends(get_db)):
     return row
 
 @router.post("/scans/{scan_id}/stop")
-async def scans_stop(scan_id: int):
-    await TASKS.cancel_scan(scan_id)
+async def scans_stop(scan_id: int, db: AsyncSession = Depends(get_db)):
+    await stop_scan(db, scan_id)
     return {"scan_id": scan_id, "status": "stopping"}
 
+@router.get("/ws/stats")
+async def ws_stats():
+    return ws_manager.stats()
+
 @router.websocket("/ws/scans/{scan_id}")
-async def ws_scans(ws: WebSocket, scan_id: int):
-    """Handle WebSocket connections for the given ``scan_id``."""
+async def ws_scans(ws: WebSocket, scan_id: int, since: int | None = None):
+    """Handle WebSocket connections for the given ``scan_id``.
+
+    ``?since=<seq>`` replays the buffered events after ``seq`` first.
+    """
 
-    await ws_manager.connect(scan_id, ws)
+    await ws_manager.connect(scan_id, ws, since=since)
     try:
-        await ws.send_json({"event": "connected", "scan_id": scan_id})
         while True:
             # keepalive; you could accept pings or client messages here
             await ws.receive_text()
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.disconnect(scan_id, ws)
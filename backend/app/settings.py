@@ -21,7 +21,7 @@ def _default_sqlite_url() -> str:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     db_path = (DATA_DIR / "nsorchestrator.db").as_posix()
     # async driver for SQLAlchemy 2.x
-    return f"sqliteaiosqlite:///{db_path}"
+    return f"sqlite+aiosqlite:///{db_path}"
 
 class Settings(BaseSettings):
     # Override with NSO_DATABASE_URL in env or .env
@@ -30,6 +30,80 @@ class Settings(BaseSettings):
     output_dir: Path = Field(default_factory=_default_output_dir)
     nmap_path: str = "nmap"
 
+    # Connection pool (ignored for in-memory SQLite). Size it to at least the
+    # scan concurrency: every running batch borrows its own short-lived session.
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+
+    # Background workers running queued batches in the API process
+    scan_workers: int = 6
+    # batches running at once across all workers and agents (0: no global
+    # limit), and the fraction of those slots (or of this pool's workers when
+    # scheduler_slots is 0) that one scan may hold
+    scheduler_slots: int = 0
+    scheduler_max_share: float = 1.0
+    # packets/s shared by all running batches, each getting its part as
+    # --max-rate when claimed (0: no budget); rate_subnet_caps limits what
+    # batches touching a subnet send together, e.g. {"10.1.0.0/16": 300};
+    # no batch gets less than rate_min
+    rate_budget: float = 0.0
+    rate_subnet_caps: dict[str, float] = {}
+    rate_min: float = 10.0
+    # Batch leases (shared by API workers and agents): renewed every third of
+    # the lease; expired batches are re-queued up to batch_max_attempts claims
+    batch_lease_seconds: float = 60.0
+    batch_max_attempts: int = 3
+    # on startup, keep what a dead worker's partial XML already covers and
+    # re-queue only the rest of its batch
+    resume_partial: bool = True
+    # straggler batches: running straggler_factor times longer than the scan's
+    # median seconds per host predicts (and at least straggler_min_seconds),
+    # once straggler_min_samples batches of the scan completed, are cut short
+    # when the scan has a free slot and their rest re-split into
+    # straggler_split_parts batches (with --host-timeout when set, in seconds)
+    straggler_factor: float = 3.0
+    straggler_min_seconds: float = 300.0
+    straggler_min_samples: int = 3
+    straggler_split_parts: int = 4
+    straggler_host_timeout: float = 0.0
+    # nmap prints progress every this many seconds (--stats-every), reported
+    # as "progress" events and in batches.progress; 0 turns it off
+    stats_every: float = 10.0
+    # seconds between reads of a running port-scan batch's -oX file; each
+    # completed <host> is stored and sent as "host_found" (0: only at the end)
+    live_hosts_interval: float = 2.0
+    # processes parsing batch XML off the event loop (0: a thread instead)
+    parse_workers: int = 2
+    # <host> elements a parse worker sends back at a time
+    parse_chunk_hosts: int = 5000
+    # most targets one scan may cover after normalization (default: a /8);
+    # larger requests are rejected with 422
+    max_scan_targets: int = 2 ** 24
+    # bounds for adaptively sized batches (StartScanIn.batch_seconds)
+    batch_min_size: int = 1
+    batch_max_size: int = 4096
+
+    # WebSocket fan-out: frames queued per connection, and what to do when a
+    # client falls that far behind (drop_oldest | coalesce | disconnect)
+    ws_queue_size: int = 1000
+    ws_slow_policy: str = "drop_oldest"
+    # nmap output is sent as one "lines" frame per scan every window
+    # (or sooner once it holds this many bytes); 0 ms sends single "line" events
+    ws_line_window_ms: float = 50.0
+    ws_line_window_bytes: int = 65536
+    # replay buffer of recent events per scan for ?since= reconnects, and the
+    # cap across all scans (finished scans are evicted first)
+    ws_replay_scan_bytes: int = 4 * 1024 * 1024
+    ws_replay_total_bytes: int = 64 * 1024 * 1024
+    # redis://host:6379/0 to share WebSocket events between API workers and
+    # agents; empty keeps delivery inside this process
+    ws_pubsub_url: str = ""
+    # frames waiting to be published to Redis; when it is slow or down the
+    # oldest are dropped beyond this many
+    ws_pubsub_outbox: int = 10000
+
     # Pydantic v2 settings config
     model_config = SettingsConfigDict(
         env_file=".env",
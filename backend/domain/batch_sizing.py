@@ -0,0 +1,140 @@
+from __future__ import annotations
+import math
+import statistics
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..infra import models
+from .result_cache import flags_key
+
+# (started_at, finished_at, target_count) of a completed batch
+Timing = Tuple[Optional[datetime], Optional[datetime], int]
+
+
+def seconds_per_host(timings: Iterable[Timing]) -> Optional[float]:
+    """Wall-clock seconds per target over ``timings``; ``None`` without data."""
+    seconds = hosts = 0.0
+    for started, finished, count in timings:
+        if started is None or finished is None or not count:
+            continue
+        seconds += max((finished - started).total_seconds(), 0.0)
+        hosts += count
+    if not hosts or not seconds:
+        return None
+    return seconds / hosts
+
+
+@dataclass(slots=True)
+class BatchSizer:
+    """Pick batch sizes so one batch takes about ``target_seconds``.
+
+    Towards the end of a scan batches shrink to at most half of each slot's
+    share of the remaining targets (guided self-scheduling), so the last
+    batches finish close together instead of one long straggler.
+    """
+
+    target_seconds: float
+    min_size: int = 1
+    max_size: int = 4096
+
+    def size(self, seconds_per_host: Optional[float], remaining: int, slots: int, fallback: int) -> int:
+        if seconds_per_host:
+            size = int(self.target_seconds / seconds_per_host)
+        else:
+            size = fallback
+        size = min(size, self.max_size, math.ceil(remaining / (2 * max(slots, 1))))
+        return max(1, min(remaining, max(self.min_size, size)))
+
+
+async def observed_seconds_per_host(session: AsyncSession, scan_id: int) -> Optional[float]:
+    """Cost per target measured on this scan's completed batches."""
+    rows = await session.execute(
+        select(models.Batch.started_at, models.Batch.finished_at, models.Batch.target_count)
+        .where(models.Batch.scan_id == scan_id, models.Batch.status == "completed")
+    )
+    return seconds_per_host(rows.all())
+
+
+async def historical_seconds_per_host(
+    session: AsyncSession, flags: list[str], exclude_scan_id: int | None = None, limit: int = 500
+) -> Optional[float]:
+    """Cost per target from the latest completed batches of other scans run with ``flags``.
+
+    Scans are matched on ``Scan.flags_key``, so reordered but equivalent
+    flags count too, and the ``limit`` applies after that filter. Only
+    port-scan batches count; discovery and service batches run other flags.
+    """
+    query = (
+        select(models.Batch.started_at, models.Batch.finished_at, models.Batch.target_count)
+        .join(models.Scan, models.Batch.scan_id == models.Scan.id)
+        .where(
+            models.Scan.flags_key == flags_key(flags),
+            models.Batch.status == "completed",
+            models.Batch.stage == "scan",
+        )
+        .order_by(models.Batch.finished_at.desc())
+        .limit(limit)
+    )
+    if exclude_scan_id is not None:
+        query = query.where(models.Scan.id != exclude_scan_id)
+    return seconds_per_host((await session.execute(query)).all())
+
+
+async def find_stragglers(
+    session: AsyncSession,
+    owner: str,
+    factor: float,
+    min_seconds: float,
+    min_samples: int = 3,
+    now: datetime | None = None,
+) -> list[int]:
+    """Ids of ``owner``'s running batches worth splitting.
+
+    A batch is a straggler when it has run ``factor`` times longer than the
+    median seconds per host of its scan's completed batches (same stage)
+    predicts for its size, and at least ``min_seconds``. Only scans with a
+    free ``concurrency`` slot count: the pieces need somewhere to run.
+    """
+    now = now or datetime.utcnow()
+    running = (await session.execute(
+        select(models.Batch).where(
+            models.Batch.status == "running",
+            models.Batch.lease_owner == owner,
+            models.Batch.target_count > 1,
+        )
+    )).scalars().all()
+    if not running:
+        return []
+    scan_ids = {b.scan_id for b in running}
+    rows = await session.execute(
+        select(
+            models.Batch.scan_id, models.Batch.stage, models.Batch.status,
+            models.Batch.started_at, models.Batch.finished_at, models.Batch.target_count,
+        ).where(
+            models.Batch.scan_id.in_(scan_ids),
+            models.Batch.status.in_(("queued", "running", "completed")),
+        )
+    )
+    per_host: Dict[Tuple[int, str], List[float]] = {}
+    busy: Dict[int, int] = {}
+    for scan_id, stage, status, started, finished, count in rows:
+        if status != "completed":
+            busy[scan_id] = busy.get(scan_id, 0) + 1
+        elif started is not None and finished is not None and count:
+            per_host.setdefault((scan_id, stage), []).append((finished - started).total_seconds() / count)
+    limits = dict((await session.execute(
+        select(models.Scan.id, models.Scan.params_json).where(models.Scan.id.in_(scan_ids))
+    )).all())
+
+    stragglers = []
+    for batch in running:
+        samples = per_host.get((batch.scan_id, batch.stage), [])
+        limit = (limits.get(batch.scan_id) or {}).get("concurrency")
+        if len(samples) < min_samples or (limit and busy.get(batch.scan_id, 0) >= limit):
+            continue
+        elapsed = (now - batch.started_at).total_seconds()
+        if elapsed >= min_seconds and elapsed > factor * statistics.median(samples) * batch.target_count:
+            stragglers.append(batch.id)
+    return stragglers
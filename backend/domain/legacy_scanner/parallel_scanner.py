@@ -1,6 +1,8 @@
 import multiprocessing
+import threading
+from pathlib import Path
 from .nmap_scanner import run_nmap_scan
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple
 # We might need to wrap run_nmap_scan or pass arguments carefully for starmap
 # For now, let's assume we'll adapt the call within scan_chunks_parallel
 
@@ -58,6 +60,55 @@ def scan_chunks_parallel(ip_chunks: List[List[str]], nmap_options: str, num_proc
 
     return results
 
+# (batch_id, targets, xml_path) for one chunk of iter_chunks_parallel
+ChunkJob = Tuple[int, List[str], str]
+
+
+def scan_chunk_to_xml(job: ChunkJob, nmap_options: str) -> Dict:
+    """Scan one chunk in a pool process and write nmap's XML to the job's path.
+
+    Only a small status dict travels back to the parent: ``batch_id``, plus
+    ``error``/``details`` when the scan failed. The hosts are read from the
+    XML file, like the asyncio runner's.
+    """
+    batch_id, targets, xml_path = job
+    result = run_nmap_scan(targets, nmap_options)
+    status = {"batch_id": batch_id}
+    xml = result.get("nmap_output")
+    if xml:
+        Path(xml_path).write_text(xml if isinstance(xml, str) else xml.decode("utf-8", "replace"))
+    if "error" in result and not (result.get("status") == "completed" or xml):
+        status["error"] = result["error"]
+        status["details"] = result.get("details")
+    return status
+
+
+def _scan_job(args: Tuple[ChunkJob, str]) -> Dict:
+    return scan_chunk_to_xml(*args)
+
+
+def iter_chunks_parallel(
+    jobs: Sequence[ChunkJob],
+    nmap_options: str,
+    num_processes: Optional[int] = None,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[Dict]:
+    """Like ``scan_chunks_parallel``, but yield each chunk's status as it finishes.
+
+    Uses ``imap_unordered``, so a slow chunk does not hold back the others,
+    and nothing is accumulated. Setting ``stop`` ends the iteration after the
+    current chunk and terminates the pool's processes.
+    """
+    if not jobs:
+        return
+    num_processes = max(1, min(num_processes or multiprocessing.cpu_count(), len(jobs)))
+    with multiprocessing.Pool(processes=num_processes) as pool:
+        for status in pool.imap_unordered(_scan_job, [(job, nmap_options) for job in jobs]):
+            yield status
+            if stop is not None and stop.is_set():
+                return
+
+
 if __name__ == '__main__':
     # Example Usage (for testing this module directly)
     # This requires src.ip_handler to be accessible and an example IP file
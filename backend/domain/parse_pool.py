@@ -0,0 +1,63 @@
+from __future__ import annotations
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Union
+from ..app.settings import settings
+from .xml_parser import HostChunk, HostRecord, read_nmap_host_chunk
+
+
+class ParsePool:
+    """Parse nmap XML in worker processes so the event loop never blocks on it.
+
+    ``chunks()`` yields plain ``HostRecord`` objects (picklable, no ORM
+    state) for the caller to insert, at most ``chunk_hosts`` ``<host>``
+    elements per list, so memory stays bounded on both sides however large
+    the file is. The processes start on first use and
+    use the ``spawn`` start method, which is safe next to the event loop's
+    threads. With ``workers=0`` parsing runs in the loop's default thread
+    executor instead.
+    """
+
+    def __init__(self, workers: int | None = None, chunk_hosts: int | None = None) -> None:
+        self.workers = settings.parse_workers if workers is None else workers
+        self.chunk_hosts = chunk_hosts or settings.parse_chunk_hosts
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def chunks(
+        self, xml_path: Union[str, Path], up_only: bool = True, with_ports: bool = False
+    ) -> AsyncIterator[HostChunk]:
+        """The hosts in ``xml_path`` with their open ports, parsed off the loop one chunk at a time.
+
+        With ``with_ports`` the workers drop hosts without open ports before
+        sending the records back; ``seen`` still counts them. Empty chunks
+        are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        offset: Optional[int] = 0
+        while offset is not None:
+            chunk, offset = await loop.run_in_executor(
+                self._pool(), read_nmap_host_chunk, str(xml_path), offset, self.chunk_hosts, up_only, with_ports,
+            )
+            if chunk.seen:
+                yield chunk
+
+    async def hosts(self, xml_path: Union[str, Path], up_only: bool = True, with_ports: bool = False) -> List[HostRecord]:
+        """All of ``chunks()`` as one list, for callers that need every host at once."""
+        return [record async for chunk in self.chunks(xml_path, up_only, with_ports) for record in chunk.records]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+PARSER = ParsePool()
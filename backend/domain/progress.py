@@ -0,0 +1,108 @@
+from __future__ import annotations
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..infra import models
+
+# nmap --stats-every prints, for example:
+#   Stats: 0:01:05 elapsed; 12 hosts completed (3 up), 4 undergoing SYN Stealth Scan
+#   SYN Stealth Scan Timing: About 45.10% done; ETC: 12:34 (0:00:46 remaining)
+STATS = re.compile(r"Stats: (\d+):(\d\d):(\d\d) elapsed; (\d+) hosts? completed \((\d+) up\), (\d+) undergoing (.+)")
+TIMING = re.compile(r"(.+?) Timing: About ([\d.]+)% done(?:; ETC: [\d:]+ \((\d+):(\d\d):(\d\d) remaining\))?")
+
+# batches whose targets count as done for a scan's progress
+DONE_STATUSES = ("completed", "failed", "split")
+
+
+def _seconds(h: str, m: str, s: str) -> int:
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+@dataclass(slots=True)
+class BatchProgress:
+    """What nmap's statistics lines said about one running batch."""
+
+    target_count: int
+    phase: Optional[str] = None
+    phase_percent: float = 0.0
+    phase_remaining: Optional[int] = None
+    elapsed: int = 0
+    hosts_completed: int = 0
+    hosts_up: int = 0
+    undergoing: int = 0
+
+    def feed(self, line: str) -> bool:
+        """Take one stdout line; ``True`` when it was a progress line."""
+        if not line.startswith("Stats: ") and " Timing: " not in line:
+            return False
+        if m := STATS.match(line):
+            self.elapsed = _seconds(*m.group(1, 2, 3))
+            self.hosts_completed, self.hosts_up, self.undergoing = int(m[4]), int(m[5]), int(m[6])
+            if m[7] != self.phase:
+                self.phase, self.phase_percent, self.phase_remaining = m[7], 0.0, None
+            return True
+        if m := TIMING.match(line):
+            self.phase = m[1].strip()
+            self.phase_percent = float(m[2])
+            self.phase_remaining = _seconds(*m.group(3, 4, 5)) if m[3] else None
+            return True
+        return False
+
+    @property
+    def fraction(self) -> float:
+        """Share of the batch's targets done: finished hosts plus the current phase's part of the rest."""
+        if not self.target_count:
+            return 0.0
+        done = self.hosts_completed + self.undergoing * self.phase_percent / 100
+        return min(done / self.target_count, 1.0)
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        del data["target_count"]
+        fraction = self.fraction
+        data["percent"] = round(fraction * 100, 2)
+        data["eta_seconds"] = round(self.elapsed * (1 - fraction) / fraction) if fraction and self.elapsed else None
+        data["updated_at"] = datetime.utcnow().isoformat()
+        return data
+
+
+async def scan_progress(session: AsyncSession, scan_id: int) -> Optional[dict]:
+    """Progress of a whole scan, weighted by each batch's ``target_count``.
+
+    Finished batches count fully and running ones by their last reported
+    ``percent``; cancelled ones are left out. Adaptive scans also count the
+    targets not cut into batches yet. ``None`` for an unknown scan.
+    """
+    scan = await session.get(models.Scan, scan_id)
+    if scan is None:
+        return None
+    rows = (await session.execute(
+        select(models.Batch.id, models.Batch.status, models.Batch.target_count, models.Batch.progress)
+        .where(models.Batch.scan_id == scan_id, models.Batch.status != "cancelled")
+    )).all()
+    total = done = 0.0
+    running = []
+    for batch_id, status, count, progress in rows:
+        total += count
+        if status in DONE_STATUSES:
+            done += count
+        elif status == "running":
+            done += count * (progress or {}).get("percent", 0.0) / 100
+            running.append({"batch_id": batch_id, "target_count": count, "progress": progress})
+    adaptive = (scan.params_json or {}).get("adaptive")
+    if adaptive and scan.target_cursor is not None:
+        total += adaptive["total"] - scan.target_cursor
+    fraction = done / total if total else (1.0 if scan.status == "completed" else 0.0)
+    elapsed = ((scan.finished_at or datetime.utcnow()) - scan.started_at).total_seconds()
+    return {
+        "scan_id": scan_id,
+        "status": scan.status,
+        "targets": int(total),
+        "targets_done": round(done, 2),
+        "percent": round(fraction * 100, 2),
+        "eta_seconds": round(elapsed * (1 - fraction) / fraction) if 0 < fraction < 1 and scan.status == "running" else None,
+        "running": running,
+    }
@@ -0,0 +1,154 @@
+from __future__ import annotations
+import ipaddress
+import math
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..app.settings import settings
+from ..infra import models
+
+# The packet-rate budget (NSO_RATE_BUDGET, packets/s) is divided between
+# running batches when they are claimed: each gets a ``--max-rate`` stored in
+# ``args_json["rate"]``. nmap cannot change the rate of a running process, so
+# rebalancing happens at batch boundaries: a finished batch frees its share
+# for the next claim. Subnet caps (NSO_RATE_SUBNET_CAPS) bound what all
+# batches touching that subnet may send together.
+
+# final line of ``nmap -v``: "Raw packets sent: 2004 (88.152KB) | Rcvd: ..."
+RAW_PACKETS = re.compile(r"Raw packets sent: (\d+)")
+
+# (max_rate, subnets) of a running batch
+Allocation = Tuple[float, Sequence[str]]
+
+
+def user_max_rate(flags: Sequence[str]) -> Optional[float]:
+    """The ``--max-rate`` already in ``flags``, if any."""
+    for i, flag in enumerate(flags):
+        value = None
+        if flag.startswith("--max-rate="):
+            value = flag.partition("=")[2]
+        elif flag == "--max-rate" and i + 1 < len(flags):
+            value = flags[i + 1]
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def without_max_rate(flags: Sequence[str]) -> List[str]:
+    """``flags`` minus any ``--max-rate`` option."""
+    out: List[str] = []
+    skip = False
+    for flag in flags:
+        if skip:
+            skip = False
+        elif flag == "--max-rate":
+            skip = True
+        elif not flag.startswith("--max-rate="):
+            out.append(flag)
+    return out
+
+
+def touched_subnets(targets: Iterable[str], caps: Mapping[str, float]) -> List[str]:
+    """The keys of ``caps`` whose network contains one of ``targets``.
+
+    Hostname targets are not resolved and match no subnet.
+    """
+    networks = {key: ipaddress.ip_network(key, strict=False) for key in caps}
+    touched = set()
+    for target in targets:
+        try:
+            address = ipaddress.ip_address(target)
+        except ValueError:
+            continue
+        for key, network in networks.items():
+            if key not in touched and address in network:
+                touched.add(key)
+        if len(touched) == len(networks):
+            break
+    return sorted(touched)
+
+
+def allocate(
+    budget: float,
+    slots: int,
+    others: Sequence[Allocation],
+    subnets: Sequence[str] = (),
+    caps: Mapping[str, float] | None = None,
+    floor: float = 0.0,
+) -> float:
+    """Packets/s for one more batch next to the ``others`` already running.
+
+    The fair share is ``budget`` over the larger of ``slots`` and the number
+    of running batches, so the first batches of a busy queue do not take the
+    whole budget; it is then cut to what ``others`` left free. Each touched
+    subnet applies the same rule to its cap and the batches sharing it.
+    ``budget`` may be ``math.inf`` (subnet caps only). Never below ``floor``.
+    """
+    caps = caps or {}
+    running = len(others) + 1
+    rate = min(budget / max(slots, running), budget - sum(r for r, _ in others))
+    for net in subnets:
+        sharing = [r for r, nets in others if net in nets]
+        cap = caps[net]
+        rate = min(rate, cap / (len(sharing) + 1), cap - sum(sharing))
+    return max(rate, floor)
+
+
+async def running_allocations(session: AsyncSession, exclude: Optional[int] = None) -> Dict[int, dict]:
+    """``{batch_id: args_json["rate"]}`` of running batches holding a rate."""
+    rows = await session.execute(
+        select(models.Batch.id, models.Batch.args_json).where(models.Batch.status == "running")
+    )
+    return {
+        batch_id: args["rate"]
+        for batch_id, args in rows
+        if batch_id != exclude and (args or {}).get("rate", {}).get("max_rate")
+    }
+
+
+async def allocate_rate(session: AsyncSession, batch: models.Batch, flags: Sequence[str], slots: int) -> Optional[float]:
+    """Give the just-claimed ``batch`` its ``--max-rate`` and store it in ``args_json["rate"]``.
+
+    ``flags`` are the batch's own nmap flags: a lower ``--max-rate`` there
+    wins. Returns the rate, or ``None`` when no budget or cap applies.
+    """
+    caps = settings.rate_subnet_caps
+    subnets = touched_subnets(batch.args_json["targets"], caps) if caps else []
+    if not settings.rate_budget and not subnets:
+        if "rate" in batch.args_json:
+            # left over from an earlier claim of this (re-queued) batch
+            await _store(session, batch, {k: v for k, v in batch.args_json.items() if k != "rate"})
+        return None
+    others = [(r["max_rate"], r.get("subnets", [])) for r in (await running_allocations(session, batch.id)).values()]
+    rate = allocate(settings.rate_budget or math.inf, slots, others, subnets, caps, settings.rate_min)
+    own = user_max_rate(flags)
+    if own is not None:
+        rate = min(rate, own)
+    args = {**batch.args_json, "rate": {"max_rate": round(rate, 1), "subnets": subnets}}
+    await _store(session, batch, args)
+    return args["rate"]["max_rate"]
+
+
+async def _store(session: AsyncSession, batch: models.Batch, args: dict) -> None:
+    await session.execute(update(models.Batch).where(models.Batch.id == batch.id).values(args_json=args))
+    await session.commit()
+    batch.args_json = args
+
+
+async def rate_state(session: AsyncSession) -> dict:
+    """Budget, caps and the rates allocated to running batches, for monitoring."""
+    allocations = await running_allocations(session)
+    subnets = {
+        net: {"cap": cap, "allocated": round(sum(r["max_rate"] for r in allocations.values() if net in r.get("subnets", [])), 1)}
+        for net, cap in settings.rate_subnet_caps.items()
+    }
+    return {
+        "budget": settings.rate_budget,
+        "allocated": round(sum(r["max_rate"] for r in allocations.values()), 1),
+        "subnets": subnets,
+        "batches": [{"batch_id": batch_id, **r} for batch_id, r in sorted(allocations.items())],
+    }
@@ -0,0 +1,116 @@
+from __future__ import annotations
+import hashlib
+import ipaddress
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from ..infra import models
+from ..infra.bulk import bulk_insert_hosts
+from .target_expander import TargetSet
+from .xml_parser import HostRecord, PortRecord
+
+# The result cache remembers, per project and flags, when each address was
+# last scanned and which Host row (if any) holds the result. start_scan()
+# skips addresses with a fresh entry and copies their rows into the new scan.
+
+
+def flags_key(flags: Sequence[str]) -> str:
+    """Order-independent key for ``flags``: options keep their values, then sort.
+
+    ``["-T4", "-p", "80"]`` and ``["-p 80", "-T4"]`` give the same key. The
+    key is the sha256 hex digest of the sorted options, so it has a fixed
+    length however long a ``-p`` list gets.
+    """
+    units: list[str] = []
+    for token in " ".join(flags).split():
+        if units and not token.startswith("-") and units[-1].startswith("-") and " " not in units[-1]:
+            units[-1] += " " + token
+        else:
+            units.append(token)
+    return hashlib.sha256(" ".join(sorted(units)).encode()).hexdigest()
+
+
+def _is_ip(address: str) -> bool:
+    try:
+        ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return True
+
+
+async def cached_results(
+    session: AsyncSession, project_id: int, key: str, targets: TargetSet, max_age: float
+) -> Dict[str, Optional[int]]:
+    """Fresh entries for addresses in ``targets``: ``{address: host_id}``.
+
+    One range scan of ``ix_result_cache_fresh``; membership is checked
+    against the target ranges, so the cost follows the number of cached
+    entries, not the size of ``targets``.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    rows = await session.execute(
+        select(models.CachedResult.addr_key, models.CachedResult.host_id).where(
+            models.CachedResult.project_id == project_id,
+            models.CachedResult.flags_key == key,
+            models.CachedResult.scanned_at >= cutoff,
+        )
+    )
+    return {address: host_id for address, host_id in rows if address in targets}
+
+
+async def reuse_results(session: AsyncSession, scan_id: int, host_ids: Iterable[Optional[int]], batch_size: int = 1000) -> int:
+    """Copy the cached ``Host`` rows (and their ports) into ``scan_id``.
+
+    Returns the number of hosts copied; the caller commits.
+    """
+    ids = sorted(h for h in host_ids if h is not None)
+    records = []
+    for i in range(0, len(ids), batch_size):
+        hosts = await session.execute(
+            select(models.Host).where(models.Host.id.in_(ids[i:i + batch_size])).options(selectinload(models.Host.ports))
+        )
+        for host in hosts.scalars():
+            records.append(HostRecord(
+                address=host.address,
+                hostname=host.hostname,
+                status=host.status,
+                ports=[
+                    PortRecord(p.port_number, p.protocol, p.state, p.service_name, p.service_product, p.service_version)
+                    for p in host.ports
+                ],
+            ))
+    await bulk_insert_hosts(session, scan_id, records)
+    return len(records)
+
+
+async def store_results(session: AsyncSession, project_id: int, key: str, scan_id: int, addresses: Sequence[str]) -> None:
+    """Record ``addresses`` as just scanned by ``scan_id``, replacing older entries.
+
+    One ``INSERT ... ON CONFLICT DO UPDATE`` on ``ux_result_cache_key``, so
+    concurrent scans of overlapping targets never trip over each other's
+    rows; addresses go in sorted, so they also lock them in the same order.
+    Hostname targets are skipped: nmap reports their IP, so the result could
+    not be matched back. The caller commits.
+    """
+    addresses = sorted(a for a in set(addresses) if _is_ip(a))
+    if not addresses:
+        return
+    hosts = dict((await session.execute(
+        select(models.Host.address, models.Host.id)
+        .where(models.Host.scan_id == scan_id, models.Host.address.in_(addresses))
+    )).all())
+    conn = await session.connection()
+    stmt = (pg_insert if conn.dialect.name == "postgresql" else sqlite_insert)(models.CachedResult)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["project_id", "flags_key", "addr_key"],
+        set_={"scan_id": stmt.excluded.scan_id, "host_id": stmt.excluded.host_id, "scanned_at": stmt.excluded.scanned_at},
+    )
+    now = datetime.utcnow()
+    await session.execute(stmt, [
+        {"project_id": project_id, "flags_key": key, "addr_key": a, "scan_id": scan_id, "host_id": hosts.get(a), "scanned_at": now}
+        for a in addresses
+    ])
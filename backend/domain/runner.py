@@ -1,17 +1,113 @@
 from __future__ import annotations
 import asyncio
+import queue
+import threading
 from pathlib import Path
-from typing import AsyncIterator, Sequence
+from typing import AsyncIterator, List, Optional, Sequence
 
 from ..app.settings import settings
 
+# bytes taken from a pipe per read; nmap's -vv --packet-trace output arrives
+# far faster than line-at-a-time reads keep up with
+READ_CHUNK = 256 * 1024
+# a "line" longer than this without a newline is passed on as it is
+MAX_LINE = 1024 * 1024
+# last line of a run_nmap_batch() stream when nmap failed, followed by the code
+NMAP_EXITED = "[runner] nmap exited with code "
+
+
+class LogWriter:
+    """Append bytes to files from a background thread.
+
+    ``write()`` hands the data to the thread, so the event loop never waits
+    on the disk; the thread writes through large buffers. At most
+    ``max_pending`` chunks wait in between: when the disk falls behind,
+    ``write()`` waits (off the loop) for room, which stops the caller from
+    reading nmap's pipe and so slows nmap down instead of piling its output
+    up in memory. ``close()`` flushes and closes every file.
+    """
+
+    def __init__(self, *paths: Path, buffer_size: int = 1024 * 1024, max_pending: int = 64) -> None:
+        self._files = [path.open("wb", buffering=buffer_size) for path in paths]
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="nmap-log-writer", daemon=True)
+        self._thread.start()
+
+    async def write(self, index: int, data: bytes) -> None:
+        await self._put((index, data))
+
+    async def _put(self, item) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self._put_blocking, item)
+
+    def _put_blocking(self, item) -> None:
+        # gives up if the writer thread died (e.g. disk full) rather than hang
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self) -> None:
+        try:
+            while (item := self._queue.get()) is not None:
+                self._files[item[0]].write(item[1])
+        finally:
+            for f in self._files:
+                f.close()
+
+    async def close(self) -> None:
+        await self._put(None)
+        await asyncio.to_thread(self._thread.join)
+
+
+async def read_line_batches(
+    reader: asyncio.StreamReader, sink: Optional[LogWriter] = None, index: int = 0
+) -> AsyncIterator[List[str]]:
+    """Yield the lines of ``reader`` in batches, one batch per chunk read.
+
+    Every chunk is copied to ``sink`` as is, then decoded once and split on
+    newlines; a trailing partial line waits for the next chunk.
+    """
+    tail = b""
+    while chunk := await reader.read(READ_CHUNK):
+        if sink is not None:
+            await sink.write(index, chunk)
+        data = tail + chunk if tail else chunk
+        cut = data.rfind(b"\n")
+        if cut < 0:
+            tail = data
+            if len(tail) > MAX_LINE:
+                yield [tail.decode(errors="ignore")]
+                tail = b""
+            continue
+        tail = data[cut + 1:]
+        yield data[:cut].decode(errors="ignore").split("\n")
+    if tail:
+        yield [tail.decode(errors="ignore")]
+
+
 async def run_nmap_batch(
     batch_id: int,
     targets: Sequence[str],
     nmap_flags: Sequence[str],
     out_dir: Path | None = None,
     nmap_path: str | None = None,
-) -> AsyncIterator[str]:
+    stats_every: float | None = None,
+) -> AsyncIterator[List[str]]:
+    """Run nmap for one batch, yielding its stdout as batches of lines.
+
+    With ``stats_every`` (seconds) nmap also prints its progress that often
+    (``--stats-every``), unless the flags already ask for it.
+
+    stdout and stderr are read in ``READ_CHUNK`` pieces and logged to
+    ``batch_<id>.stdout.log`` / ``.stderr.log`` by a ``LogWriter``, so
+    nmap never blocks on a full pipe however verbose it is. A non-zero exit
+    ends the stream with ``[runner] nmap exited with code N``.
+    """
     out_dir = out_dir or settings.output_dir
     nmap_path = nmap_path or settings.nmap_path
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -19,7 +115,8 @@ async def run_nmap_batch(
     stdout_path = out_dir / f"batch_{batch_id}.stdout.log"
     stderr_path = out_dir / f"batch_{batch_id}.stderr.log"
 
-    cmd = [nmap_path, *nmap_flags, "-oX", str(xml_path), *targets]
+    extra = ["--stats-every", f"{stats_every:g}s"] if stats_every and "--stats-every" not in nmap_flags else []
+    cmd = [nmap_path, *nmap_flags, *extra, "-oX", str(xml_path), *targets]
 
     proc = await asyncio.create_subprocess_exec(
         *cmd,
@@ -29,32 +126,25 @@ async def run_nmap_batch(
     assert proc.stdout and proc.stderr
 
     try:
-        with stdout_path.open("wb") as out_f, stderr_path.open("wb") as err_f:
-            async def pipe(reader, sink, forward_stdout: bool):
-                while True:
-                    line = await reader.readline()
-                    if not line:
-                        break
-                    sink.write(line)
-                    if forward_stdout:
-                        yield line.decode(errors="ignore").rstrip("\n")
-
-            async def stream_stdout():
-                async for ln in pipe(proc.stdout, out_f, True):
-                    yield ln
-
+        logs = LogWriter(stdout_path, stderr_path)
+        try:
             async def drain_stderr():
-                async for _ in pipe(proc.stderr, err_f, False):
-                    pass
+                while chunk := await proc.stderr.read(READ_CHUNK):
+                    await logs.write(1, chunk)
 
             stderr_task = asyncio.create_task(drain_stderr())
-            async for ln in stream_stdout():
-                yield ln
-            await stderr_task
+            try:
+                async for lines in read_line_batches(proc.stdout, logs, 0):
+                    yield lines
+                await stderr_task
+            finally:
+                stderr_task.cancel()
+        finally:
+            await logs.close()
 
         rc = await proc.wait()
         if rc != 0:
-            yield f"[runner] nmap exited with code {rc}"
+            yield [f"{NMAP_EXITED}{rc}"]
     except asyncio.CancelledError:
         # terminate underlying process on cancellation
         try:
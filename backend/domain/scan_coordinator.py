@@ -1,151 +1,842 @@
 from __future__ import annotations
 import asyncio
+import contextlib
+import logging
+import math
+import re
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Sequence
 from ..app.settings import settings
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, update, func
 from ..infra import models
 from ..infra.ws_hub import ws_manager
-from .runner import run_nmap_batch
+from .runner import NMAP_EXITED, run_nmap_batch
 from .task_registry import TASKS
-from .xml_summary import parse_xml_summary
-from .legacy_scanner.parallel_scanner import scan_chunks_parallel
-from .xml_parser import parse_nmap_xml
+from .legacy_scanner.parallel_scanner import iter_chunks_parallel
+from ..infra.batch_queue import default_owner, requeue_batch
+from ..infra.bulk import bulk_insert_hosts, bulk_update_services, delete_batch_hosts, stored_addresses
+from .xml_parser import HostFollower, HostRecord, iter_nmap_hosts
+from .target_expander import TargetSet, normalize_targets
+from .batch_sizing import BatchSizer, historical_seconds_per_host, observed_seconds_per_host
+from .result_cache import cached_results, flags_key, reuse_results, store_results
+from .parse_pool import PARSER
+from .progress import BatchProgress, scan_progress
+from .rate_budget import RAW_PACKETS, allocate_rate, without_max_rate
 
-# very simple chunker
+log = logging.getLogger(__name__)
+
+# cancel() messages understood by execute_batch:
+#   REQUEUE    - the worker is shutting down; put the batch back in the queue
+#   LEASE_LOST - another worker owns the batch now; leave its row alone
+#   SPLIT      - the batch is a straggler; keep what it finished, re-split the rest
+REQUEUE = "requeue"
+LEASE_LOST = "lease_lost"
+SPLIT = "split"
+
+# batch stages (models.Batch.stage): "discovery" batches feed live hosts
+# into "scan" batches, which feed open ports into "service" batches
+DISCOVERY = "discovery"
+PORT_SCAN = "scan"
+SERVICE = "service"
+DEFAULT_DISCOVERY_FLAGS = ["-sn", "-T4"]
+DEFAULT_SERVICE_FLAGS = ["-sV"]
+# nmap verbosity/debug flags (-v, -vv, -v2, -d ...)
+VERBOSE = re.compile(r"-[vd]+\d?")
+
+# very simple chunker; slices of a TargetSet stay lazy until the caller lists them
 def chunk(seq: Sequence[str], size: int):
-    for i in range(0, len(seq), size):
+    # TargetSet.size, as len() cannot hold an IPv6 range's count
+    total = seq.size if isinstance(seq, TargetSet) else len(seq)
+    for i in range(0, total, size):
         yield seq[i:i+size]
 
+async def ingest_batch_xml(
+    db: AsyncSession,
+    scan_id: int,
+    xml_path: Path,
+    collect: list[HostRecord] | None = None,
+    batch_id: int | None = None,
+) -> dict:
+    """Parse ``xml_path`` once, bulk-inserting hosts with open ports into ``db``.
+
+    Parsing runs in the ``parse_pool`` processes, which send the hosts
+    back in bounded chunks; each chunk is inserted before the next is
+    read. Returns the ``{hosts_up, open_ports}`` summary for the batch; the
+    records with open ports are also appended to ``collect`` when given.
+    With ``batch_id``, hosts already stored for that batch while it ran are
+    not inserted again. The caller commits.
+    """
+    stored = await stored_addresses(db, batch_id) if batch_id is not None else ()
+    summary = {"hosts_up": 0, "open_ports": 0}
+    async for part in PARSER.chunks(xml_path, with_ports=True):
+        summary["hosts_up"] += part.seen
+        summary["open_ports"] += sum(len(record.ports) for record in part.records)
+        if collect is not None:
+            collect.extend(part.records)
+        await bulk_insert_hosts(db, scan_id, [r for r in part.records if r.address not in stored], batch_id=batch_id)
+    return summary
+
+def queue_live_hosts(db: AsyncSession, scan_id: int, live: list[str], chunk_size: int) -> dict:
+    """Queue port-scan batches for the hosts a discovery batch found up.
+
+    Returns the ``{hosts_up, open_ports, queued_batches}`` summary. The caller
+    commits, together with the discovery batch's completion.
+    """
+    batches = 0
+    for part in chunk(live, chunk_size):
+        db.add(models.Batch(
+            scan_id=scan_id, status="queued", stage=PORT_SCAN, target_count=len(part), args_json={"targets": part},
+        ))
+        batches += 1
+    return {"hosts_up": len(live), "open_ports": 0, "queued_batches": batches}
+
+def queue_service_batches(db: AsyncSession, scan_id: int, records: list[HostRecord], chunk_size: int) -> int:
+    """Queue version-detection batches for the open ports of ``records``.
+
+    Hosts with the same open ports (per protocol) share one batch, which
+    passes exactly those ports with ``-p``. Returns the number of batches;
+    the caller commits.
+    """
+    groups: dict[tuple[str, tuple[int, ...]], list[str]] = {}
+    for record in records:
+        by_protocol: dict[str, set[int]] = {}
+        for port in record.ports:
+            by_protocol.setdefault(port.protocol, set()).add(port.port_number)
+        for protocol, ports in by_protocol.items():
+            groups.setdefault((protocol, tuple(sorted(ports))), []).append(record.address)
+    batches = 0
+    for (protocol, ports), addresses in sorted(groups.items()):
+        for part in chunk(addresses, chunk_size):
+            db.add(models.Batch(
+                scan_id=scan_id, status="queued", stage=SERVICE, target_count=len(part),
+                args_json={"targets": part, "protocol": protocol, "ports": ",".join(map(str, ports))},
+            ))
+            batches += 1
+    return batches
+
+def _stage_flags(params: dict, batch: models.Batch, with_rate: bool = True) -> list[str]:
+    """nmap flags for ``batch``, depending on its stage.
+
+    With an allocated packet rate (``rate_budget``) that rate replaces any
+    ``--max-rate`` in the flags, and ``-v`` is added so nmap reports the
+    packets it sent.
+    """
+    pipeline = params.get("pipeline")
+    args = batch.args_json
+    if batch.stage == DISCOVERY and pipeline:
+        flags = pipeline["discovery_flags"]
+    elif batch.stage == SERVICE:
+        extra = ["-sU"] if args["protocol"] == "udp" else []
+        flags = [*params["services"]["flags"], *extra, "-Pn", "-p", args["ports"]]
+    else:
+        flags = params.get("flags", [])
+        if pipeline and "-Pn" not in flags:
+            # discovery already proved these hosts up
+            flags = [*flags, "-Pn"]
+    if args.get("host_timeout"):
+        # pieces of a split straggler
+        flags = [*flags, "--host-timeout", f"{args['host_timeout']:g}s"]
+    if with_rate and args.get("rate"):
+        flags = [*without_max_rate(flags), "--max-rate", f"{args['rate']['max_rate']:g}"]
+        if not any(VERBOSE.fullmatch(f) for f in flags):
+            flags.append("-v")
+    return flags
+
+async def stage_progress(db: AsyncSession, scan_id: int) -> dict:
+    """Per-stage batch and target counts of a scan, as sent in ``stage_progress`` events."""
+    rows = await db.execute(
+        select(models.Batch.stage, models.Batch.status, func.count(), func.sum(models.Batch.target_count))
+        .where(models.Batch.scan_id == scan_id)
+        .group_by(models.Batch.stage, models.Batch.status)
+    )
+    stages: dict[str, dict] = {}
+    for stage, status, batches, targets in rows:
+        entry = stages.setdefault(stage, {"batches": 0, "batches_done": 0, "targets": 0, "targets_done": 0})
+        entry["batches"] += batches
+        entry["targets"] += targets or 0
+        if status in ("completed", "failed", "cancelled", "split"):
+            entry["batches_done"] += batches
+            entry["targets_done"] += targets or 0
+    return stages
+
 async def start_scan(
     db: AsyncSession,
     project_id: int,
     nmap_flags: list[str],
-    targets: list[str],
+    targets: list[str] | TargetSet,
     runner: str = "asyncio",
     chunk_size: int = 256,
     concurrency: int = 6,
     out_dir: Path | None = None,
+    session_factory: async_sessionmaker[AsyncSession] | None = None,
+    batch_seconds: float | None = None,
+    discovery_flags: list[str] | None = None,
+    discovery_chunk_size: int = 4096,
+    service_flags: list[str] | None = None,
+    cache_max_age: float | None = None,
+    priority: int = 0,
 ):
-    """Kick off a scan and stream progress via the WebSocket manager."""
-    out_dir = out_dir or settings.output_dir
+    """Record a scan and its batches, then return the new ``scan_id`` at once.
+
+    asyncio batches are written as ``queued`` and picked up by the worker pool
+    (``scan_worker.WORKERS``), so the scan survives the request and process
+    restarts. The legacy runner still runs in a background task, using its own
+    sessions from ``session_factory`` (bound to ``db``'s engine by default).
+
+    Plain ``targets`` are normalized first (``normalize_targets``: merged,
+    deduplicated, sorted) and the report is kept in ``params_json["targets"]``.
+    The set is expanded lazily: each batch gets ``chunk_size`` addresses, and
+    only one batch's strings exist at a time.
+
+    With ``batch_seconds`` (asyncio runner only) batches are cut adaptively
+    instead: only ``concurrency + 1`` exist at a time and ``refill_scan`` sizes
+    the next ones so each runs for about ``batch_seconds``.
+
+    With ``discovery_flags`` (asyncio runner only) the scan is a two-stage
+    pipeline: ``discovery`` batches of ``discovery_chunk_size`` targets run
+    the cheap probe, and each one queues ``scan`` batches of ``chunk_size``
+    for the hosts it found up (``queue_live_hosts``), so port scanning starts
+    while discovery is still going. ``batch_seconds`` does not apply.
+
+    With ``service_flags`` (asyncio runner only) every completed ``scan``
+    batch queues ``service`` batches running those flags against exactly
+    the open ports it found (``queue_service_batches``); their results fill
+    in the existing ``Port`` rows.
+
+    Single-stage asyncio scans use the result cache (``result_cache``):
+    targets scanned with the same flags in this project within
+    ``cache_max_age`` seconds (default: the project's ``cache_max_age``) are
+    not batched; their stored hosts and ports are copied into the new scan
+    and ``params_json["cache"]["served"]`` counts them. Without a max-age
+    (unset or ``0``) the scan neither reads nor writes the cache.
+
+    ``priority`` orders this scan against the project's other scans when
+    workers are scarce (higher first); fairness between projects comes first
+    (see ``infra.batch_queue.pick_scan``).
+    """
+    session_factory = session_factory or async_sessionmaker(db.bind, expire_on_commit=False, class_=AsyncSession)
 
-    scan = models.Scan(project_id=project_id, params_json={"flags": nmap_flags}, status="running")
+    if not isinstance(targets, TargetSet):
+        targets = normalize_targets(targets)
+    params = {"flags": nmap_flags, "runner": runner, "concurrency": concurrency, "priority": priority}
+    if out_dir is not None:
+        params["out_dir"] = str(out_dir)
+    if targets.report is not None:
+        params["targets"] = targets.report
+    pipeline = discovery_flags is not None and runner == "asyncio"
+    if pipeline:
+        params["pipeline"] = {"discovery_flags": discovery_flags, "chunk_size": chunk_size}
+    if service_flags is not None and runner == "asyncio":
+        params["services"] = {"flags": service_flags, "chunk_size": chunk_size}
+    key = flags_key(nmap_flags)
+    hits: dict[str, int | None] = {}
+    if runner == "asyncio" and not pipeline and service_flags is None:
+        if cache_max_age is None:
+            project = await db.get(models.Project, project_id)
+            cache_max_age = project.cache_max_age if project is not None else None
+        if cache_max_age:
+            hits = await cached_results(db, project_id, key, targets, cache_max_age)
+            if hits:
+                targets = targets.without(hits)
+            params["cache"] = {"project_id": project_id, "flags_key": key, "max_age": cache_max_age, "served": len(hits)}
+    adaptive = batch_seconds is not None and runner == "asyncio" and not pipeline
+    if adaptive:
+        params["adaptive"] = {
+            "seconds": batch_seconds,
+            # first guess until batches of this scan finish: other scans with the same flags
+            "seconds_per_host": await historical_seconds_per_host(db, nmap_flags),
+            "fallback_size": chunk_size,
+            "total": targets.size,
+            "ranges": targets.to_json(),
+        }
+    scan = models.Scan(
+        project_id=project_id, params_json=params, flags_key=key, status="running", target_cursor=0 if adaptive else None,
+    )
     db.add(scan)
     await db.flush()  # obtain scan.id
+    if hits:
+        await reuse_results(db, scan.id, hits.values())
+
+    if adaptive:
+        await db.commit()
+        if not await refill_scan(session_factory, scan.id):
+            await finalize_scan(session_factory, scan.id)
+        return scan.id
 
+    # queued batches are runnable by the worker pool; legacy ones are not,
+    # and carry this process as owner so recovery can tell when it died
+    status, owner = ("queued", None) if runner == "asyncio" else ("pending", default_owner("legacy"))
+    stage, size = (DISCOVERY, discovery_chunk_size) if pipeline else (PORT_SCAN, chunk_size)
     batches: list[models.Batch] = []
-    for t in chunk(targets, chunk_size):
-        b = models.Batch(scan_id=scan.id, status="queued", target_count=len(t), args_json={"targets": t})
+    for part in chunk(targets, size):
+        t = list(part)
+        b = models.Batch(
+            scan_id=scan.id, status=status, stage=stage, target_count=len(t), args_json={"targets": t}, lease_owner=owner,
+        )
         db.add(b); batches.append(b)
     await db.commit()
 
-    if runner == "asyncio":
-        sem = asyncio.Semaphore(concurrency)
-
-        async def run_one(b: models.Batch):
-            async with sem:
-                await db.execute(
-                    update(models.Batch)
-                    .where(models.Batch.id == b.id)
-                    .values(status="running", started_at=datetime.utcnow())
-                )
-                await db.commit()
-                await ws_manager.broadcast(scan.id, {"event": "batch_start", "batch_id": b.id, "targets": b.args_json["targets"]})
-
-                xml_path = Path(out_dir) / f"batch_{b.id}.xml"
-                stdout_path = Path(out_dir) / f"batch_{b.id}.stdout.log"
-                stderr_path = Path(out_dir) / f"batch_{b.id}.stderr.log"
-
-                async for line in run_nmap_batch(b.id, b.args_json["targets"], nmap_flags, out_dir=out_dir):
-                    await ws_manager.broadcast(scan.id, {"event": "line", "batch_id": b.id, "line": line})
-
-                # upsert raw result row
-                rr = models.ResultRaw(batch_id=b.id, xml_path=str(xml_path), stdout_path=str(stdout_path), stderr_path=str(stderr_path))
-                db.add(rr)
-                await db.execute(
-                    update(models.Batch)
-                    .where(models.Batch.id == b.id)
-                    .values(status="completed", finished_at=datetime.utcnow())
-                )
-                await db.commit()
-
-                # quick summary for demo
-                summary = parse_xml_summary(xml_path)
-                await ws_manager.broadcast(scan.id, {"event": "batch_complete", "batch_id": b.id, "summary": summary})
-
-                # --- START of new code ---
-            if xml_path.exists():
-                xml_content = xml_path.read_text()
-                if xml_content:
-                    hosts = parse_nmap_xml(xml_content)
-                    for host in hosts:
-                        host.scan_id = scan.id
-                        db.add(host)
-                    await db.commit()
-            # --- END of new code ---
-
-            # quick summary for demo
-            summary = parse_xml_summary(xml_path)
-            await ws_manager.broadcast(scan.id, {"event": "batch_complete", "batch_id": b.id, "summary": summary})
-
-        tasks = []
+    if not batches:
+        await finalize_scan(session_factory, scan.id)
+    elif runner != "asyncio":
+        task = asyncio.create_task(_run_legacy(session_factory, scan.id, batches, nmap_flags, concurrency))
         for b in batches:
-            t = asyncio.create_task(run_one(b))
-            TASKS.add(scan.id, b.id, t)
-            tasks.append(t)
+            TASKS.add(scan.id, b.id, task)
 
-        await asyncio.gather(*tasks, return_exceptions=True)
-    else: # legacy runner
-        loop = asyncio.get_running_loop()
+    return scan.id
 
-        # The legacy runner does not provide per-batch updates, so we update all at once
-        for b in batches:
-            await db.execute(
-                update(models.Batch)
-                .where(models.Batch.id == b.id)
-                .values(status="running", started_at=datetime.utcnow())
+async def execute_batch(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch) -> bool:
+    """Run a claimed (``running``) batch: nmap, result ingestion, completion.
+
+    Cancellation marks the batch ``cancelled`` and errors mark it ``failed``
+    (returning ``False``); so does a non-zero nmap exit, whose partial XML
+    is not ingested. Either way the scan is finalized once no batch is left
+    to run.
+    """
+    scan_id = batch.scan_id
+    targets = batch.args_json["targets"]
+    async with session_factory() as session:
+        params = (await session.get(models.Scan, scan_id)).params_json or {}
+    staged = bool(params.get("pipeline") or params.get("services"))
+    nmap_flags = _stage_flags(params, batch)
+    out_dir = Path(params.get("out_dir") or settings.output_dir)
+
+    xml_path = out_dir / f"batch_{batch.id}.xml"
+    stdout_path = out_dir / f"batch_{batch.id}.stdout.log"
+    stderr_path = out_dir / f"batch_{batch.id}.stderr.log"
+
+    rate = batch.args_json.get("rate")
+    try:
+        start = {"event": "batch_start", "batch_id": batch.id, "stage": batch.stage, "targets": targets}
+        if rate:
+            start["max_rate"] = rate["max_rate"]
+        await ws_manager.broadcast(scan_id, start)
+
+        sent = None
+        began = time.monotonic()
+        progress = BatchProgress(len(targets)) if settings.stats_every else None
+        live = HostFollower(xml_path) if batch.stage == PORT_SCAN and settings.live_hosts_interval else None
+        if live is not None and batch.attempts > 1:
+            # hosts an earlier, interrupted run of this batch stored
+            async with session_factory() as session:
+                await delete_batch_hosts(session, batch.id)
+                await session.commit()
+        follower = asyncio.create_task(_follow_hosts(session_factory, batch, live)) if live is not None else None
+        exited = None
+        try:
+            async for lines in run_nmap_batch(batch.id, targets, nmap_flags, out_dir=out_dir, stats_every=settings.stats_every):
+                await ws_manager.publish_lines(scan_id, batch.id, lines)
+                if lines and lines[-1].startswith(NMAP_EXITED):
+                    exited = lines[-1]
+                reported = False
+                for line in lines if rate or progress is not None else ():
+                    if progress is not None and progress.feed(line):
+                        reported = True
+                    elif rate and (m := RAW_PACKETS.search(line)):
+                        sent = int(m.group(1))
+                if reported:
+                    await _report_progress(session_factory, batch, progress)
+        finally:
+            if follower is not None:
+                follower.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await follower
+        if exited is not None:
+            # results (and cache entries) of a failed or killed run would pass
+            # its missing hosts off as down
+            raise RuntimeError(exited.removeprefix("[runner] "))
+        if live is not None and not live.failed:
+            # hosts completed since the follower's last read
+            await _poll_live_hosts(session_factory, batch, live)
+        done = {"status": "completed", "finished_at": datetime.utcnow(), "lease_expires_at": None}
+        if rate:
+            # what nmap really sent, next to what it was allowed
+            elapsed = time.monotonic() - began
+            rate = {**rate, "actual_rate": round(sent / elapsed, 1) if sent is not None and elapsed > 0 else None}
+            done["args_json"] = {**batch.args_json, "rate": rate}
+
+        async with session_factory() as session:
+            summary = await _ingest_results(session, params, batch, xml_path, targets)
+            session.add(models.ResultRaw(batch_id=batch.id, xml_path=str(xml_path), stdout_path=str(stdout_path), stderr_path=str(stderr_path)))
+            result = await session.execute(_owned(batch).values(**done))
+            if result.rowcount != 1:
+                # lease expired and the batch was re-queued or stopped: drop our results
+                await session.rollback()
+                return False
+            await session.commit()
+        complete = {"event": "batch_complete", "batch_id": batch.id, "summary": summary}
+        if rate:
+            complete["rate"] = rate
+        await ws_manager.broadcast(scan_id, complete)
+        if staged:
+            await _broadcast_progress(session_factory, scan_id)
+    except asyncio.CancelledError as e:
+        reason = e.args[0] if e.args else None
+        if reason == REQUEUE:
+            async with session_factory() as session:
+                await requeue_batch(session, batch.id, batch.lease_owner)
+        elif reason == SPLIT:
+            await split_batch(session_factory, batch)
+            await finalize_scan(session_factory, scan_id)
+        elif reason != LEASE_LOST:
+            await _set_batch_status(session_factory, batch, "cancelled")
+            await finalize_scan(session_factory, scan_id)
+        raise
+    except Exception as e:
+        await _set_batch_status(session_factory, batch, "failed")
+        await ws_manager.broadcast(scan_id, {"event": "batch_failed", "batch_id": batch.id, "error": str(e)})
+        if staged:
+            await _broadcast_progress(session_factory, scan_id)
+        await finalize_scan(session_factory, scan_id)
+        return False
+
+    await finalize_scan(session_factory, scan_id)
+    return True
+
+async def _report_progress(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch, progress: BatchProgress) -> None:
+    """Store ``batch``'s latest progress and send it with the scan's aggregate."""
+    data = progress.as_dict()
+    async with session_factory() as session:
+        await session.execute(_owned(batch).values(progress=data))
+        await session.commit()
+        scan = await scan_progress(session, batch.scan_id)
+    await ws_manager.broadcast(batch.scan_id, {
+        "event": "progress", "scan_id": batch.scan_id, "batch_id": batch.id, **data,
+        "scan": {"percent": scan["percent"], "eta_seconds": scan["eta_seconds"]},
+    })
+
+async def _follow_hosts(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch, live: HostFollower) -> None:
+    """Store the hosts of ``batch``'s growing XML every ``NSO_LIVE_HOSTS_INTERVAL`` seconds."""
+    while not live.failed:
+        await asyncio.sleep(settings.live_hosts_interval)
+        await _poll_live_hosts(session_factory, batch, live)
+
+async def _poll_live_hosts(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch, live: HostFollower) -> None:
+    """Read what ``live`` has gained and store it.
+
+    The live preview never fails the batch: on any error it stops following
+    and the final ingestion stores the rest. Cancelling the caller leaves
+    the thread running; the next ``live.poll`` waits for it.
+    """
+    try:
+        await _store_live_hosts(session_factory, batch, await asyncio.to_thread(live.poll))
+    except Exception:
+        log.exception("following batch %s's hosts failed; they are stored when it ends", batch.id)
+        live.failed = True
+
+async def _store_live_hosts(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch, records: list[HostRecord]) -> None:
+    """Insert hosts with open ports for a running ``batch`` and send ``host_found`` for each.
+
+    Nothing is stored once the lease is lost. The final ingestion skips
+    these hosts (``ingest_batch_xml(batch_id=...)``).
+    """
+    records = [record for record in records if record.ports]
+    if not records:
+        return
+    async with session_factory() as session:
+        # no-op UPDATE that only matches while the lease is ours
+        owned = await session.execute(_owned(batch).values(lease_owner=batch.lease_owner))
+        if owned.rowcount != 1:
+            await session.rollback()
+            return
+        host_ids = await bulk_insert_hosts(session, batch.scan_id, records, batch_id=batch.id)
+        await session.commit()
+    for host_id, record in zip(host_ids, records):
+        await ws_manager.broadcast(batch.scan_id, {
+            "event": "host_found",
+            "scan_id": batch.scan_id,
+            "batch_id": batch.id,
+            "host_id": host_id,
+            "address": record.address,
+            "hostname": record.hostname,
+            "ports": [
+                {"port": p.port_number, "protocol": p.protocol, "service": p.service_name}
+                for p in record.ports
+            ],
+        })
+
+def _finished_prefix(xml_path: Path, targets: list[str], flags: list[str]) -> int:
+    """How many leading ``targets`` a killed nmap run finished, from its partial XML.
+
+    Like nmap's ``--resume``: hosts are reported in target order, so every
+    target up to the last complete ``<host>`` element is done. Returns 0
+    when that cannot be told (no XML, randomized order, unknown host).
+    """
+    if not xml_path.exists() or "--randomize-hosts" in flags:
+        return 0
+    position = {t: i for i, t in enumerate(targets)}
+    done = 0
+    for record in iter_nmap_hosts(xml_path, up_only=False):
+        index = position.get(record.address, position.get(record.hostname))
+        if index is None:
+            return 0
+        done = max(done, index + 1)
+    return done
+
+async def _carve(
+    session_factory: async_sessionmaker[AsyncSession],
+    batch: models.Batch,
+    params: dict,
+    done: int,
+    parts: int,
+    status: str,
+    extra_args: dict | None = None,
+) -> tuple[dict, list[int]] | None:
+    """End ``batch`` with its first ``done`` targets and queue the rest as ``parts`` child batches.
+
+    The finished prefix is ingested from the partial XML. Children record
+    ``parent_id``. Returns the summary and the child ids, or ``None`` when
+    ``batch``'s lease had already moved on.
+    """
+    targets = batch.args_json["targets"]
+    out_dir = Path(params.get("out_dir") or settings.output_dir)
+    xml_path = out_dir / f"batch_{batch.id}.xml"
+    rest = targets[done:]
+    async with session_factory() as session:
+        # the prefix is ingested again from the XML below; live hosts past it
+        # would be duplicated by the children
+        await delete_batch_hosts(session, batch.id)
+        summary = {"hosts_up": 0, "open_ports": 0}
+        if done:
+            summary = await _ingest_results(session, params, batch, xml_path, targets[:done])
+            session.add(models.ResultRaw(
+                batch_id=batch.id,
+                xml_path=str(xml_path),
+                stdout_path=str(out_dir / f"batch_{batch.id}.stdout.log"),
+                stderr_path=str(out_dir / f"batch_{batch.id}.stderr.log"),
+            ))
+        children = []
+        for part in (chunk(rest, math.ceil(len(rest) / parts)) if rest else ()):
+            child = models.Batch(
+                scan_id=batch.scan_id, status="queued", stage=batch.stage, parent_id=batch.id,
+                target_count=len(part), args_json={**_unrated(batch.args_json), **(extra_args or {}), "targets": part},
             )
-        await db.commit()
+            session.add(child)
+            children.append(child)
+        result = await session.execute(_owned(batch).values(
+            status=status, finished_at=datetime.utcnow(), lease_expires_at=None,
+            target_count=done, args_json={**batch.args_json, "targets": targets[:done]},
+        ))
+        if result.rowcount != 1:
+            await session.rollback()
+            return None
+        await session.flush()
+        child_ids = [c.id for c in children]
+        await session.commit()
+    return summary, child_ids
+
+def _unrated(args: dict) -> dict:
+    # a packet rate is allocated per claim (see assign_rate)
+    return {k: v for k, v in args.items() if k != "rate"}
+
+async def assign_rate(session: AsyncSession, batch: models.Batch, slots: int) -> float | None:
+    """Allocate the just-claimed ``batch``'s share of the packet-rate budget.
+
+    ``slots`` is how many batches are expected to run at once. See
+    ``rate_budget.allocate_rate``.
+    """
+    params = (await session.get(models.Scan, batch.scan_id)).params_json or {}
+    return await allocate_rate(session, batch, _stage_flags(params, batch, with_rate=False), slots)
+
+async def resume_batch(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch) -> int:
+    """Recover a ``running`` batch whose worker died mid-run.
+
+    With ``NSO_RESUME_PARTIAL`` the targets its partial XML already covers
+    are ingested and the batch completes with that prefix; the rest goes to
+    a new ``queued`` child batch. Otherwise, or when nothing is usable, the
+    whole batch goes back to the queue. Returns the number of targets kept.
+    Guarded on the dead owner's lease like a normal completion.
+    """
+    async with session_factory() as session:
+        params = (await session.get(models.Scan, batch.scan_id)).params_json or {}
+    xml_path = Path(params.get("out_dir") or settings.output_dir) / f"batch_{batch.id}.xml"
+    targets = batch.args_json["targets"]
+    done = _finished_prefix(xml_path, targets, _stage_flags(params, batch)) if settings.resume_partial else 0
+    carved = await _carve(session_factory, batch, params, done, 1, "completed") if done else None
+    if carved is None:
+        async with session_factory() as session:
+            await requeue_batch(session, batch.id, batch.lease_owner)
+        return 0
+    await ws_manager.broadcast(batch.scan_id, {"event": "batch_complete", "batch_id": batch.id, "summary": carved[0]})
+    return done
+
+async def split_batch(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch) -> list[int]:
+    """Cut a straggler short after its run was cancelled with ``SPLIT``.
 
-        # The legacy runner takes a single string for nmap options
-        nmap_options_str = " ".join(nmap_flags)
+    The batch ends as ``split`` with the targets its partial XML finished;
+    the rest is spread over ``NSO_STRAGGLER_SPLIT_PARTS`` child batches,
+    with ``--host-timeout NSO_STRAGGLER_HOST_TIMEOUT`` when that is set.
+    Returns the child batch ids.
+    """
+    async with session_factory() as session:
+        params = (await session.get(models.Scan, batch.scan_id)).params_json or {}
+    xml_path = Path(params.get("out_dir") or settings.output_dir) / f"batch_{batch.id}.xml"
+    done = _finished_prefix(xml_path, batch.args_json["targets"], _stage_flags(params, batch))
+    extra = {"host_timeout": settings.straggler_host_timeout} if settings.straggler_host_timeout else None
+    carved = await _carve(session_factory, batch, params, done, settings.straggler_split_parts, "split", extra)
+    if carved is None:
+        return []
+    summary, children = carved
+    await ws_manager.broadcast(batch.scan_id, {
+        "event": "batch_split", "batch_id": batch.id, "done": done, "summary": summary, "children": children,
+    })
+    return children
 
-        # All targets are processed in one go by the legacy runner
-        all_target_chunks = [b.args_json["targets"] for b in batches]
+async def _ingest_results(session: AsyncSession, params: dict, batch: models.Batch, xml_path: Path, targets: list[str]) -> dict:
+    """Store one finished batch's results according to its stage; returns the summary."""
+    pipeline, services = params.get("pipeline"), params.get("services")
+    if pipeline and batch.stage == DISCOVERY:
+        live = [record.address async for part in PARSER.chunks(xml_path) for record in part.records]
+        return queue_live_hosts(session, batch.scan_id, live, pipeline["chunk_size"])
+    if batch.stage == SERVICE:
+        summary = {"hosts_up": 0, "open_ports": 0, "services": 0}
+        async for part in PARSER.chunks(xml_path):
+            summary["hosts_up"] += part.seen
+            summary["open_ports"] += sum(len(r.ports) for r in part.records)
+            summary["services"] += await bulk_update_services(session, batch.scan_id, part.records)
+        return summary
+    # one pass over the XML: persist hosts and count the summary
+    found: list[HostRecord] | None = [] if services else None
+    summary = await ingest_batch_xml(session, batch.scan_id, xml_path, collect=found, batch_id=batch.id)
+    if services:
+        summary["queued_batches"] = queue_service_batches(session, batch.scan_id, found, services["chunk_size"])
+    if "cache" in params:
+        cache = params["cache"]
+        await store_results(session, cache["project_id"], cache["flags_key"], batch.scan_id, targets)
+    return summary
 
-        # Run the blocking function in an executor
-        results = await loop.run_in_executor(
-            None,  # uses the default ThreadPoolExecutor
-            scan_chunks_parallel,
-            all_target_chunks,
-            nmap_options_str,
-            concurrency  # num_processes
+async def _broadcast_progress(session_factory: async_sessionmaker[AsyncSession], scan_id: int) -> None:
+    async with session_factory() as session:
+        stages = await stage_progress(session, scan_id)
+    await ws_manager.broadcast(scan_id, {"event": "stage_progress", "scan_id": scan_id, "stages": stages})
+
+def _owned(batch: models.Batch):
+    """UPDATE for ``batch`` that only matches while its lease is still ours."""
+    return (
+        update(models.Batch)
+        .where(
+            models.Batch.id == batch.id,
+            models.Batch.status == "running",
+            models.Batch.lease_owner == batch.lease_owner,
         )
+    )
 
-        # Process results
-        await ws_manager.broadcast(scan.id, {"event": "legacy_scan_complete", "results": results})
+async def _set_batch_status(session_factory: async_sessionmaker[AsyncSession], batch: models.Batch, status: str) -> None:
+    async with session_factory() as session:
+        await session.execute(_owned(batch).values(status=status, finished_at=datetime.utcnow(), lease_expires_at=None))
+        await session.commit()
 
-        for b in batches:
-            await db.execute(
-                update(models.Batch)
-                .where(models.Batch.id == b.id)
-                .values(status="completed", finished_at=datetime.utcnow())
+# TargetSets of adaptive scans, so refills don't re-parse the stored ranges
+_ADAPTIVE_TARGETS: dict[int, TargetSet] = {}
+
+def _adaptive_targets(scan_id: int, ranges: list) -> TargetSet:
+    targets = _ADAPTIVE_TARGETS.get(scan_id)
+    if targets is None:
+        if len(_ADAPTIVE_TARGETS) >= 32:
+            _ADAPTIVE_TARGETS.pop(next(iter(_ADAPTIVE_TARGETS)))
+        targets = _ADAPTIVE_TARGETS[scan_id] = TargetSet.from_json(ranges)
+    return targets
+
+async def refill_scan(session_factory: async_sessionmaker[AsyncSession], scan_id: int) -> int:
+    """Queue the next batches of an adaptive scan; returns how many were added.
+
+    Keeps ``concurrency + 1`` batches queued or running. Sizes come from
+    ``BatchSizer``: the seconds per host measured on this scan's completed
+    batches (``started_at``/``finished_at``), else the historical estimate,
+    else ``chunk_size``. The move of ``scans.target_cursor`` is conditional,
+    so concurrent refills (other workers, agents) never cut the same targets.
+    """
+    async with session_factory() as session:
+        scan = await session.get(models.Scan, scan_id)
+        if scan is None or scan.status != "running" or scan.target_cursor is None:
+            return 0
+        params = scan.params_json or {}
+        adaptive = params["adaptive"]
+        cursor, total = scan.target_cursor, adaptive["total"]
+        if cursor >= total:
+            return 0
+        slots = params.get("concurrency") or 1
+        active = (await session.execute(
+            select(func.count()).select_from(models.Batch).where(
+                models.Batch.scan_id == scan_id,
+                models.Batch.status.in_(("queued", "running")),
             )
-        await db.commit()
+        )).scalar_one()
+        if active > slots:
+            return 0
+
+        per_host = await observed_seconds_per_host(session, scan_id) or adaptive.get("seconds_per_host")
+        sizer = BatchSizer(adaptive["seconds"], settings.batch_min_size, settings.batch_max_size)
+        targets = _adaptive_targets(scan_id, adaptive["ranges"])
+        batches = []
+        end = cursor
+        for _ in range(slots + 1 - active):
+            if end >= total:
+                break
+            size = sizer.size(per_host, total - end, slots, adaptive["fallback_size"])
+            t = list(targets[end:end + size])
+            end += size
+            batches.append(models.Batch(scan_id=scan_id, status="queued", target_count=len(t), args_json={"targets": t}))
 
+        result = await session.execute(
+            update(models.Scan)
+            .where(models.Scan.id == scan_id, models.Scan.status == "running", models.Scan.target_cursor == cursor)
+            .values(target_cursor=end)
+        )
+        if result.rowcount != 1:
+            # another finisher refilled first
+            await session.rollback()
+            return 0
+        session.add_all(batches)
+        await session.commit()
+    if end >= total:
+        _ADAPTIVE_TARGETS.pop(scan_id, None)
+    return len(batches)
+
+async def finalize_scan(session_factory: async_sessionmaker[AsyncSession], scan_id: int) -> None:
+    """Mark the scan completed once none of its batches is waiting or running.
+
+    Adaptive scans get their next batches first (``refill_scan``) and only
+    complete once every target has been cut into a batch.
+    """
+    await refill_scan(session_factory, scan_id)
+    async with session_factory() as session:
+        remaining = (await session.execute(
+            select(func.count()).select_from(models.Batch).where(
+                models.Batch.scan_id == scan_id,
+                models.Batch.status.in_(("pending", "queued", "running")),
+            )
+        )).scalar_one()
+        if remaining:
+            return
+        scan = await session.get(models.Scan, scan_id)
+        if scan is not None and scan.target_cursor is not None and scan.target_cursor < scan.params_json["adaptive"]["total"]:
+            return
+        # conditional, so concurrent finishers (or a stopped scan) don't double-complete
+        result = await session.execute(
+            update(models.Scan)
+            .where(models.Scan.id == scan_id, models.Scan.status == "running")
+            .values(status="completed", finished_at=datetime.utcnow())
+        )
+        await session.commit()
+    if result.rowcount:
+        await ws_manager.broadcast(scan_id, {"event": "scan_complete", "scan_id": scan_id})
+
+async def stop_scan(db: AsyncSession, scan_id: int) -> None:
+    """Cancel every unfinished batch of the scan and send ``scan_stopped``.
+
+    Local batch tasks are cancelled directly; agents running a batch notice
+    on their next heartbeat that the lease is gone and stop nmap.
+    """
     await db.execute(
+        update(models.Batch)
+        .where(models.Batch.scan_id == scan_id, models.Batch.status.in_(("pending", "queued", "running")))
+        .values(status="cancelled", finished_at=datetime.utcnow(), lease_expires_at=None)
+    )
+    stopped = await db.execute(
         update(models.Scan)
-        .where(models.Scan.id == scan.id)
-        .values(status="completed", finished_at=datetime.utcnow())
+        .where(models.Scan.id == scan_id, models.Scan.status == "running")
+        .values(status="cancelled", finished_at=datetime.utcnow())
     )
     await db.commit()
-    await ws_manager.broadcast(scan.id, {"event": "scan_complete", "scan_id": scan.id})
+    await TASKS.cancel_scan(scan_id)
+    if stopped.rowcount:
+        await ws_manager.broadcast(scan_id, {"event": "scan_stopped", "scan_id": scan_id})
 
-    # cleanup registry entries for this scan
-    for b in batches:
-        TASKS.remove(scan.id, b.id)
+async def _run_legacy(
+    session_factory: async_sessionmaker[AsyncSession],
+    scan_id: int,
+    batches: list[models.Batch],
+    nmap_flags: list[str],
+    concurrency: int,
+) -> None:
+    """Run the legacy python-nmap process pool, handling each chunk as it ends.
 
-    return scan.id
+    ``iter_chunks_parallel`` runs in the default thread executor and hands
+    finished chunks over to the event loop one at a time. Each batch row is
+    completed (or failed) right then and its XML goes through
+    ``_ingest_results`` like an asyncio batch, followed by the usual
+    ``batch_complete``/``batch_failed`` event.
+    """
+    loop = asyncio.get_running_loop()
+    finished: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    by_id = {b.id: b for b in batches}
+    async with session_factory() as db:
+        params = (await db.get(models.Scan, scan_id)).params_json or {}
+    out_dir = Path(params.get("out_dir") or settings.output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(b.id, b.args_json["targets"], str(out_dir / f"batch_{b.id}.xml")) for b in batches]
+
+    def produce() -> None:
+        try:
+            for status in iter_chunks_parallel(jobs, " ".join(nmap_flags), concurrency, stop):
+                loop.call_soon_threadsafe(finished.put_nowait, status)
+        except Exception as e:
+            loop.call_soon_threadsafe(finished.put_nowait, {"error": "Parallel processing failed", "details": str(e)})
+        finally:
+            loop.call_soon_threadsafe(finished.put_nowait, None)
+
+    try:
+        async with session_factory() as db:
+            # the pool only reports chunks as they end, so all of them count as running
+            await db.execute(
+                update(models.Batch)
+                .where(models.Batch.id.in_(by_id), models.Batch.status == "pending")
+                .values(status="running", started_at=datetime.utcnow())
+            )
+            await db.commit()
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while (status := await finished.get()) is not None:
+                await _finish_legacy_chunk(session_factory, params, by_id, status)
+            await producer
+        except Exception as e:
+            # fail what is still running, so the scan still ends
+            log.exception("legacy run of scan %s failed", scan_id)
+            stop.set()
+            await _finish_legacy_chunk(session_factory, params, by_id, {"error": "Legacy run failed", "details": str(e)})
+        await finalize_scan(session_factory, scan_id)
+    finally:
+        stop.set()
+        # cleanup registry entries for this scan
+        for b in batches:
+            TASKS.remove(scan_id, b.id)
+
+async def _finish_legacy_chunk(
+    session_factory: async_sessionmaker[AsyncSession],
+    params: dict,
+    by_id: dict[int, models.Batch],
+    status: dict,
+) -> None:
+    """Record one chunk reported by ``iter_chunks_parallel``.
+
+    A status without ``batch_id`` means the pool itself broke: every batch
+    still running fails.
+    """
+    batch = by_id.get(status.get("batch_id"))
+    failed = [batch] if batch is not None else list(by_id.values())
+    if batch is not None and "error" not in status:
+        xml_path = Path(params.get("out_dir") or settings.output_dir) / f"batch_{batch.id}.xml"
+        async with session_factory() as session:
+            summary = await _ingest_results(session, params, batch, xml_path, batch.args_json["targets"])
+            result = await session.execute(_owned(batch).values(status="completed", finished_at=datetime.utcnow()))
+            if result.rowcount != 1:
+                # stopped meanwhile
+                await session.rollback()
+                return
+            await session.commit()
+        await ws_manager.broadcast(batch.scan_id, {"event": "batch_complete", "batch_id": batch.id, "summary": summary})
+        return
+    error = status["error"] if not status.get("details") else f"{status['error']} {status['details']}"
+    for b in failed:
+        async with session_factory() as session:
+            result = await session.execute(_owned(b).values(status="failed", finished_at=datetime.utcnow()))
+            await session.commit()
+        if result.rowcount:
+            await ws_manager.broadcast(b.scan_id, {"event": "batch_failed", "batch_id": b.id, "error": error})
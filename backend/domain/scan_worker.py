@@ -0,0 +1,292 @@
+from __future__ import annotations
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from ..app.settings import settings
+from ..infra import models
+from ..infra.batch_queue import (
+    claim_batch, default_owner, owner_alive, project_usage, queue_depth, renew_lease, requeue_expired_leases,
+    scheduler_state,
+)
+from ..infra.db import SessionLocal
+from ..infra.ws_hub import ws_manager
+from .batch_sizing import find_stragglers
+from .rate_budget import rate_state
+from .scan_coordinator import LEASE_LOST, REQUEUE, SPLIT, assign_rate, execute_batch, finalize_scan, resume_batch
+from .task_registry import TASKS
+
+
+class WorkerStats:
+    def __init__(self) -> None:
+        self.batch_id: Optional[int] = None
+        self.completed = 0
+        self.failed = 0
+        self.targets = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self, index: int) -> dict:
+        return {
+            "worker": index,
+            "batch_id": self.batch_id,
+            "completed": self.completed,
+            "failed": self.failed,
+            "targets": self.targets,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "targets_per_second": round(self.targets / self.busy_seconds, 3) if self.busy_seconds else 0.0,
+        }
+
+
+class ScanWorkerPool:
+    """Run ``queued`` batches from the database with a fixed number of workers.
+
+    The queue itself is the ``batches`` table (see ``infra.batch_queue``), so
+    anything still queued when the process stops is picked up again on the
+    next start. Idle workers poll every ``poll_interval`` seconds and are
+    woken early by ``notify()`` when new batches are submitted.
+
+    Claimed batches are leased to ``owner`` and the lease is renewed every
+    ``lease_seconds / 3`` while nmap runs. The same class backs the in-process
+    workers and the standalone agents (``python -m backend.agent``); every
+    pool also re-queues batches whose lease expired because their worker died.
+
+    Which batch a free worker gets is decided in ``claim_batch``: fair
+    shares across projects, scan priority, and the ``scheduler_slots`` /
+    ``scheduler_max_share`` budget, which holds across every pool that
+    shares the database.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession] | None = None,
+        workers: int | None = None,
+        poll_interval: float = 2.0,
+        owner: str | None = None,
+        lease_seconds: float | None = None,
+    ) -> None:
+        self.session_factory = session_factory or SessionLocal
+        self.workers = workers or settings.scan_workers
+        self.poll_interval = poll_interval
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds or settings.batch_lease_seconds
+        self._last_reap = 0.0
+        self._last_split = 0.0
+        self._stats: Dict[int, WorkerStats] = {i: WorkerStats() for i in range(self.workers)}
+        self._tasks: list[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._claim_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        self._wake = asyncio.Event()
+        await self.recover()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Wake idle workers; call after queueing new batches."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run_until_idle(self) -> None:
+        """Drain the queue with all workers and return when nothing is runnable."""
+        async def drain(index: int):
+            while await self._run_next(index):
+                pass
+        await asyncio.gather(*(drain(i) for i in range(self.workers)))
+
+    @property
+    def scan_cap(self) -> int:
+        """Most batches one scan may run at once under ``scheduler_max_share``."""
+        if settings.scheduler_max_share >= 1:
+            return 0
+        budget = settings.scheduler_slots or self.workers
+        return max(1, math.floor(budget * settings.scheduler_max_share))
+
+    async def stats(self) -> dict:
+        async with self.session_factory() as session:
+            depth = await queue_depth(session)
+            scans = await scheduler_state(session)
+            rates = await rate_state(session)
+        usage = project_usage(scans)
+        projects: Dict[int, dict] = {}
+        for s in scans.values():
+            entry = projects.setdefault(s["project_id"], {
+                "project_id": s["project_id"], "weight": s["weight"], "queued": 0, "running": 0,
+                "usage": round(usage[s["project_id"]], 3),
+            })
+            entry["queued"] += s["queued"]
+            entry["running"] += s["running"]
+        return {
+            "owner": self.owner,
+            "workers": self.workers,
+            "queue_depth": depth,
+            "in_flight": sum(1 for s in self._stats.values() if s.batch_id is not None),
+            "per_worker": [s.as_dict(i) for i, s in self._stats.items()],
+            "scheduler": {
+                "slots": settings.scheduler_slots,
+                "scan_cap": self.scan_cap,
+                "running": sum(s["running"] for s in scans.values()),
+                "projects": sorted(projects.values(), key=lambda p: p["project_id"]),
+                "scans": [dict(s, scan_id=scan_id) for scan_id, s in sorted(scans.items())],
+            },
+            "rate": rates,
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            if await self._run_next(index):
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def recover(self) -> dict:
+        """Startup recovery after a crash or restart.
+
+        Batches still leased to dead processes on this host are resumed at
+        once (``resume_batch``) rather than after their lease expires.
+        Batches of the multiprocessing runner that died with their process
+        (owned, but without a lease) cannot be resumed and are marked
+        ``failed``. Then every ``running`` scan is finalized, which completes
+        scans whose last batch ended just before the crash and refills
+        adaptive ones. Queued batches need nothing: they are still in the
+        queue.
+        """
+        async with self.session_factory() as session:
+            running = (await session.execute(
+                select(models.Batch).where(
+                    models.Batch.status.in_(("pending", "running")), models.Batch.lease_owner.is_not(None),
+                )
+            )).scalars().all()
+            scan_ids = (await session.execute(
+                select(models.Scan.id).where(models.Scan.status == "running")
+            )).scalars().all()
+        resumed = requeued = failed = 0
+        for batch in running:
+            if batch.lease_owner == self.owner or owner_alive(batch.lease_owner) is not False:
+                continue
+            if batch.lease_expires_at is None:
+                # a legacy batch: its process pool is gone
+                failed += await self._fail_orphan(batch)
+            elif await resume_batch(self.session_factory, batch):
+                resumed += 1
+            else:
+                requeued += 1
+        for scan_id in scan_ids:
+            await finalize_scan(self.session_factory, scan_id)
+        return {"resumed": resumed, "requeued": requeued, "failed": failed, "scans": len(scan_ids)}
+
+    async def _fail_orphan(self, batch: models.Batch) -> int:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(models.Batch)
+                .where(
+                    models.Batch.id == batch.id,
+                    models.Batch.status == batch.status,
+                    models.Batch.lease_owner == batch.lease_owner,
+                )
+                .values(status="failed", finished_at=datetime.utcnow())
+            )
+            await session.commit()
+        if result.rowcount:
+            await ws_manager.broadcast(batch.scan_id, {
+                "event": "batch_failed", "batch_id": batch.id, "error": "interrupted by a restart of its process",
+            })
+        return result.rowcount
+
+    async def split_stragglers(self) -> list[int]:
+        """Cut short this pool's straggler batches (see ``find_stragglers``).
+
+        Their tasks are cancelled with ``SPLIT``; ``execute_batch`` keeps the
+        finished targets and queues the rest as smaller child batches.
+        """
+        if not settings.straggler_factor:
+            return []
+        async with self.session_factory() as session:
+            ids = await find_stragglers(
+                session, self.owner, settings.straggler_factor,
+                settings.straggler_min_seconds, settings.straggler_min_samples,
+            )
+        for batch_id in ids:
+            task = TASKS.by_batch.get(batch_id)
+            if task is not None:
+                task.cancel(SPLIT)
+        return ids
+
+    async def reap_expired_leases(self) -> None:
+        async with self.session_factory() as session:
+            touched = await requeue_expired_leases(session, settings.batch_max_attempts)
+        for _, scan_id, status in touched:
+            if status == "failed":
+                await finalize_scan(self.session_factory, scan_id)
+        if touched:
+            self.notify()
+
+    async def _heartbeat(self, batch_id: int, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with self.session_factory() as session:
+                alive = await renew_lease(session, batch_id, self.owner, self.lease_seconds)
+            if not alive:
+                # re-queued after expiry or stopped by the user: abandon our run
+                task.cancel(LEASE_LOST)
+                return
+
+    async def _run_next(self, index: int) -> bool:
+        # claim_batch serializes claims across processes; this lock also keeps
+        # local rate allocations (assign_rate) from overlapping
+        async with self._claim_lock:
+            if time.monotonic() - self._last_reap >= self.lease_seconds / 3:
+                self._last_reap = time.monotonic()
+                await self.reap_expired_leases()
+            async with self.session_factory() as session:
+                batch = await claim_batch(session, self.owner, self.lease_seconds, settings.scheduler_slots, self.scan_cap)
+                if batch is not None:
+                    # still under the claim lock, so local allocations never overlap
+                    await assign_rate(session, batch, settings.scheduler_slots or self.workers)
+            if batch is None and time.monotonic() - self._last_split >= self.poll_interval:
+                # an idle worker is spare capacity: look for batches worth splitting
+                self._last_split = time.monotonic()
+                await self.split_stragglers()
+        if batch is None:
+            return False
+
+        stats = self._stats[index]
+        stats.batch_id = batch.id
+        started = time.monotonic()
+        task = asyncio.create_task(execute_batch(self.session_factory, batch))
+        heartbeat = asyncio.create_task(self._heartbeat(batch.id, task))
+        TASKS.add(batch.scan_id, batch.id, task)
+        try:
+            # wait() rather than await, so a cancelled batch doesn't stop the worker
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # the pool is stopping: put the batch back for the next start
+            task.cancel(REQUEUE)
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        finally:
+            heartbeat.cancel()
+            TASKS.remove(batch.scan_id, batch.id)
+            stats.batch_id = None
+            stats.busy_seconds += time.monotonic() - started
+
+        if task.cancelled() or task.exception() is not None or not task.result():
+            stats.failed += 1
+        else:
+            stats.completed += 1
+            stats.targets += batch.target_count
+        return True
+
+
+WORKERS = ScanWorkerPool()
@@ -1,19 +1,409 @@
+from __future__ import annotations
+import bisect
+import re
+from itertools import product
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from netaddr import IPNetwork, IPAddress, AddrFormatError
-from typing import List
 
-def expand_targets(targets: List[str]) -> List[str]:
-    expanded_targets = []
-    for target in targets:
-        try:
-            if "/" in target:
-                network = IPNetwork(target)
-                for ip in network:
-                    expanded_targets.append(str(ip))
+# nmap-style IPv4 octet ranges: 10.0.0-255.1-20, 192.168.1,3.*, 10.0.0.-10
+_OCTET_RANGE = re.compile(r"^[\d,\-*]+(\.[\d,\-*]+){3}$")
+_IPV4 = re.compile(r"^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$")
+_HOSTNAME = re.compile(r"^(?=.{1,253}$)([A-Za-z0-9_](?:[A-Za-z0-9_-]{0,61}[A-Za-z0-9])?)(\.[A-Za-z0-9_](?:[A-Za-z0-9_-]{0,61}[A-Za-z0-9])?)*\.?$")
+
+
+def _format_ip(version: int, value: int) -> str:
+    if version == 4:
+        return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+    return str(IPAddress(value, 6))
+
+
+class _IPRange:
+    """Consecutive addresses ``first..last`` (inclusive, as integers)."""
+
+    __slots__ = ("version", "first", "last")
+
+    def __init__(self, version: int, first: int, last: int) -> None:
+        self.version, self.first, self.last = version, first, last
+
+    @property
+    def count(self) -> int:
+        return self.last - self.first + 1
+
+    def item(self, index: int) -> str:
+        return _format_ip(self.version, self.first + index)
+
+    def iter(self, start: int, stop: int) -> Iterator[str]:
+        for value in range(self.first + start, self.first + stop):
+            yield _format_ip(self.version, value)
+
+
+class _OctetRange:
+    """Cartesian product of per-octet value lists, in nmap's order."""
+
+    __slots__ = ("octets", "count")
+
+    def __init__(self, octets: Tuple[Tuple[int, ...], ...]) -> None:
+        self.octets = octets
+        self.count = len(octets[0]) * len(octets[1]) * len(octets[2]) * len(octets[3])
+
+    def item(self, index: int) -> str:
+        parts = []
+        for values in reversed(self.octets):
+            index, digit = divmod(index, len(values))
+            parts.append(values[digit])
+        return "{3}.{2}.{1}.{0}".format(*parts)
+
+    def iter(self, start: int, stop: int) -> Iterator[str]:
+        for index in range(start, stop):
+            yield self.item(index)
+
+
+class _Hostname:
+    __slots__ = ("name",)
+    count = 1
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def item(self, index: int) -> str:
+        return self.name
+
+    def iter(self, start: int, stop: int) -> Iterator[str]:
+        if start < stop:
+            yield self.name
+
+
+Segment = Union[_IPRange, _OctetRange, _Hostname]
+
+
+def _parse_octet(spec: str) -> Tuple[int, ...]:
+    values: set[int] = set()
+    for part in spec.split(","):
+        if part == "*":
+            lo, hi = 0, 255
+        elif "-" in part:
+            lo_s, hi_s = part.split("-", 1)
+            lo, hi = int(lo_s or 0), int(hi_s or 255)
+        else:
+            lo = hi = int(part)
+        if not 0 <= lo <= hi <= 255:
+            raise ValueError(f"bad octet range {part!r}")
+        values.update(range(lo, hi + 1))
+    return tuple(sorted(values))
+
+
+def parse_target(entry: str, allow_hostnames: bool = True) -> Segment:
+    """Parse one target into a segment; raise ``ValueError`` when it is invalid."""
+    entry = entry.strip()
+    m = _IPV4.match(entry)
+    if m:
+        a, b, c, d = map(int, m.groups())
+        if a > 255 or b > 255 or c > 255 or d > 255:
+            raise ValueError(f"invalid target {entry!r}")
+        value = (a << 24) | (b << 16) | (c << 8) | d
+        return _IPRange(4, value, value)
+    try:
+        if "/" in entry:
+            network = IPNetwork(entry)
+            return _IPRange(network.version, network.first, network.last)
+        if _OCTET_RANGE.match(entry) and any(c in entry for c in ",-*"):
+            return _OctetRange(tuple(_parse_octet(o) for o in entry.split(".")))
+        if ":" in entry or entry.replace(".", "").isdigit():
+            ip = IPAddress(entry)
+            return _IPRange(ip.version, int(ip), int(ip))
+    except (AddrFormatError, ValueError) as e:
+        raise ValueError(f"invalid target {entry!r}") from e
+    if allow_hostnames and _HOSTNAME.match(entry):
+        return _Hostname(entry.lower().rstrip("."))
+    raise ValueError(f"invalid target {entry!r}")
+
+
+class TargetSet(Sequence[str]):
+    """Scan targets kept as address ranges and expanded only on demand.
+
+    Indexing, slicing and ``len()`` never build per-address strings: a slice
+    is another ``TargetSet`` over the same segments, and ``chunks(n)`` walks
+    the set in ``n``-sized slices. Iteration yields one string at a time.
+    ``size`` is the exact count even where ``len()`` cannot hold it (an IPv6
+    /64).
+    """
+
+    def __init__(self, segments: Iterable[Segment] = (), _windows: List[Tuple[Segment, int, int]] | None = None) -> None:
+        self._windows = _windows if _windows is not None else [(s, 0, s.count) for s in segments]
+        self._offsets: List[int] = []
+        total = 0
+        for _, start, stop in self._windows:
+            self._offsets.append(total)
+            total += stop - start
+        self.size = total
+        self._lookup: Optional[Tuple[Dict[int, Tuple[List[int], List[int]]], set]] = None
+        self.rejected: List[str] = []
+        # set by normalize_targets()
+        self.report: Optional[dict] = None
+
+    @classmethod
+    def parse(cls, entries: Iterable[str], allow_hostnames: bool = True) -> "TargetSet":
+        """Build a set from CIDRs, addresses, octet ranges and hostnames.
+
+        Invalid entries are skipped and listed in ``rejected``.
+        """
+        segments, rejected = [], []
+        for entry in entries:
+            try:
+                segments.append(parse_target(entry, allow_hostnames))
+            except ValueError:
+                rejected.append(entry)
+        targets = cls(segments)
+        targets.rejected = rejected
+        return targets
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[str]:
+        for segment, start, stop in self._windows:
+            yield from segment.iter(start, stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._slice(key)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("TargetSet index out of range")
+        pos = bisect.bisect_right(self._offsets, key) - 1
+        segment, start, _ = self._windows[pos]
+        return segment.item(start + key - self._offsets[pos])
+
+    def _slice(self, key: slice) -> "TargetSet":
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise ValueError("TargetSet slices must be contiguous")
+        windows = []
+        if start < stop:
+            pos = bisect.bisect_right(self._offsets, start) - 1
+            while pos < len(self._windows) and self._offsets[pos] < stop:
+                segment, w_start, w_stop = self._windows[pos]
+                offset = self._offsets[pos]
+                lo = w_start + max(start - offset, 0)
+                hi = w_start + min(stop - offset, w_stop - w_start)
+                windows.append((segment, lo, hi))
+                pos += 1
+        return TargetSet(_windows=windows)
+
+    def _ranges(self) -> Tuple[Dict[int, List[Tuple[int, int]]], List[str]]:
+        # merged integer ranges per IP version, plus the hostnames
+        ranges: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        hostnames: List[str] = []
+        for item in self.to_json():
+            if isinstance(item, str):
+                hostnames.append(item)
             else:
-                ip = IPAddress(target)
-                expanded_targets.append(str(ip))
-        except (AddrFormatError, ValueError):
-            # For now, we'll just ignore invalid targets.
-            # In the future, we might want to return an error.
-            pass
-    return expanded_targets
+                ranges[item[0]].append((item[1], item[2]))
+        return {version: _merge(r) for version, r in ranges.items()}, hostnames
+
+    def __contains__(self, address) -> bool:
+        """Membership by binary search over the ranges, without expanding them."""
+        if self._lookup is None:
+            ranges, hostnames = self._ranges()
+            self._lookup = ({v: ([f for f, _ in r], [l for _, l in r]) for v, r in ranges.items()}, set(hostnames))
+        spans, hostnames = self._lookup
+        m = _IPV4.match(address) if isinstance(address, str) else None
+        if m:
+            # fast path, as in _split()
+            a, b, c, d = map(int, m.groups())
+            version, value = 4, (a << 24) | (b << 16) | (c << 8) | d
+        else:
+            try:
+                segment = parse_target(address)
+            except (ValueError, TypeError, AttributeError):
+                return False
+            if isinstance(segment, _Hostname):
+                return segment.name in hostnames
+            if not isinstance(segment, _IPRange) or segment.count != 1:
+                return False
+            version, value = segment.version, segment.first
+        firsts, lasts = spans[version]
+        pos = bisect.bisect_right(firsts, value) - 1
+        return pos >= 0 and value <= lasts[pos]
+
+    def without(self, addresses: Iterable[str]) -> "TargetSet":
+        """This set minus ``addresses`` (same syntax as targets), as merged ranges."""
+        ranges, hostnames = self._ranges()
+        holes, skip_hosts, _, _ = _split(addresses)
+        segments: List[Segment] = []
+        for version in (4, 6):
+            segments.extend(_IPRange(version, f, l) for f, l in _subtract(ranges[version], _merge(holes[version])))
+        skip = set(skip_hosts)
+        segments.extend(_Hostname(h) for h in dict.fromkeys(hostnames) if h not in skip)
+        return TargetSet(segments)
+
+    def to_json(self) -> list:
+        """Compact JSON form: ``[version, first, last]`` per range, hostnames as strings."""
+        out: list = []
+        for segment, start, stop in self._windows:
+            if isinstance(segment, _Hostname):
+                out.append(segment.name)
+            elif isinstance(segment, _IPRange):
+                out.append([segment.version, segment.first + start, segment.first + stop - 1])
+            elif start == 0 and stop == segment.count:
+                out.extend([4, a, b] for a, b in _octet_ranges(segment))
+            else:
+                # part of an octet product (only from slicing an unnormalized set)
+                values = [int(IPAddress(segment.item(i))) for i in range(start, stop)]
+                out.extend([4, a, b] for a, b in _runs(values))
+        return out
+
+    @classmethod
+    def from_json(cls, data: list) -> "TargetSet":
+        return cls(_Hostname(item) if isinstance(item, str) else _IPRange(*item) for item in data)
+
+    def chunks(self, size: int) -> Iterator["TargetSet"]:
+        for start in range(0, self.size, size):
+            yield self[start:start + size]
+
+    def __repr__(self) -> str:
+        return f"<TargetSet {self.size} targets in {len(self._windows)} ranges>"
+
+
+_FULL_OCTET = tuple(range(256))
+
+
+def _runs(values: Sequence[int]) -> List[Tuple[int, int]]:
+    runs: List[Tuple[int, int]] = []
+    for v in values:
+        if runs and runs[-1][1] == v - 1:
+            runs[-1] = (runs[-1][0], v)
+        else:
+            runs.append((v, v))
+    return runs
+
+
+def _octet_ranges(segment: _OctetRange) -> Iterator[Tuple[int, int]]:
+    # Lower octets that cover 0-255 make each run of the octet above them one
+    # contiguous block, so 10.0.0-255.* is a single range, not 65536.
+    octets = segment.octets
+    k = 3
+    while k >= 0 and octets[k] == _FULL_OCTET:
+        k -= 1
+    if k < 0:
+        yield 0, 2**32 - 1
+        return
+    span = 256 ** (3 - k)
+    runs = _runs(octets[k])
+    for prefix in product(*octets[:k]):
+        base = 0
+        for value in prefix:
+            base = (base << 8) | value
+        base <<= 8 * (4 - k)
+        for lo, hi in runs:
+            yield base + lo * span, base + (hi + 1) * span - 1
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _subtract(ranges: List[Tuple[int, int]], holes: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # both sorted and non-overlapping: one sweep
+    out: List[Tuple[int, int]] = []
+    j = 0
+    for first, last in ranges:
+        while j < len(holes) and holes[j][1] < first:
+            j += 1
+        k = j
+        while k < len(holes) and holes[k][0] <= last:
+            if holes[k][0] > first:
+                out.append((first, holes[k][0] - 1))
+            first = max(first, holes[k][1] + 1)
+            k += 1
+        if first <= last:
+            out.append((first, last))
+    return out
+
+
+def _split(entries: Iterable[str]) -> Tuple[Dict[int, List[Tuple[int, int]]], List[str], int, List[str]]:
+    ranges: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+    hostnames: List[str] = []
+    rejected: List[str] = []
+    total = 0
+    v4 = ranges[4]
+    for entry in entries:
+        m = _IPV4.match(entry)
+        if m:
+            # fast path for the common case, a plain IPv4 address
+            a, b, c, d = map(int, m.groups())
+            if a < 256 and b < 256 and c < 256 and d < 256:
+                value = (a << 24) | (b << 16) | (c << 8) | d
+                v4.append((value, value))
+                total += 1
+                continue
+        try:
+            segment = parse_target(entry)
+        except ValueError:
+            rejected.append(entry)
+            continue
+        total += segment.count
+        if isinstance(segment, _IPRange):
+            ranges[segment.version].append((segment.first, segment.last))
+        elif isinstance(segment, _OctetRange):
+            ranges[4].extend(_octet_ranges(segment))
+        else:
+            hostnames.append(segment.name)
+    return ranges, hostnames, total, rejected
+
+
+def normalize_targets(entries: Iterable[str], exclude: Iterable[str] = ()) -> TargetSet:
+    """Merge ``entries`` into a minimal sorted set of ranges, minus ``exclude``.
+
+    Overlapping and adjacent ranges are merged (IPv4 first, then IPv6),
+    repeated hostnames kept once in input order, and every address or
+    hostname in ``exclude`` (same syntax, like nmap's ``--exclude``)
+    removed. Sorting the ranges is the only super-linear step. The
+    returned set's ``report`` counts what was dropped and why.
+    """
+    ranges, hostnames, total, rejected = _split(entries)
+    skip_ranges, skip_hosts, _, skip_rejected = _split(exclude)
+
+    segments: List[Segment] = []
+    merged_size = excluded = 0
+    for version in (4, 6):
+        merged = _merge(ranges[version])
+        merged_size += sum(last - first + 1 for first, last in merged)
+        kept = _subtract(merged, _merge(skip_ranges[version]))
+        excluded += sum(last - first + 1 for first, last in merged) - sum(last - first + 1 for first, last in kept)
+        segments.extend(_IPRange(version, first, last) for first, last in kept)
+
+    unique_hosts = list(dict.fromkeys(hostnames))
+    merged_size += len(unique_hosts)
+    skip_hosts_set = set(skip_hosts)
+    kept_hosts = [h for h in unique_hosts if h not in skip_hosts_set]
+    excluded += len(unique_hosts) - len(kept_hosts)
+    segments.extend(_Hostname(h) for h in kept_hosts)
+
+    targets = TargetSet(segments)
+    targets.rejected = rejected
+    targets.report = {
+        "requested": total,
+        "duplicates_removed": total - merged_size,
+        "excluded": excluded,
+        "invalid": len(rejected) + len(skip_rejected),
+        "targets": targets.size,
+    }
+    return targets
+
+
+def expand_targets(targets: List[str]) -> List[str]:
+    """Every IP address in ``targets`` as a string; invalid entries are dropped.
+
+    Prefer ``TargetSet.parse`` for anything large: this builds the whole list.
+    """
+    return list(TargetSet.parse(targets, allow_hostnames=False))
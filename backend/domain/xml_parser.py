@@ -1,68 +1,232 @@
+from __future__ import annotations
+import io
+import threading
 import xml.etree.ElementTree as ET
-from typing import List
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple, Union
 from ..infra.models import Host, Port
 
-def parse_nmap_xml(xml_content: str) -> List[Host]:
-    """
-    Parses Nmap XML output and returns a list of Host objects.
-    These objects are not yet session-aware and must be added to a session
-    to be persisted.
+# A path on disk, a binary file object, or (for parse_nmap_xml only) raw XML text
+XmlSource = Union[str, Path, IO[bytes]]
+
+
+@dataclass(slots=True)
+class PortRecord:
+    port_number: int
+    protocol: str
+    state: str
+    service_name: Optional[str] = None
+    service_product: Optional[str] = None
+    service_version: Optional[str] = None
+
+
+@dataclass(slots=True)
+class HostRecord:
+    address: str
+    hostname: Optional[str]
+    status: str
+    ports: List[PortRecord] = field(default_factory=list)
+
+
+def _host_record(host_node: ET.Element) -> Optional[HostRecord]:
+    status_node = host_node.find('status')
+    address_node = host_node.find('address')
+    if status_node is None or address_node is None:
+        return None
+
+    hostname_node = host_node.find('hostnames/hostname')
+    record = HostRecord(
+        address=address_node.get('addr'),
+        hostname=hostname_node.get('name') if hostname_node is not None else None,
+        status=status_node.get('state'),
+    )
+
+    for port_node in host_node.findall('ports/port'):
+        state_node = port_node.find('state')
+        if state_node is None or state_node.get('state') != 'open':
+            continue
+        service_node = port_node.find('service')
+        record.ports.append(PortRecord(
+            port_number=int(port_node.get('portid')),
+            protocol=port_node.get('protocol'),
+            state=state_node.get('state'),
+            service_name=service_node.get('name') if service_node is not None else None,
+            service_product=service_node.get('product') if service_node is not None else None,
+            service_version=service_node.get('version') if service_node is not None else None,
+        ))
+    return record
+
+
+def iter_nmap_hosts(source: Union[Path, str, IO[bytes]], up_only: bool = True) -> Iterator[HostRecord]:
+    """Stream ``HostRecord`` objects out of an Nmap ``-oX`` file.
+
+    ``source`` is a path or a binary file object. Each ``<host>`` element is
+    dropped from the tree as soon as it has been converted, so memory stays
+    flat regardless of the file size. Only open ports are kept. A truncated
+    or invalid document ends the stream after the last complete host.
     """
-    hosts: List[Host] = []
+    context = ET.iterparse(source, events=("start", "end"))
+    root: Optional[ET.Element] = None
     try:
-        root = ET.fromstring(xml_content)
+        for event, elem in context:
+            if root is None:
+                root = elem
+                continue
+            if event != "end" or elem.tag != "host":
+                continue
+            record = _host_record(elem)
+            # release the consumed <host> (and anything before it) from the root
+            root.clear()
+            if record is None or (up_only and record.status != "up"):
+                continue
+            yield record
     except ET.ParseError:
-        # Handle empty or invalid XML
-        return []
+        # empty, invalid or still-being-written XML: keep what we already yielded
+        return
 
-    for host_node in root.findall('host'):
-        status_node = host_node.find('status')
-        address_node = host_node.find('address')
 
-        if status_node is None or address_node is None:
-            continue
+class HostFollower:
+    """Incremental ``iter_nmap_hosts`` for an ``-oX`` file nmap is still writing.
 
-        host_status = status_node.get('state')
-        if host_status != 'up':
-            continue
+    ``poll()`` reads what was appended to ``path`` since the last call and
+    returns the hosts whose ``<host>`` element completed in it; ``feed()``
+    does the same for bytes from any other source, such as ``-oX -`` on a
+    pipe. A missing file reads as empty. Invalid XML stops the follower for
+    good: the batch's final ingestion still reads the whole file.
 
-        ip_address = address_node.get('addr')
+    ``poll()`` may run in worker threads: a call waits for one still in
+    flight (say, in a cancelled task's thread) and carries on after it.
+    """
 
-        hostname_node = host_node.find('hostnames/hostname')
-        hostname = hostname_node.get('name') if hostname_node is not None else None
+    def __init__(self, path: Optional[Path] = None, up_only: bool = True, read_size: int = 1024 * 1024) -> None:
+        self.path = path
+        self.up_only = up_only
+        self.read_size = read_size
+        self.offset = 0
+        self.failed = False
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root: Optional[ET.Element] = None
+        self._lock = threading.Lock()
 
-        host = Host(
-            address=ip_address,
-            hostname=hostname,
-            status=host_status,
-            ports=[]
-        )
+    def poll(self) -> List[HostRecord]:
+        records: List[HostRecord] = []
+        with self._lock:
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(self.offset)
+                    while not self.failed and (data := f.read(self.read_size)):
+                        self.offset += len(data)
+                        records.extend(self.feed(data))
+            except FileNotFoundError:
+                pass
+        return records
+
+    def feed(self, data: bytes) -> List[HostRecord]:
+        if self.failed:
+            return []
+        records: List[HostRecord] = []
+        try:
+            self._parser.feed(data)
+            for event, elem in self._parser.read_events():
+                if self._root is None:
+                    self._root = elem
+                    continue
+                if event != "end" or elem.tag != "host":
+                    continue
+                record = _host_record(elem)
+                self._root.clear()
+                if record is not None and not (self.up_only and record.status != "up"):
+                    records.append(record)
+        except ET.ParseError:
+            self.failed = True
+        return records
 
-        for port_node in host_node.findall('ports/port'):
-            state_node = port_node.find('state')
-            if state_node is None or state_node.get('state') != 'open':
-                continue
 
-            port_id = port_node.get('portid')
-            protocol = port_node.get('protocol')
-            port_state = state_node.get('state')
-
-            service_node = port_node.find('service')
-            service_name = service_node.get('name') if service_node is not None else None
-            service_product = service_node.get('product') if service_node is not None else None
-            service_version = service_node.get('version') if service_node is not None else None
-
-            port = Port(
-                port_number=int(port_id),
-                protocol=protocol,
-                state=port_state,
-                service_name=service_name,
-                service_product=service_product,
-                service_version=service_version,
+def host_from_record(record: HostRecord) -> Host:
+    """Build a transient ``Host`` (with its ``Port`` children) from ``record``."""
+    return Host(
+        address=record.address,
+        hostname=record.hostname,
+        status=record.status,
+        ports=[
+            Port(
+                port_number=p.port_number,
+                protocol=p.protocol,
+                state=p.state,
+                service_name=p.service_name,
+                service_product=p.service_product,
+                service_version=p.service_version,
             )
-            host.ports.append(port)
+            for p in record.ports
+        ],
+    )
+
+
+def parse_nmap_xml(source: XmlSource) -> List[Host]:
+    """
+    Parses Nmap XML output and returns a list of Host objects.
+    ``source`` may be the XML text itself, a ``Path`` or a binary file object.
+    Only hosts that are up and have at least one open port are returned.
+    These objects are not yet session-aware and must be added to a session
+    to be persisted.
+    """
+    if isinstance(source, str):
+        source = io.BytesIO(source.encode())
+    return [host_from_record(r) for r in iter_nmap_hosts(source) if r.ports]
+
+
+HOST_END = b"</host>"
 
-        if host.ports:
-            hosts.append(host)
 
-    return hosts
+class HostChunk(NamedTuple):
+    records: List[HostRecord]
+    # hosts parsed, before ``with_ports`` dropped the ones without open ports
+    seen: int
+
+
+def read_nmap_host_chunk(
+    path: Union[str, Path],
+    offset: int = 0,
+    max_hosts: int = 5000,
+    up_only: bool = True,
+    with_ports: bool = False,
+    read_size: int = 1024 * 1024,
+) -> Tuple[HostChunk, Optional[int]]:
+    """The hosts of at most ``max_hosts`` ``<host>`` elements after byte ``offset``.
+
+    The target of ``parse_pool`` workers: each call parses one slice of the
+    file, cut after a ``</host>`` tag, so neither side ever holds more than
+    one chunk of records. Returns the chunk and the ``offset`` of the next
+    call, or ``None`` once the file is exhausted. With ``with_ports`` hosts
+    without open ports are left out of ``records`` but counted in ``seen``. An absent file gives no hosts;
+    a truncated or invalid one ends after the last complete host.
+    """
+    path = Path(path)
+    if not path.exists():
+        return HostChunk([], 0), None
+    buf = b""
+    found = cut = 0
+    at_end = False
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while found < max_hosts:
+            data = f.read(read_size)
+            if not data:
+                at_end = True
+                break
+            # a tag may straddle two reads
+            start = max(len(buf) - len(HOST_END) + 1, 0)
+            buf += data
+            while found < max_hosts and (i := buf.find(HOST_END, start)) >= 0:
+                cut = start = i + len(HOST_END)
+                found += 1
+    if not found:
+        return HostChunk([], 0), None
+    follower = HostFollower(up_only=up_only)
+    # past the first chunk the <nmaprun> start tag is behind us: supply one
+    records = follower.feed(buf[:cut] if offset == 0 else b"<nmaprun>" + buf[:cut])
+    chunk = HostChunk([record for record in records if record.ports] if with_ports else records, len(records))
+    if follower.failed or (at_end and buf.find(HOST_END, cut) < 0):
+        return chunk, None
+    return chunk, offset + cut
@@ -0,0 +1,241 @@
+from __future__ import annotations
+import os
+import re
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, false, select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+
+# The batches table doubles as the scan job queue:
+#   pending   -> created but not runnable through the queue (legacy runner)
+#   queued    -> waiting for a worker
+#   running   -> leased by a worker/agent until lease_expires_at
+#   completed / failed / cancelled -> terminal
+#   split     -> a straggler cut short; its unfinished targets moved to child
+#                batches (parent_id)
+#
+# Claims are fair across projects (``pick_scan``): the project using the
+# fewest running batches per unit of ``Project.weight`` is served first, then
+# the scan with the highest ``priority``. Within a scan, port-scan and service
+# batches are claimed before discovery batches (the ``stage`` column), so
+# hosts found up by a pipeline scan are scanned right away.
+#
+# Workers in the API process and standalone agents (backend/agent.py) share
+# these functions, so several machines can drain the same queue. Claims are
+# serialized across all of them (``lock_claims``), so the limits hold
+# globally and not just per process.
+
+# tells this process apart from an earlier one that had the same hostname
+# and pid (a restarted container)
+BOOT_ID = uuid.uuid4().hex[:8]
+OWNER = re.compile(r"[^-]+-(?P<host>.+?)-(?P<pid>\d+)(?:-(?P<boot>[0-9a-f]{8}))?")
+
+def default_owner(prefix: str = "api") -> str:
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}-{BOOT_ID}"
+
+def owner_alive(owner: str) -> Optional[bool]:
+    """Whether the process behind a ``default_owner()`` lease still runs.
+
+    A lease with this process's pid but another boot id was taken by an
+    earlier process (before a restart reused the pid), so it is dead.
+    ``None`` when that cannot be checked from here (another host, or a
+    custom ``--agent-id``); those leases are left to expire.
+    """
+    m = OWNER.fullmatch(owner)
+    if m is None or m["host"] != socket.gethostname():
+        return None
+    pid = int(m["pid"])
+    if pid == os.getpid():
+        return m["boot"] == BOOT_ID
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# pg_advisory_xact_lock key of the claim lock
+CLAIM_LOCK = 0x6E736F01
+
+async def lock_claims(session: AsyncSession) -> None:
+    """Take the claim lock for the rest of ``session``'s transaction.
+
+    PostgreSQL uses a transaction-level advisory lock; on SQLite a write
+    that matches no row takes the database's write lock. Either way the
+    lock is released by the commit that ends the claim.
+    """
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql":
+        await session.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK)))
+    else:
+        await session.execute(update(models.Batch).where(false()).values(status=models.Batch.status))
+
+async def scheduler_state(session: AsyncSession) -> dict[int, dict]:
+    """Scheduling inputs for every scan with queued or running batches.
+
+    ``{scan_id: {"project_id", "weight", "priority", "concurrency", "queued", "running"}}``
+    where ``weight`` is the project's and ``priority``/``concurrency`` come
+    from the scan's params.
+    """
+    counts = await session.execute(
+        select(models.Batch.scan_id, models.Batch.status, func.count())
+        .where(models.Batch.status.in_(("queued", "running")))
+        .group_by(models.Batch.scan_id, models.Batch.status)
+    )
+    scans: dict[int, dict] = {}
+    for scan_id, status, n in counts:
+        scans.setdefault(scan_id, {"queued": 0, "running": 0})[status] = n
+    if not scans:
+        return scans
+    rows = await session.execute(
+        select(models.Scan.id, models.Scan.project_id, models.Scan.params_json, models.Project.weight)
+        .join(models.Project, models.Scan.project_id == models.Project.id)
+        .where(models.Scan.id.in_(scans))
+    )
+    for scan_id, project_id, params, weight in rows:
+        params = params or {}
+        scans[scan_id].update(
+            project_id=project_id,
+            weight=weight or 1.0,
+            priority=params.get("priority", 0),
+            concurrency=params.get("concurrency"),
+        )
+    # scans whose row vanished (deleted mid-claim) are not scheduled
+    return {scan_id: s for scan_id, s in scans.items() if "project_id" in s}
+
+def project_usage(scans: dict[int, dict]) -> dict[int, float]:
+    """Running batches per project divided by the project's weight."""
+    usage: dict[int, float] = {}
+    for s in scans.values():
+        usage[s["project_id"]] = usage.get(s["project_id"], 0.0) + s["running"] / s["weight"]
+    return usage
+
+def pick_scan(scans: dict[int, dict], slots: int = 0, scan_cap: int = 0) -> Optional[int]:
+    """The scan whose batch should run next, or ``None``.
+
+    Weighted fair queuing across projects: the project whose running
+    batches per unit of weight would be lowest after this claim goes first;
+    within it, the highest ``priority``, then the scan with the fewest
+    running batches, then the oldest. Scans at their
+    ``concurrency`` or at ``scan_cap`` running batches are skipped, and
+    nothing runs once ``slots`` batches run in total (0: no limit).
+    """
+    if slots and sum(s["running"] for s in scans.values()) >= slots:
+        return None
+    usage = project_usage(scans)
+    eligible = [
+        (scan_id, s) for scan_id, s in scans.items()
+        if s["queued"]
+        and not (s["concurrency"] and s["running"] >= s["concurrency"])
+        and not (scan_cap and s["running"] >= scan_cap)
+    ]
+    if not eligible:
+        return None
+    def order(item):
+        scan_id, s = item
+        finish = usage[s["project_id"]] + 1 / s["weight"]
+        return finish, -s["priority"], s["running"], scan_id
+    return min(eligible, key=order)[0]
+
+async def claim_batch(
+    session: AsyncSession, owner: str, lease_seconds: float, slots: int = 0, scan_cap: int = 0
+) -> Optional[models.Batch]:
+    """Lease the next ``queued`` batch to ``owner`` and return it.
+
+    ``pick_scan`` chooses the scan (fair share across projects, scan
+    priority, ``concurrency``, and the ``slots``/``scan_cap`` budget); its
+    oldest batch is taken, ``scan`` and ``service`` stage batches before
+    ``discovery`` ones.
+
+    The counts are read and the batch is taken under ``lock_claims``, so
+    claims from other processes (API workers, agents) wait their turn
+    instead of reading the same counts and overshooting ``slots``,
+    ``scan_cap`` or a scan's ``concurrency``. The claim itself is a single
+    ``UPDATE ... WHERE id = (SELECT ... LIMIT 1) RETURNING id``; on
+    PostgreSQL the sub-select also takes ``FOR UPDATE SKIP LOCKED``.
+    Returns ``None`` when nothing is runnable.
+    """
+    await lock_claims(session)
+    scan_id = pick_scan(await scheduler_state(session), slots, scan_cap)
+    if scan_id is None:
+        await session.commit()
+        return None
+    candidate = (
+        select(models.Batch.id)
+        .where(models.Batch.status == "queued", models.Batch.scan_id == scan_id)
+        .order_by(case((models.Batch.stage == "discovery", 1), else_=0), models.Batch.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+
+    now = datetime.utcnow()
+    batch_id = (await session.execute(
+        update(models.Batch)
+        .where(models.Batch.id == candidate.scalar_subquery(), models.Batch.status == "queued")
+        .values(
+            status="running",
+            started_at=now,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=models.Batch.attempts + 1,
+        )
+        .returning(models.Batch.id)
+    )).scalar_one_or_none()
+    await session.commit()
+    if batch_id is None:
+        return None
+    return await session.get(models.Batch, batch_id)
+
+async def renew_lease(session: AsyncSession, batch_id: int, owner: str, lease_seconds: float) -> bool:
+    """Heartbeat: extend ``owner``'s lease. ``False`` means the lease was lost."""
+    result = await session.execute(
+        update(models.Batch)
+        .where(models.Batch.id == batch_id, models.Batch.status == "running", models.Batch.lease_owner == owner)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+async def requeue_batch(session: AsyncSession, batch_id: int, owner: Optional[str] = None) -> None:
+    """Hand a ``running`` batch back to the queue (e.g. on worker shutdown)."""
+    query = update(models.Batch).where(models.Batch.id == batch_id, models.Batch.status == "running")
+    if owner is not None:
+        query = query.where(models.Batch.lease_owner == owner)
+    await session.execute(query.values(status="queued", started_at=None, lease_owner=None, lease_expires_at=None))
+    await session.commit()
+
+async def requeue_expired_leases(session: AsyncSession, max_attempts: int) -> list[tuple[int, int, str]]:
+    """Re-queue running batches whose lease ran out (their worker died).
+
+    Batches that already used ``max_attempts`` claims are marked ``failed``
+    instead. Returns ``(batch_id, scan_id, new_status)`` for every batch
+    touched.
+    """
+    now = datetime.utcnow()
+    expired = (await session.execute(
+        select(models.Batch.id, models.Batch.scan_id, models.Batch.attempts)
+        .where(models.Batch.status == "running", models.Batch.lease_expires_at < now)
+    )).all()
+    touched = []
+    for batch_id, scan_id, attempts in expired:
+        status = "failed" if attempts >= max_attempts else "queued"
+        values = {"status": status, "lease_owner": None, "lease_expires_at": None}
+        values.update({"finished_at": now} if status == "failed" else {"started_at": None})
+        result = await session.execute(
+            update(models.Batch)
+            .where(models.Batch.id == batch_id, models.Batch.status == "running", models.Batch.lease_expires_at < now)
+            .values(**values)
+        )
+        if result.rowcount:
+            touched.append((batch_id, scan_id, status))
+    await session.commit()
+    return touched
+
+async def queue_depth(session: AsyncSession) -> int:
+    return (await session.execute(
+        select(func.count()).select_from(models.Batch).where(models.Batch.status == "queued")
+    )).scalar_one()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Set
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from .models import Host, Port
+
+if TYPE_CHECKING:
+    from ..domain.xml_parser import HostRecord
+
+PORT_COLUMNS = (
+    "host_id", "port_number", "protocol", "state",
+    "service_name", "service_product", "service_version",
+)
+_SQLITE_PORT_INSERT = (
+    f"INSERT INTO {Port.__tablename__} ({', '.join(PORT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in PORT_COLUMNS)})"
+)
+
+
+def _batched(records: Iterable["HostRecord"], size: int) -> Iterator[List["HostRecord"]]:
+    it = iter(records)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+async def _copy_ports(conn: AsyncConnection, rows: list[tuple]) -> None:
+    # psycopg 3 COPY on the session's own connection/transaction
+    raw = await conn.get_raw_connection()
+    cols = ", ".join(PORT_COLUMNS)
+    async with raw.driver_connection.cursor() as cur:
+        async with cur.copy(f"COPY {Port.__tablename__} ({cols}) FROM STDIN") as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+
+async def bulk_insert_hosts(
+    session: AsyncSession,
+    scan_id: int,
+    records: Iterable["HostRecord"],
+    batch_size: int = 1000,
+    batch_id: Optional[int] = None,
+) -> list[int]:
+    """Insert ``records`` (``HostRecord``-like objects) and their ports for ``scan_id``.
+
+    Hosts go in as multi-row ``INSERT ... RETURNING id`` per ``batch_size``
+    records; ports use ``COPY`` on PostgreSQL and one driver-level
+    executemany on SQLite. No ORM objects are created. Returns the new host
+    ids in input order; the caller commits. ``batch_id`` is stored on the
+    hosts (see ``stored_addresses``).
+    """
+    conn = await session.connection()
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        host_stmt = insert(Host).returning(Host.id, sort_by_parameter_order=True)
+    else:
+        # SQLite gives no ordering guarantee for RETURNING and sorting falls
+        # back to row-at-a-time inserts, so match ids back by address instead
+        host_stmt = insert(Host).returning(Host.id, Host.address)
+    host_ids: list[int] = []
+
+    for batch in _batched(records, batch_size):
+        result = await conn.execute(host_stmt, [
+            {"scan_id": scan_id, "batch_id": batch_id, "address": r.address, "hostname": r.hostname, "status": r.status}
+            for r in batch
+        ])
+        if dialect == "postgresql":
+            ids = list(result.scalars())
+        else:
+            by_address: dict[str, list[int]] = {}
+            for host_id, address in result:
+                by_address.setdefault(address, []).append(host_id)
+            ids = [by_address[r.address].pop() for r in batch]
+        host_ids.extend(ids)
+
+        rows = [
+            (host_id, p.port_number, p.protocol, p.state, p.service_name, p.service_product, p.service_version)
+            for host_id, r in zip(ids, batch)
+            for p in r.ports
+        ]
+        if not rows:
+            continue
+        if dialect == "postgresql":
+            await _copy_ports(conn, rows)
+        elif dialect == "sqlite":
+            await conn.exec_driver_sql(_SQLITE_PORT_INSERT, rows)
+        else:
+            await conn.execute(insert(Port), [dict(zip(PORT_COLUMNS, row)) for row in rows])
+
+    return host_ids
+
+
+async def stored_addresses(session: AsyncSession, batch_id: int) -> Set[str]:
+    """Addresses of the hosts already stored for ``batch_id``."""
+    rows = await session.execute(select(Host.address).where(Host.batch_id == batch_id))
+    return set(rows.scalars())
+
+
+async def delete_batch_hosts(session: AsyncSession, batch_id: int) -> None:
+    """Delete the hosts stored for ``batch_id`` and their ports; the caller commits."""
+    hosts = select(Host.id).where(Host.batch_id == batch_id).scalar_subquery()
+    await session.execute(delete(Port).where(Port.host_id.in_(hosts)))
+    await session.execute(delete(Host).where(Host.batch_id == batch_id))
+
+
+async def bulk_update_services(session: AsyncSession, scan_id: int, records: Iterable["HostRecord"]) -> int:
+    """Fill the service fields of ``scan_id``'s existing ``Port`` rows from ``records``.
+
+    Ports are matched on host address, port number and protocol; nothing is
+    inserted. One ``SELECT`` finds the row ids and one executemany
+    ``UPDATE`` by primary key writes them. Returns the number of ports
+    updated; the caller commits.
+    """
+    found = {(r.address, p.port_number, p.protocol): p for r in records for p in r.ports}
+    if not found:
+        return 0
+    rows = await session.execute(
+        select(Port.id, Host.address, Port.port_number, Port.protocol)
+        .join(Host, Port.host_id == Host.id)
+        .where(Host.scan_id == scan_id, Host.address.in_(sorted({address for address, _, _ in found})))
+    )
+    params = []
+    for port_id, address, number, protocol in rows:
+        p = found.get((address, number, protocol))
+        if p is not None:
+            params.append({
+                "id": port_id,
+                "service_name": p.service_name,
+                "service_product": p.service_product,
+                "service_version": p.service_version,
+            })
+    if params:
+        await session.execute(update(Port), params)
+    return len(params)
@@ -2,23 +2,38 @@ from __future__ import annotations
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import event, text
+from ..app.settings import settings
 
-DATABASE_URL = "sqlite+aiosqlite:///./data/state.db"
+DATABASE_URL = settings.database_url
 
 class Base(DeclarativeBase):
     pass
 
+def engine_options(url: str) -> dict:
+    """Pool settings from ``Settings``; in-memory SQLite keeps SQLAlchemy's static pool."""
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
 engine = create_async_engine(
     DATABASE_URL,
     future=True,
+    **engine_options(DATABASE_URL),
 )
 
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 # Enable WAL each time we establish a (sync) connection underneath.
-@event.listens_for(engine.sync_engine, "connect")
-def set_sqlite_pragma(dbapi_conn, _):
-    cursor = dbapi_conn.cursor()
-    cursor.execute("PRAGMA journal_mode=WAL;")
-    cursor.execute("PRAGMA synchronous=NORMAL;")
-    cursor.close()
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragma(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL;")
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.close()
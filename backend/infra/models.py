@@ -2,7 +2,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, String, Integer, DateTime, Text, JSON
+from sqlalchemy import ForeignKey, String, Integer, Float, DateTime, Text, JSON, Index
 from .db import Base
 
 class Project(Base):
@@ -11,6 +11,10 @@ class Project(Base):
     name: Mapped[str] = mapped_column(String(200), unique=True, index=True)
     description: Mapped[Optional[str]] = mapped_column(Text, default=None)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # seconds a cached result stays reusable for this project's scans (None: no reuse)
+    cache_max_age: Mapped[Optional[float]] = mapped_column(Float, default=None)
+    # share of the scan workers relative to other projects (see infra/batch_queue.py)
+    weight: Mapped[float] = mapped_column(Float, default=1.0)
     targets: Mapped[list["Target"]] = relationship(back_populates="project")
     scans: Mapped[list["Scan"]] = relationship(back_populates="project")
 
@@ -27,9 +31,13 @@ class Scan(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True)
     params_json: Mapped[dict] = mapped_column(JSON)
+    # result_cache.flags_key of the scan's nmap flags (see batch_sizing)
+    flags_key: Mapped[Optional[str]] = mapped_column(String(64), index=True, default=None)
     status: Mapped[str] = mapped_column(String(32), index=True, default="running")
     started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    # adaptive batching: targets already cut into batches (see scan_coordinator.refill_scan)
+    target_cursor: Mapped[Optional[int]] = mapped_column(Integer, default=None)
     project: Mapped["Project"] = relationship(back_populates="scans")
     batches: Mapped[list["Batch"]] = relationship(back_populates="scan")
     hosts: Mapped[List["Host"]] = relationship(back_populates="scan")
@@ -39,10 +47,21 @@ class Batch(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     scan_id: Mapped[int] = mapped_column(ForeignKey("scans.id"), index=True)
     status: Mapped[str] = mapped_column(String(32), index=True, default="pending")
+    # "discovery" batches feed live hosts into "scan" batches, which feed
+    # open ports into "service" batches (see scan_coordinator)
+    stage: Mapped[str] = mapped_column(String(16), default="scan")
+    # set on the pieces of a resumed or split batch
+    parent_id: Mapped[Optional[int]] = mapped_column(ForeignKey("batches.id"), default=None, index=True)
     target_count: Mapped[int] = mapped_column(Integer, default=0)
     args_json: Mapped[dict] = mapped_column(JSON)
     started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
     finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    # set while a worker or agent holds the batch (see infra/batch_queue.py)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(128), default=None)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None, index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    # latest nmap --stats-every report while running (see domain/progress.py)
+    progress: Mapped[Optional[dict]] = mapped_column(JSON, default=None)
     scan: Mapped["Scan"] = relationship(back_populates="batches")
     result_raw: Mapped[Optional["ResultRaw"]] = relationship(back_populates="batch", uselist=False)
 
@@ -63,6 +82,8 @@ class Host(Base):
     address: Mapped[str] = mapped_column(String(255), index=True)
     hostname: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     status: Mapped[str] = mapped_column(String(32), index=True)
+    # batch that stored the host (None for hosts copied from the result cache)
+    batch_id: Mapped[Optional[int]] = mapped_column(ForeignKey("batches.id"), default=None, index=True)
     scan: Mapped["Scan"] = relationship(back_populates="hosts")
     ports: Mapped[List["Port"]] = relationship(back_populates="host")
 
@@ -77,3 +98,20 @@ class Port(Base):
     service_product: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
     service_version: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
     host: Mapped["Host"] = relationship(back_populates="ports")
+
+class CachedResult(Base):
+    """Latest scan of one target with one set of flags (see domain/result_cache.py)."""
+    __tablename__ = "result_cache"
+    __table_args__ = (
+        Index("ux_result_cache_key", "project_id", "flags_key", "addr_key", unique=True),
+        Index("ix_result_cache_fresh", "project_id", "flags_key", "scanned_at"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"))
+    # sha256 hex digest of the normalized flags (see result_cache.flags_key)
+    flags_key: Mapped[str] = mapped_column(String(64))
+    addr_key: Mapped[str] = mapped_column(String(255))
+    scan_id: Mapped[int] = mapped_column(ForeignKey("scans.id"))
+    # None when the target was down or had no open ports
+    host_id: Mapped[Optional[int]] = mapped_column(ForeignKey("hosts.id"), default=None)
+    scanned_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
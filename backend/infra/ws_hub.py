@@ -1,44 +1,418 @@
 from __future__ import annotations
-from typing import Dict, Set
+import asyncio
+import json
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from fastapi import WebSocket
+from ..app.settings import settings
+from .ws_pubsub import encode as _encode, make_pubsub
+
+POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# close code for consumers dropped by the "disconnect" policy (RFC 6455: try again later)
+SLOW_CONSUMER_CLOSE = 1013
+
+# events carrying nmap output; the coalesce policy may fold these
+LOG_EVENTS = ("line", "lines")
+# after these a scan's stream is finished and its replay buffer may be evicted first
+FINAL_EVENTS = ("scan_complete", "scan_stopped")
+
+# (event name, encoded frame, log lines in it)
+Frame = Tuple[str, str, int]
+
+
+class _Client:
+    """One connection's bounded outbound queue and the task draining it."""
+
+    def __init__(self, scan_id: int, ws: WebSocket, maxsize: int, policy: str) -> None:
+        self.scan_id = scan_id
+        self.ws = ws
+        self.maxsize = maxsize
+        self.policy = policy
+        # (event name, encoded frame or ``lines_skipped`` count, log lines in it)
+        self.queue: Deque[Tuple[str, Union[str, int], int]] = deque()
+        # frames at the head of the queue, up to the end of a replay, that do
+        # not count against ``maxsize``
+        self.backlog = 0
+        self.sent = 0
+        self.dropped = 0
+        self.closing = False
+        self._ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def offer(self, event: str, text: str, lines: int = 0) -> None:
+        """Enqueue a frame without waiting; apply the slow-consumer policy when full."""
+        if self.closing:
+            return
+        if len(self.queue) >= self.maxsize + self.backlog:
+            if self.policy == "disconnect":
+                self.dropped += len(self.queue) + 1
+                self.queue.clear()
+                self.backlog = 0
+                self.closing = True
+                self._ready.set()
+                return
+            if self.policy != "coalesce" or not self._coalesce():
+                self._pop()
+                self.dropped += 1
+        self.queue.append((event, text, lines))
+        self._ready.set()
+
+    def preload(self, frames: Iterable[Frame]) -> None:
+        """Queue replayed frames ahead of live ones, outside the size bound.
+
+        The allowance shrinks as they leave the queue, so once the backlog
+        is sent live frames face the configured bound again.
+        """
+        self.queue.extend(frames)
+        self.backlog = len(self.queue)
+        self._ready.set()
+
+    def _pop(self):
+        if self.backlog:
+            self.backlog -= 1
+        return self.queue.popleft()
+
+    def _coalesce(self) -> bool:
+        # Fold queued ``line`` frames (and earlier notices) into one
+        # ``lines_skipped`` notice, keeping every other event in order.
+        # False when there were no lines to fold.
+        lines = sum(n for event, _, n in self.queue if event in LOG_EVENTS)
+        if not lines:
+            return False
+        skipped = lines + sum(n for event, n, _ in self.queue if event == "lines_skipped")
+        kept = deque(item for item in self.queue if item[0] not in LOG_EVENTS + ("lines_skipped",))
+        kept.append(("lines_skipped", skipped, 0))
+        self.queue = kept
+        self.backlog = min(self.backlog, len(kept))
+        self.dropped += lines
+        return True
+
+    async def run(self, on_exit) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                if self.closing:
+                    await self.ws.close(code=SLOW_CONSUMER_CLOSE)
+                    return
+                while self.queue:
+                    event, text, _ = self._pop()
+                    if event == "lines_skipped":
+                        text = _encode({"event": event, "scan_id": self.scan_id, "count": text})
+                    await self.ws.send_text(text)
+                    self.sent += 1
+                if not self.closing:
+                    self._ready.clear()
+        except Exception:
+            # the socket went away; the receive loop will see the disconnect
+            pass
+        finally:
+            on_exit(self.scan_id, self.ws)
+
+    def stats(self) -> dict:
+        return {
+            "scan_id": self.scan_id,
+            "queue_depth": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "policy": self.policy,
+        }
+
+
+class _ScanStream:
+    """Sequence counter, pending line window and replay buffer of one scan."""
+
+    def __init__(self, scan_id: int) -> None:
+        self.scan_id = scan_id
+        self.seq = 0
+        self.finished = False
+        self.pending: List[dict] = []
+        self.pending_bytes = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        # (first seq, last seq, frame)
+        self.replay: Deque[Tuple[int, int, Frame]] = deque()
+        self.replay_bytes = 0
+
+    def record(self, first: int, last: int, frame: Frame) -> None:
+        self.replay.append((first, last, frame))
+        self.replay_bytes += len(frame[1])
+
+    def drop_oldest(self) -> int:
+        _, _, frame = self.replay.popleft()
+        self.replay_bytes -= len(frame[1])
+        return len(frame[1])
+
+    def clear(self) -> int:
+        freed, self.replay_bytes = self.replay_bytes, 0
+        self.replay.clear()
+        return freed
+
+    def first_seq(self) -> Optional[int]:
+        return self.replay[0][0] if self.replay else None
+
+    def since(self, seq: int) -> List[Frame]:
+        """Buffered frames holding anything after ``seq``."""
+        frames = []
+        for first, last, frame in self.replay:
+            if last <= seq:
+                continue
+            if first <= seq:
+                # a lines frame straddling ``seq``: resend only the newer lines
+                message = json.loads(frame[1])
+                message["lines"] = [entry for entry in message["lines"] if entry["seq"] > seq]
+                frame = (frame[0], _encode(message), len(message["lines"]))
+            frames.append(frame)
+        return frames
+
+    def cancel_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.timer_loop = None
+
 
 class WSConnectionManager:
-    """Track WebSocket connections grouped by ``scan_id``."""
+    """Track WebSocket connections grouped by ``scan_id``.
 
-    def __init__(self) -> None:
-        # scan_id -> set of websockets
-        self._rooms: Dict[int, Set[WebSocket]] = {}
+    Each connection gets a bounded outbound queue drained by its own sender
+    task, so ``broadcast`` never waits on a socket: it encodes the message
+    once and appends it to every queue in the room. When a queue is full the
+    slow-consumer ``policy`` applies:
 
-    async def connect(self, scan_id: int, ws: WebSocket):
-        """Register ``ws`` under ``scan_id`` and accept the connection."""
+    ``drop_oldest``
+        discard the oldest queued frame.
+    ``coalesce``
+        replace the queued ``line``/``lines`` frames with one
+        ``lines_skipped`` notice carrying their line count, keeping every
+        other event.
+    ``disconnect``
+        close the socket with code 1013 (try again later).
 
-        await ws.accept()
-        self._rooms.setdefault(scan_id, set()).add(ws)
+    Nmap output goes through ``publish_line``, which collects a scan's lines
+    for up to ``line_window_ms`` milliseconds or ``line_window_bytes`` bytes
+    and sends them as one ``lines`` frame. A window of 0 sends each line as
+    its own ``line`` event.
 
-    def disconnect(self, scan_id: int, ws: WebSocket):
-        """Remove ``ws`` from the ``scan_id`` room if present."""
+    Every event and every line gets the next ``seq`` of its scan, and sent
+    frames are kept in a per-scan replay buffer of at most
+    ``replay_scan_bytes``. A client connecting with ``since`` first receives
+    the buffered frames after that ``seq``. All buffers together stay under
+    ``replay_total_bytes``: finished scans are evicted least recently used
+    first, then the oldest frames of the least recently used running scans.
+
+    Frames travel through ``pubsub`` between producing and delivering:
+    in-process by default, or through Redis (``NSO_WS_PUBSUB_URL``) so every
+    API worker and agent reaches the clients of every other one. Sequence
+    numbers are assigned by the pub/sub backend.
+    """
+
+    def __init__(
+        self,
+        queue_size: int | None = None,
+        policy: str | None = None,
+        line_window_ms: float | None = None,
+        line_window_bytes: int | None = None,
+        replay_scan_bytes: int | None = None,
+        replay_total_bytes: int | None = None,
+        pubsub=None,
+    ) -> None:
+        self.queue_size = queue_size or settings.ws_queue_size
+        self.policy = policy or settings.ws_slow_policy
+        if self.policy not in POLICIES:
+            raise ValueError(f"unknown slow consumer policy {self.policy!r}; expected one of {POLICIES}")
+        self.line_window = (settings.ws_line_window_ms if line_window_ms is None else line_window_ms) / 1000
+        self.line_window_bytes = line_window_bytes or settings.ws_line_window_bytes
+        self.replay_scan_bytes = settings.ws_replay_scan_bytes if replay_scan_bytes is None else replay_scan_bytes
+        self.replay_total_bytes = settings.ws_replay_total_bytes if replay_total_bytes is None else replay_total_bytes
+        # scan_id -> {websocket: client}
+        self._rooms: Dict[int, Dict[WebSocket, _Client]] = {}
+        # scan_id -> stream, least recently used first
+        self._streams: "OrderedDict[int, _ScanStream]" = OrderedDict()
+        self._replay_bytes = 0
+        self.pubsub = pubsub or make_pubsub(settings.ws_pubsub_url, settings.ws_pubsub_outbox)
+        self.pubsub.attach(self._deliver)
+        self._pending_unsubscribes: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await self.pubsub.start()
+
+    async def close(self) -> None:
+        for stream in self._streams.values():
+            self.flush_lines(stream.scan_id)
+        clients = [c for room in self._rooms.values() for c in room.values() if c.task]
+        self._rooms.clear()
+        for client in clients:
+            client.task.cancel()
+        await asyncio.gather(*(c.task for c in clients), *self._pending_unsubscribes, return_exceptions=True)
+        await self.pubsub.close()
+
+    def _stream(self, scan_id: int) -> _ScanStream:
+        stream = self._streams.get(scan_id)
+        if stream is None:
+            stream = self._streams[scan_id] = _ScanStream(scan_id)
+        else:
+            self._streams.move_to_end(scan_id)
+        return stream
+
+    async def connect(self, scan_id: int, ws: WebSocket, since: int | None = None):
+        """Accept ``ws``, register it under ``scan_id`` and greet it with ``connected``.
 
+        With ``since``, buffered events after that ``seq`` are replayed
+        before live ones; ``replay_truncated`` precedes them when older
+        events were already evicted or never reached this process (it was
+        not subscribed while they were published).
+        """
+
+        await ws.accept()
+        await self.pubsub.subscribe(scan_id)
+        stream = self._stream(scan_id)
+        latest = await self.pubsub.latest_seq(scan_id)
+        if latest > stream.seq:
+            # frames published while no local client was subscribed: the
+            # buffer no longer runs up to the present, so it cannot be replayed
+            self._replay_bytes -= stream.clear()
+            stream.seq = latest
+        client = _Client(scan_id, ws, self.queue_size, self.policy)
+        self._rooms.setdefault(scan_id, {})[ws] = client
+        client.offer("connected", _encode({"event": "connected", "scan_id": scan_id, "seq": stream.seq}))
+        if since is not None:
+            first = stream.first_seq()
+            if stream.seq > since and (first is None or first > since + 1):
+                notice = {"event": "replay_truncated", "scan_id": scan_id, "since": since, "first_seq": first}
+                client.offer("replay_truncated", _encode(notice))
+            client.preload(stream.since(since))
+        client.task = asyncio.create_task(client.run(self._forget))
+
+    def _forget(self, scan_id: int, ws: WebSocket) -> None:
         room = self._rooms.get(scan_id)
         if room and ws in room:
-            room.remove(ws)
+            del room[ws]
             if not room:
                 self._rooms.pop(scan_id, None)
+                task = asyncio.ensure_future(self.pubsub.unsubscribe(scan_id))
+                self._pending_unsubscribes.add(task)
+                task.add_done_callback(self._pending_unsubscribes.discard)
+
+    def disconnect(self, scan_id: int, ws: WebSocket):
+        """Remove ``ws`` from the ``scan_id`` room and stop its sender, if present."""
+
+        client = self._rooms.get(scan_id, {}).get(ws)
+        self._forget(scan_id, ws)
+        if client and client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
 
     async def broadcast(self, scan_id: int, message: dict):
-        """Send ``message`` as JSON to all sockets registered for ``scan_id``.
+        """Queue ``message`` for every socket registered for ``scan_id``.
 
-        Connections that fail to receive the message are pruned from the
-        registry to keep the manager clean.
+        The message is published with the scan's next ``seq``, serialized
+        once and recorded for replay; nothing here waits on a client.
         """
 
-        room = self._rooms.get(scan_id, set())
-        to_drop = []
-        for ws in list(room):
-            try:
-                await ws.send_json(message)
-            except Exception:
-                to_drop.append(ws)
-        for ws in to_drop:
-            self.disconnect(scan_id, ws)
+        stream = self._streams.get(scan_id)
+        if stream is not None and stream.pending:
+            # keep order: buffered output goes out before e.g. batch_complete
+            self.flush_lines(scan_id)
+        self.pubsub.publish(scan_id, dict(message), int(message.get("event") == "line"))
+
+    def _deliver(self, scan_id: int, first: int, last: int, event: str, lines: int, text: str) -> None:
+        """Record a numbered frame from the pub/sub backend and queue it for local clients."""
+
+        stream = self._stream(scan_id)
+        if stream.replay and first > stream.seq + 1:
+            # missed frames in between: keep the buffer contiguous
+            self._replay_bytes -= stream.clear()
+        stream.seq = max(stream.seq, last)
+        if event in FINAL_EVENTS:
+            stream.finished = True
+        frame = (event, text, lines)
+        if self.replay_scan_bytes:
+            stream.record(first, last, frame)
+            self._replay_bytes += len(frame[1])
+            while stream.replay_bytes > self.replay_scan_bytes:
+                self._replay_bytes -= stream.drop_oldest()
+            self._evict()
+        for client in list(self._rooms.get(stream.scan_id, {}).values()):
+            client.offer(*frame)
+
+    def _evict(self) -> None:
+        if self._replay_bytes <= self.replay_total_bytes:
+            return
+        for scan_id, stream in list(self._streams.items()):
+            if not stream.finished:
+                continue
+            self._replay_bytes -= stream.clear()
+            if scan_id not in self._rooms:
+                del self._streams[scan_id]
+            if self._replay_bytes <= self.replay_total_bytes:
+                return
+        for stream in self._streams.values():
+            while stream.replay and self._replay_bytes > self.replay_total_bytes:
+                self._replay_bytes -= stream.drop_oldest()
+            if self._replay_bytes <= self.replay_total_bytes:
+                return
+
+    async def publish_line(self, scan_id: int, batch_id: int, line: str):
+        """Send one line of nmap output, coalesced with the scan's other lines."""
+
+        await self.publish_lines(scan_id, batch_id, [line])
+
+    async def publish_lines(self, scan_id: int, batch_id: int, lines: Sequence[str]):
+        """Send a batch of nmap output lines (as read by the runner) at once."""
+
+        if not lines:
+            return
+        if not self.line_window:
+            for line in lines:
+                self.pubsub.publish(scan_id, {"event": "line", "batch_id": batch_id, "line": line}, 1)
+            return
+        stream = self._stream(scan_id)
+        loop = asyncio.get_running_loop()
+        if stream.pending and stream.timer_loop is not loop:
+            # left over from a loop that is gone (tests); its timer never fires
+            self.flush_lines(scan_id)
+        was_empty = not stream.pending
+        stream.pending.extend({"batch_id": batch_id, "line": line} for line in lines)
+        stream.pending_bytes += sum(map(len, lines))
+        if stream.pending_bytes >= self.line_window_bytes:
+            self.flush_lines(scan_id)
+        elif was_empty:
+            stream.timer = loop.call_later(self.line_window, self.flush_lines, scan_id)
+            stream.timer_loop = loop
+
+    def flush_lines(self, scan_id: int) -> None:
+        """Send the scan's buffered lines now as one ``lines`` frame."""
+
+        stream = self._streams.get(scan_id)
+        if stream is None or not stream.pending:
+            return
+        lines, stream.pending, stream.pending_bytes = stream.pending, [], 0
+        stream.cancel_timer()
+        self.pubsub.publish(scan_id, {"event": "lines", "scan_id": scan_id, "lines": lines}, len(lines))
+
+    def stats(self) -> dict:
+        """Per-connection queue depth and send/drop counters, and replay buffer use."""
+
+        clients = [c.stats() for room in self._rooms.values() for c in room.values()]
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "connections": clients,
+            "subscriptions": self.pubsub.channels(),
+            "pubsub": self.pubsub.stats(),
+            "replay": {
+                "bytes": self._replay_bytes,
+                "limit": self.replay_total_bytes,
+                "scans": [
+                    {
+                        "scan_id": stream.scan_id,
+                        "first_seq": stream.first_seq(),
+                        "last_seq": stream.seq,
+                        "bytes": stream.replay_bytes,
+                        "finished": stream.finished,
+                    }
+                    for stream in self._streams.values()
+                ],
+            },
+        }
 
 ws_manager = WSConnectionManager()
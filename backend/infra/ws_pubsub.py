@@ -0,0 +1,215 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import json
+import logging
+from typing import Callable, Dict, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+# handler(scan_id, first seq, last seq, event, log lines in frame, encoded frame)
+Deliver = Callable[[int, int, int, str, int, str], None]
+
+
+def encode(message: dict) -> str:
+    # same compact form as Starlette's send_json
+    return json.dumps(message, separators=(",", ":"))
+
+
+def stamp(message: dict, last: int, lines: int) -> Tuple[int, str]:
+    """Number ``message`` with the seq range ending at ``last`` and encode it."""
+    first = last - max(lines, 1) + 1
+    if message.get("event") == "lines":
+        for offset, entry in enumerate(message["lines"]):
+            entry["seq"] = first + offset
+    message["seq"] = last
+    return first, encode(message)
+
+
+class InProcessPubSub:
+    """Deliver published frames straight back to the local manager.
+
+    The default: one API process, no subscriptions needed. Every frame is
+    delivered, so late joiners can replay scans they never subscribed to.
+    """
+
+    def __init__(self) -> None:
+        self._deliver: Optional[Deliver] = None
+        self._seq: Dict[int, int] = {}
+
+    def attach(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def publish(self, scan_id: int, message: dict, lines: int = 0) -> None:
+        last = self._seq[scan_id] = self._seq.get(scan_id, 0) + max(lines, 1)
+        first, text = stamp(message, last, lines)
+        self._deliver(scan_id, first, last, message.get("event", ""), lines, text)
+
+    async def latest_seq(self, scan_id: int) -> int:
+        """The last ``seq`` handed out for ``scan_id`` by any producer."""
+        return self._seq.get(scan_id, 0)
+
+    async def subscribe(self, scan_id: int) -> None:
+        pass
+
+    async def unsubscribe(self, scan_id: int) -> None:
+        pass
+
+    def channels(self) -> list[int]:
+        return []
+
+    def stats(self) -> dict:
+        return {"outbox": 0, "dropped": 0}
+
+
+class RedisPubSub:
+    """Fan frames out to every API worker and agent through Redis.
+
+    ``publish`` only appends to a local queue. One publisher task takes a
+    seq range from ``INCRBY nso:ws:seq:<scan>`` (so numbering is shared by
+    all producers of a scan) and ``PUBLISH``es the frame on
+    ``nso:ws:scan:<scan>``. A process only subscribes to the channels of
+    scans it has clients for.
+
+    The local queue holds at most ``outbox_size`` frames: while Redis is
+    slow or down the oldest ones are dropped (and counted in ``stats()``)
+    rather than piling up in memory.
+    """
+
+    SEQ_KEY = "nso:ws:seq:{}"
+    CHANNEL = "nso:ws:scan:{}"
+    # sequence counters outlive their scan's traffic by this long
+    SEQ_TTL = 7 * 24 * 3600
+    # close() waits this long for queued frames to go out
+    CLOSE_TIMEOUT = 5.0
+
+    def __init__(self, url: str | None = None, client=None, outbox_size: int = 10000) -> None:
+        if client is None:
+            try:
+                from redis.asyncio import Redis
+            except ImportError as e:  # pragma: no cover - optional dependency
+                raise RuntimeError("NSO_WS_PUBSUB_URL is a redis:// URL but the 'redis' package is not installed") from e
+            client = Redis.from_url(url)
+        self.redis = client
+        self._deliver: Optional[Deliver] = None
+        self.outbox_size = outbox_size
+        self._outbox: asyncio.Queue | None = None
+        self.dropped = 0
+        self._pubsub = None
+        self._channels: Set[int] = set()
+        self._has_channels: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def attach(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def start(self) -> None:
+        self._outbox = self._outbox or asyncio.Queue(self.outbox_size)
+        self._has_channels = asyncio.Event()
+        self._pubsub = self.redis.pubsub()
+        self._tasks = [asyncio.create_task(self._publisher()), asyncio.create_task(self._listener())]
+
+    async def close(self) -> None:
+        try:
+            if self._outbox is not None:
+                # let frames already published go out, unless Redis is unreachable
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._outbox.join(), timeout=self.CLOSE_TIMEOUT)
+        finally:
+            for t in self._tasks:
+                t.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            try:
+                if self._pubsub is not None:
+                    await self._pubsub.aclose()
+            finally:
+                await self.redis.aclose()
+
+    def publish(self, scan_id: int, message: dict, lines: int = 0) -> None:
+        if self._outbox is None:
+            self._outbox = asyncio.Queue(self.outbox_size)
+        if self._outbox.full():
+            self._outbox.get_nowait()
+            self._outbox.task_done()
+            self.dropped += 1
+        self._outbox.put_nowait((scan_id, message, lines))
+
+    async def latest_seq(self, scan_id: int) -> int:
+        """The last ``seq`` handed out for ``scan_id`` by any producer.
+
+        Frames published while this process was not subscribed never reached
+        its replay buffer; comparing with this tells them apart.
+        """
+        value = await self.redis.get(self.SEQ_KEY.format(scan_id))
+        return int(value) if value is not None else 0
+
+    async def subscribe(self, scan_id: int) -> None:
+        if scan_id not in self._channels:
+            self._channels.add(scan_id)
+            await self._pubsub.subscribe(self.CHANNEL.format(scan_id))
+            self._has_channels.set()
+
+    async def unsubscribe(self, scan_id: int) -> None:
+        if scan_id in self._channels:
+            self._channels.discard(scan_id)
+            await self._pubsub.unsubscribe(self.CHANNEL.format(scan_id))
+            if not self._channels:
+                self._has_channels.clear()
+
+    def channels(self) -> list[int]:
+        return sorted(self._channels)
+
+    def stats(self) -> dict:
+        """Frames waiting for Redis, and frames dropped because the outbox was full."""
+        return {"outbox": self._outbox.qsize() if self._outbox is not None else 0, "dropped": self.dropped}
+
+    async def _publisher(self) -> None:
+        while True:
+            scan_id, message, lines = await self._outbox.get()
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    key = self.SEQ_KEY.format(scan_id)
+                    last, _ = await pipe.incrby(key, max(lines, 1)).expire(key, self.SEQ_TTL).execute()
+                first, text = stamp(message, last, lines)
+                header = f"{first} {last} {lines} {message.get('event', '')}\n"
+                await self.redis.publish(self.CHANNEL.format(scan_id), header + text)
+            except Exception:
+                log.exception("could not publish scan %s event", scan_id)
+            finally:
+                self._outbox.task_done()
+
+    async def _listener(self) -> None:
+        while True:
+            await self._has_channels.wait()
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except RuntimeError:
+                # raced with the last unsubscribe
+                await asyncio.sleep(0.1)
+                continue
+            if not msg or msg.get("type") != "message":
+                continue
+            channel, data = msg["channel"], msg["data"]
+            if isinstance(data, bytes):
+                channel, data = channel.decode(), data.decode()
+            header, _, text = data.partition("\n")
+            first, last, lines, event = header.split(" ", 3)
+            scan_id = int(channel.rsplit(":", 1)[1])
+            if scan_id in self._channels:
+                self._deliver(scan_id, int(first), int(last), event, int(lines), text)
+
+
+def make_pubsub(url: str | None, outbox_size: int = 10000):
+    """In-process delivery by default; Redis for ``redis://`` / ``rediss://`` URLs."""
+    if not url:
+        return InProcessPubSub()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPubSub(url, outbox_size=outbox_size)
+    raise ValueError(f"unsupported WebSocket pub/sub URL {url!r}")
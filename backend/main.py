@@ -2,6 +2,9 @@ from __future__ import annotations
 from fastapi import FastAPI
 from .api.routers import router as api_router
 from .infra.db import engine, Base
+from .domain.parse_pool import PARSER
+from .domain.scan_worker import WORKERS
+from .infra.ws_hub import ws_manager
 
 app = FastAPI(title="NetScan Orchestrator Next")
 app.include_router(api_router, prefix="/api")
@@ -9,4 +12,25 @@ app.include_router(api_router, prefix="/api")
 @app.on_event("startup")
 async def create_schema_if_missing():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+
+@app.on_event("startup")
+async def start_ws_pubsub():
+    await ws_manager.start()
+
+@app.on_event("startup")
+async def start_scan_workers():
+    # picks up batches that were still queued when the process last stopped
+    await WORKERS.start()
+
+@app.on_event("shutdown")
+async def stop_scan_workers():
+    await WORKERS.stop()
+
+@app.on_event("shutdown")
+async def stop_parse_pool():
+    PARSER.shutdown()
+
+@app.on_event("shutdown")
+async def stop_ws_pubsub():
+    await ws_manager.close()
@@ -16,17 +16,41 @@ export default function LiveLog({ scanId }: { scanId: number }) {
         const msg: WSEvent = JSON.parse(ev.data);
         if (msg.event === "line") {
           setLines((prev) => [...prev, `[batch ${msg.batch_id}] ${msg.line}`].slice(-2000));
+        } else if (msg.event === "lines") {
+          const batch = msg.lines.map((l) => `[batch ${l.batch_id}] ${l.line}`);
+          setLines((prev) => [...prev, ...batch].slice(-2000));
+        } else if (msg.event === "lines_skipped") {
+          setLines((p) => [...p, `… ${msg.count} lines skipped (client too slow)`]);
         } else if (msg.event === "batch_start") {
-          setLines((p) => [...p, `▶ batch ${msg.batch_id} started (${msg.targets.length} targets)`]);
+          setLines((p) => [...p, `▶ ${msg.stage} batch ${msg.batch_id} started (${msg.targets.length} targets)`]);
         } else if (msg.event === "batch_complete") {
           setLines((p) => [
             ...p,
             `✔ batch ${msg.batch_id} complete — hosts_up=${msg.summary.hosts_up}, open_ports=${msg.summary.open_ports}`,
           ]);
+        } else if (msg.event === "batch_split") {
+          setLines((p) => [
+            ...p,
+            `✂ batch ${msg.batch_id} split after ${msg.done} targets — rest in batches ${msg.children.join(", ")}`,
+          ]);
+        } else if (msg.event === "stage_progress") {
+          const parts = Object.entries(msg.stages).map(
+            ([stage, s]) => `${stage} ${s!.batches_done}/${s!.batches} batches, ${s!.targets_done}/${s!.targets} targets`
+          );
+          setLines((p) => [...p, `⏳ ${parts.join(" · ")}`]);
+        } else if (msg.event === "host_found") {
+          const ports = msg.ports.map((pt) => `${pt.port}/${pt.protocol}`).join(", ");
+          setLines((p) => [...p, `● ${msg.address}${msg.hostname ? ` (${msg.hostname})` : ""} — ${ports}`]);
+        } else if (msg.event === "progress") {
+          const eta = msg.scan.eta_seconds === null ? "" : `, ~${msg.scan.eta_seconds}s left`;
+          setLines((p) => [
+            ...p,
+            `⏳ batch ${msg.batch_id} ${msg.percent}% (${msg.phase ?? "starting"}) — scan ${msg.scan.percent}%${eta}`,
+          ]);
         } else if (msg.event === "scan_complete") {
           setLines((p) => [...p, `🏁 scan ${msg.scan_id} complete`]);
-        } else if (msg.event === "legacy_scan_complete") {
-          setLines((p) => [...p, `🏁 legacy scan complete`, JSON.stringify(msg.results, null, 2)]);
+        } else if (msg.event === "scan_stopped") {
+          setLines((p) => [...p, `⏹ scan ${msg.scan_id} stopped`]);
         } else if (msg.event === "connected") {
           setLines((p) => [...p, `connected to scan ${msg.scan_id}`]);
         }
@@ -2,6 +2,8 @@ export interface Project {
   id: number;
   name: string;
   description?: string;
+  cache_max_age?: number | null;
+  weight?: number;
 }
 
 export interface StartScanReq {
@@ -10,6 +12,14 @@ export interface StartScanReq {
   targets: string[];
   chunk_size: number;
   concurrency: number;
+  batch_seconds?: number | null;
+  discovery?: boolean;
+  discovery_flags?: string[];
+  discovery_chunk_size?: number;
+  service_detection?: boolean;
+  service_flags?: string[];
+  cache_max_age?: number | null;
+  priority?: number;
 }
 
 export interface StartScanRes {
@@ -20,18 +30,42 @@ export interface StartScanRes {
 export interface ConnectedEvent {
   event: "connected";
   scan_id: number;
+  seq: number;
+}
+
+export interface ReplayTruncatedEvent {
+  event: "replay_truncated";
+  scan_id: number;
+  since: number;
+  first_seq: number | null;
 }
 
 export interface LineEvent {
   event: "line";
   batch_id: number;
+  seq: number;
   line: string;
 }
 
+export interface LinesEvent {
+  event: "lines";
+  scan_id: number;
+  seq: number;
+  lines: { seq: number; batch_id: number; line: string }[];
+}
+
+export interface LinesSkippedEvent {
+  event: "lines_skipped";
+  scan_id: number;
+  count: number;
+}
+
 export interface BatchStartEvent {
   event: "batch_start";
   batch_id: number;
+  stage: "discovery" | "scan" | "service";
   targets: string[];
+  max_rate?: number;
 }
 
 export interface BatchCompleteEvent {
@@ -40,23 +74,88 @@ export interface BatchCompleteEvent {
   summary: {
     hosts_up: number;
     open_ports: number;
+    queued_batches?: number;
+    services?: number;
+  };
+  rate?: {
+    max_rate: number;
+    subnets: string[];
+    actual_rate: number | null;
   };
 }
 
+export interface BatchSplitEvent {
+  event: "batch_split";
+  batch_id: number;
+  done: number;
+  summary: { hosts_up: number; open_ports: number };
+  children: number[];
+}
+
+export interface StageProgress {
+  batches: number;
+  batches_done: number;
+  targets: number;
+  targets_done: number;
+}
+
+export interface StageProgressEvent {
+  event: "stage_progress";
+  scan_id: number;
+  stages: Partial<Record<"discovery" | "scan" | "service", StageProgress>>;
+}
+
+export interface HostFoundEvent {
+  event: "host_found";
+  scan_id: number;
+  batch_id: number;
+  host_id: number;
+  address: string;
+  hostname: string | null;
+  ports: { port: number; protocol: string; service: string | null }[];
+}
+
+export interface BatchProgress {
+  phase: string | null;
+  phase_percent: number;
+  phase_remaining: number | null;
+  elapsed: number;
+  hosts_completed: number;
+  hosts_up: number;
+  undergoing: number;
+  percent: number;
+  eta_seconds: number | null;
+  updated_at: string;
+}
+
+export interface ProgressEvent extends BatchProgress {
+  event: "progress";
+  scan_id: number;
+  batch_id: number;
+  scan: { percent: number; eta_seconds: number | null };
+}
+
 export interface ScanCompleteEvent {
   event: "scan_complete";
   scan_id: number;
 }
 
-export interface LegacyScanCompleteEvent {
-  event: "legacy_scan_complete";
-  results: any;
+export interface ScanStoppedEvent {
+  event: "scan_stopped";
+  scan_id: number;
 }
 
 export type WSEvent =
   | ConnectedEvent
+  | ReplayTruncatedEvent
   | LineEvent
+  | LinesEvent
+  | LinesSkippedEvent
   | BatchStartEvent
   | BatchCompleteEvent
+  | BatchSplitEvent
+  | StageProgressEvent
+  | ProgressEvent
+  | HostFoundEvent
   | ScanCompleteEvent
-  | LegacyScanCompleteEvent;
+  | ScanStoppedEvent;
@@ -26,7 +26,7 @@ test('WebSocket scan stream emits lines', async ({ page }) => {
     client.on('message', (data) => {
       try {
         const evt = JSON.parse(data.toString());
-        if (evt.event === 'line') {
+        if (evt.event === 'line' || evt.event === 'lines') {
           gotLine = true;
           clearTimeout(timer);
           client.close();
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Stand-in for nmap: reports every target as up with 80/tcp open.
+
+Accepts ``[flags...] -oX <path> <targets...>`` like the runner builds it.
+``FAKE_NMAP_DELAY`` (seconds) slows every run down. ``FAKE_NMAP_NOISE``
+(bytes) first floods stdout and stderr with that much ``--packet-trace``
+style output.
+"""
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+xml_path = args[args.index("-oX") + 1]
+targets = args[args.index("-oX") + 2:]
+
+time.sleep(float(os.environ.get("FAKE_NMAP_DELAY", "0")))
+noise = int(os.environ.get("FAKE_NMAP_NOISE", "0"))
+if noise:
+    line = b"SENT (0.0421s) TCP 10.0.0.254:53211 > 10.0.0.1:443 S ttl=42 id=4242 iplen=44 seq=123456789 win=1024\n"
+    block = line * (65536 // len(line))
+    for _ in range(max(1, noise // len(block))):
+        sys.stdout.buffer.write(block)
+        sys.stderr.buffer.write(block[:4096])
+    sys.stdout.buffer.flush()
+with open(xml_path, "w") as f:
+    f.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap">\n')
+    for target in targets:
+        print(f"Nmap scan report for {target}", flush=True)
+        f.write(f'<host><status state="up"/><address addr="{target}" addrtype="ipv4"/><ports>'
+                '<port protocol="tcp" portid="80"><state state="open"/><service name="http"/></port>'
+                '</ports></host>\n')
+    f.write("</nmaprun>\n")
+print(f"Nmap done: {len(targets)} IP addresses", flush=True)
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from backend.domain import scan_coordinator
+from backend.domain.scan_worker import ScanWorkerPool
+from backend.infra import models
+from backend.infra.batch_queue import claim_batch
+from backend.infra.db import Base
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+FAKE_NMAP = REPO_ROOT / "tests" / "backend" / "fixtures" / "fake_nmap.py"
+
+
+async def _setup(db_path: Path, targets: list[str]):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=targets, chunk_size=1, concurrency=10,
+        )
+    return engine, Session, scan_id
+
+
+@pytest.mark.asyncio
+async def test_several_agent_processes_drain_the_queue_once(tmp_path):
+    targets = [f"10.0.0.{i}" for i in range(1, 9)]
+    engine, Session, scan_id = await _setup(tmp_path / "state.db", targets)
+
+    env = dict(
+        os.environ,
+        NSO_DATABASE_URL=f"sqlite+aiosqlite:///{tmp_path / 'state.db'}",
+        NSO_NMAP_PATH=str(FAKE_NMAP),
+        NSO_OUTPUT_DIR=str(tmp_path / "outputs"),
+        FAKE_NMAP_DELAY="0.5",
+    )
+    agents = [
+        subprocess.Popen(
+            [sys.executable, "-m", "backend.agent", "--once", "--workers", "2", "--agent-id", f"agent-{i}"],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        for i in range(3)
+    ]
+    for agent in agents:
+        out, _ = agent.communicate(timeout=60)
+        assert agent.returncode == 0, out.decode()
+
+    async with Session() as session:
+        batches = (await session.execute(select(models.Batch))).scalars().all()
+        assert {b.status for b in batches} == {"completed"}
+        assert all(b.attempts == 1 for b in batches)
+        assert len({b.lease_owner for b in batches}) > 1
+
+        hosts = (await session.execute(select(models.Host.address))).scalars().all()
+        assert sorted(hosts) == sorted(targets)
+        assert (await session.get(models.Scan, scan_id)).status == "completed"
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_expired_leases_are_requeued_and_reclaimed(monkeypatch, tmp_path):
+    engine, Session, scan_id = await _setup(tmp_path / "state.db", ["10.0.0.1"])
+
+    async with Session() as session:
+        dead = await claim_batch(session, "dead-agent", lease_seconds=60)
+        await session.execute(
+            update(models.Batch)
+            .where(models.Batch.id == dead.id)
+            .values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+        await session.commit()
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+    monkeypatch.setattr(scan_coordinator.settings, "output_dir", tmp_path)
+
+    await ScanWorkerPool(Session, workers=1, owner="live-agent").run_until_idle()
+
+    async with Session() as session:
+        batch = await session.get(models.Batch, dead.id)
+        assert (batch.status, batch.lease_owner, batch.attempts) == ("completed", "live-agent", 2)
+        assert (await session.get(models.Scan, scan_id)).status == "completed"
+    await engine.dispose()
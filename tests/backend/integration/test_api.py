@@ -12,6 +12,7 @@ sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
 from backend.infra.db import Base
 from backend.api.routers import router, get_db
 import backend.api.routers as routers
+from backend.domain.task_registry import TASKS
 
 
 @pytest.fixture()
@@ -69,7 +70,7 @@ def test_scan_start_and_stop(client, monkeypatch):
     async def fake_cancel_scan(scan_id):
         assert scan_id == 123
 
-    monkeypatch.setattr(routers.TASKS, "cancel_scan", fake_cancel_scan)
+    monkeypatch.setattr(TASKS, "cancel_scan", fake_cancel_scan)
 
     resp = client.post("/api/scans/123/stop")
     assert resp.status_code == 200
@@ -80,7 +81,7 @@ def test_list_all_scans(client, monkeypatch):
     resp = client.post("/api/projects", json={"name": "proj1"})
     project_id = resp.json()["id"]
 
-    async def fake_start_scan(db, project_id, nmap_flags, targets, runner, chunk_size, concurrency):
+    async def fake_start_scan(db, project_id, nmap_flags, targets, runner, chunk_size, concurrency, **kwargs):
         scan = routers.models.Scan(project_id=project_id, params_json={}, status="running")
         db.add(scan)
         await db.commit()
@@ -116,8 +117,28 @@ def test_target_expansion(client):
     }
 
 
+
+def test_target_expansion_pages_large_ranges(client):
+    resp = client.post("/api/targets/expand?offset=256&limit=2", json={"targets": ["10.0.0.0/8"]})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "targets": ["10.0.1.0", "10.0.1.1"],
+        "total": 2**24,
+        "offset": 256,
+        "next_offset": 258,
+    }
+    for query in ("offset=-2&limit=2", "limit=0", f"limit={routers.EXPAND_PAGE_MAX + 1}"):
+        assert client.post(f"/api/targets/expand?{query}", json={"targets": ["10.0.0.0/8"]}).status_code == 422
+
+
+def test_scan_start_rejects_oversized_target_sets(client):
+    project_id = client.post("/api/projects", json={"name": "proj1"}).json()["id"]
+    resp = client.post("/api/scans/start", json={"project_id": project_id, "targets": ["2001:db8::/64"]})
+    assert resp.status_code == 422
+    assert "exceed" in resp.json()["detail"]
+
 def test_nmap_run_error_handling(client, monkeypatch, tmp_path):
-    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir):
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
         raise RuntimeError("boom")
         yield  # pragma: no cover
 
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from backend.domain.result_cache import store_results
+from backend.domain.xml_parser import HostRecord, PortRecord
+from backend.infra import models
+from backend.infra.bulk import bulk_insert_hosts
+from backend.infra.db import Base
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_hosts_returns_ids_in_input_order():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    records = [
+        HostRecord(f"10.0.0.{i}", None, "up", [PortRecord(p, "tcp", "open", "svc") for p in range(1, i + 1)])
+        for i in range(1, 6)
+    ]
+    async with Session() as session:
+        ids = await bulk_insert_hosts(session, 7, records, batch_size=2)
+        await session.commit()
+
+        hosts = {h.id: h for h in (await session.execute(select(models.Host))).scalars()}
+        assert [hosts[i].address for i in ids] == [r.address for r in records]
+        assert all(h.scan_id == 7 for h in hosts.values())
+
+        ports = (await session.execute(select(models.Port.host_id, models.Port.port_number))).all()
+        for host_id, record in zip(ids, records):
+            assert sorted(p for h, p in ports if h == host_id) == [p.port_number for p in record.ports]
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_store_results_replaces_cache_entries_in_place():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async with Session() as session:
+        await store_results(session, 1, "k", 10, ["10.0.0.1", "10.0.0.2"])
+        await session.commit()
+        await bulk_insert_hosts(session, 11, [HostRecord("10.0.0.2", None, "up", [])])
+        # an upsert, not a delete and insert: the row keeps its id
+        await store_results(session, 1, "k", 11, ["10.0.0.2", "10.0.0.3", "10.0.0.2"])
+        await session.commit()
+
+        rows = (await session.execute(
+            select(models.CachedResult.id, models.CachedResult.addr_key, models.CachedResult.scan_id, models.CachedResult.host_id)
+            .order_by(models.CachedResult.addr_key)
+        )).all()
+    assert [(r.addr_key, r.scan_id, r.host_id is not None) for r in rows] == [
+        ("10.0.0.1", 10, False), ("10.0.0.2", 11, True), ("10.0.0.3", 11, False),
+    ]
+    assert rows[1].id == 2
+
+    await engine.dispose()
@@ -0,0 +1,594 @@
+import asyncio
+import socket
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from backend.domain import scan_coordinator
+from backend.domain.batch_sizing import historical_seconds_per_host
+from backend.domain.progress import scan_progress
+from backend.domain.result_cache import flags_key
+from backend.domain.scan_worker import ScanWorkerPool
+from backend.infra import models
+from backend.infra.batch_queue import claim_batch, default_owner
+from backend.infra.db import Base
+
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+async def _statuses(Session):
+    async with Session() as session:
+        return [b.status for b in (await session.execute(select(models.Batch).order_by(models.Batch.id))).scalars()]
+
+
+async def _submit(Session, tmp_path, targets, concurrency=6):
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        return await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=targets,
+            chunk_size=1, concurrency=concurrency, out_dir=tmp_path,
+        )
+
+
+@pytest.mark.asyncio
+async def test_submission_returns_before_batches_run(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    started = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        started.append(batch_id)
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    scan_id = await _submit(Session, tmp_path, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    assert started == []
+    assert await _statuses(Session) == ["queued"] * 3
+
+    pool = ScanWorkerPool(Session, workers=2)
+    assert (await pool.stats())["queue_depth"] == 3
+    await pool.run_until_idle()
+
+    assert await _statuses(Session) == ["completed"] * 3
+    stats = await pool.stats()
+    assert stats["queue_depth"] == 0 and stats["in_flight"] == 0
+    assert sum(w["completed"] for w in stats["per_worker"]) == 3
+    async with Session() as session:
+        assert (await session.get(models.Scan, scan_id)).status == "completed"
+
+
+@pytest.mark.asyncio
+async def test_stopping_the_pool_requeues_running_batches(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    gate = asyncio.Event()
+
+    async def slow_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        gate.set()
+        await asyncio.sleep(60)
+        yield ["never"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", slow_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    scan_id = await _submit(Session, tmp_path, ["10.0.0.1", "10.0.0.2"], concurrency=1)
+    pool = ScanWorkerPool(Session, workers=2, poll_interval=0.05)
+    await pool.start()
+    await asyncio.wait_for(gate.wait(), timeout=5)
+    # per-scan concurrency=1 keeps the second batch in the queue
+    assert sorted(await _statuses(Session)) == ["queued", "running"]
+
+    await pool.stop()
+    assert await _statuses(Session) == ["queued", "queued"]
+    async with Session() as session:
+        assert (await session.get(models.Scan, scan_id)).status == "running"
+
+
+@pytest.mark.asyncio
+async def test_stopping_a_scan_announces_that_it_ended(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    events = []
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    scan_id = await _submit(Session, tmp_path, ["10.0.0.1", "10.0.0.2"])
+    async with Session() as session:
+        await scan_coordinator.stop_scan(session, scan_id)
+        # a second stop finds nothing running
+        await scan_coordinator.stop_scan(session, scan_id)
+    assert await _statuses(Session) == ["cancelled", "cancelled"]
+    assert events == [{"event": "scan_stopped", "scan_id": scan_id}]
+
+
+@pytest.mark.asyncio
+async def test_start_scan_batches_normalized_targets(tmp_path):
+    Session = await _session_factory(tmp_path)
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session,
+            project_id=project.id,
+            nmap_flags=[],
+            targets=["10.0.0.0/30", "10.0.0.2", "10.0.0.4-5", "host.local", "HOST.local"],
+            chunk_size=4,
+        )
+
+    async with Session() as session:
+        scan = await session.get(models.Scan, scan_id)
+        batches = (await session.execute(
+            select(models.Batch).where(models.Batch.scan_id == scan_id).order_by(models.Batch.id)
+        )).scalars().all()
+    assert [b.args_json["targets"] for b in batches] == [
+        ["10.0.0.0", "10.0.0.1", "10.0.0.2", "10.0.0.3"],
+        ["10.0.0.4", "10.0.0.5", "host.local"],
+    ]
+    assert scan.params_json["targets"]["duplicates_removed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_adaptive_batches_follow_measured_cost(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    scanned = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        scanned.extend(targets)
+        await asyncio.sleep(0.01 * len(targets))
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=["10.0.0.0/24"],
+            chunk_size=4, concurrency=2, out_dir=tmp_path, batch_seconds=0.2,
+        )
+    # only concurrency + 1 batches exist up front, sized by chunk_size
+    async with Session() as session:
+        assert [b.target_count for b in (await session.execute(select(models.Batch))).scalars()] == [4, 4, 4]
+
+    await ScanWorkerPool(Session, workers=2).run_until_idle()
+
+    async with Session() as session:
+        scan = await session.get(models.Scan, scan_id)
+        sizes = [b.target_count for b in (await session.execute(select(models.Batch).order_by(models.Batch.id))).scalars()]
+    assert scan.status == "completed" and scan.target_cursor == 256
+    assert sorted(scanned) == sorted(f"10.0.0.{i}" for i in range(256))
+    # grows towards ~20 hosts (0.2s / 0.01s per host), then shrinks for the tail
+    assert max(sizes) > 8
+    assert sizes[-1] <= 2
+
+
+@pytest.mark.asyncio
+async def test_history_matches_equivalent_flags_past_busy_other_scans(tmp_path):
+    Session = await _session_factory(tmp_path)
+    t0 = datetime(2024, 1, 1)
+
+    def scan(flags, seconds, batches, start):
+        return models.Scan(
+            project_id=1, params_json={"flags": flags}, flags_key=flags_key(flags), status="completed",
+            batches=[
+                models.Batch(
+                    status="completed", target_count=10, args_json={"targets": []},
+                    started_at=start + timedelta(minutes=i), finished_at=start + timedelta(minutes=i, seconds=seconds),
+                )
+                for i in range(batches)
+            ],
+        )
+
+    async with Session() as session:
+        session.add_all([
+            scan(["-sS", "-p", "22"], 30, 2, t0),
+            # newer and far more batches than the history limit, other flags
+            scan(["-sU"], 90, 20, t0 + timedelta(days=1)),
+        ])
+        await session.commit()
+        assert await historical_seconds_per_host(session, ["-p 22", "-sS"], limit=10) == 3.0
+        assert await historical_seconds_per_host(session, ["-sT"]) is None
+
+
+@pytest.mark.asyncio
+async def test_pipeline_port_scans_only_discovered_hosts(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    runs, events = [], []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        runs.append((nmap_flags, targets))
+        up = [t for t in targets if int(t.rsplit(".", 1)[1]) % 5 == 0] if "-sn" in nmap_flags else targets
+        hosts = "".join(f'<host><status state="up"/><address addr="{t}" addrtype="ipv4"/></host>' for t in up)
+        (out_dir / f"batch_{batch_id}.xml").write_text(f'<?xml version="1.0"?><nmaprun>{hosts}</nmaprun>')
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=["10.0.0.0/28"],
+            chunk_size=2, concurrency=1, out_dir=tmp_path,
+            discovery_flags=["-sn"], discovery_chunk_size=8,
+        )
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+
+    # live hosts of the first discovery batch are scanned before the second one runs
+    assert runs == [
+        (["-sn"], [f"10.0.0.{i}" for i in range(8)]),
+        (["-sS", "-Pn"], ["10.0.0.0", "10.0.0.5"]),
+        (["-sn"], [f"10.0.0.{i}" for i in range(8, 16)]),
+        (["-sS", "-Pn"], ["10.0.0.10", "10.0.0.15"]),
+    ]
+    assert [e["stage"] for e in events if e["event"] == "batch_start"] == ["discovery", "scan", "discovery", "scan"]
+    assert events[-2]["event"] == "stage_progress"
+    assert events[-2]["stages"] == {
+        "discovery": {"batches": 2, "batches_done": 2, "targets": 16, "targets_done": 16},
+        "scan": {"batches": 2, "batches_done": 2, "targets": 4, "targets_done": 4},
+    }
+    assert events[-1] == {"event": "scan_complete", "scan_id": scan_id}
+
+
+@pytest.mark.asyncio
+async def test_startup_recovery_resumes_batches_of_dead_workers(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    scanned = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        scanned.append(list(targets))
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=["10.0.0.1-4", "10.0.1.1"],
+            chunk_size=4, out_dir=tmp_path,
+        )
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        live = subprocess.Popen(["sleep", "30"])
+        lease = datetime.utcnow() + timedelta(hours=1)
+        owners = {1: f"api-{socket.gethostname()}-{dead.pid}", 2: f"agent-{socket.gethostname()}-{live.pid}-0123abcd"}
+        for batch_id, owner in owners.items():
+            await session.execute(
+                update(models.Batch).where(models.Batch.id == batch_id)
+                .values(status="running", lease_owner=owner, lease_expires_at=lease, attempts=1)
+            )
+        await session.commit()
+    # the dead worker got through two hosts before it was killed
+    (tmp_path / "batch_1.xml").write_text(
+        '<?xml version="1.0"?><nmaprun>'
+        '<host><status state="up"/><address addr="10.0.0.1" addrtype="ipv4"/>'
+        '<ports><port protocol="tcp" portid="22"><state state="open"/></port></ports></host>'
+        '<host><status state="down"/><address addr="10.0.0.2" addrtype="ipv4"/></host>'
+        '<host><status state="up"/><addr'
+    )
+
+    pool = ScanWorkerPool(Session, workers=1)
+    try:
+        assert await pool.recover() == {"resumed": 1, "requeued": 0, "failed": 0, "scans": 1}
+    finally:
+        live.kill()
+        live.wait()
+    await pool.run_until_idle()
+
+    assert scanned == [["10.0.0.3", "10.0.0.4"]]
+    async with Session() as session:
+        batches = (await session.execute(select(models.Batch).order_by(models.Batch.id))).scalars().all()
+        hosts = (await session.execute(select(models.Host.address))).scalars().all()
+        scan = await session.get(models.Scan, scan_id)
+    assert [(b.status, b.args_json["targets"]) for b in batches] == [
+        ("completed", ["10.0.0.1", "10.0.0.2"]),
+        # a live agent's lease is left alone
+        ("running", ["10.0.1.1"]),
+        ("completed", ["10.0.0.3", "10.0.0.4"]),
+    ]
+    assert hosts == ["10.0.0.1"]
+    assert scan.status == "running"
+
+
+@pytest.mark.asyncio
+async def test_startup_recovery_takes_back_leases_of_an_earlier_process_with_the_same_pid(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    await _submit(Session, tmp_path, ["10.0.0.1"])
+    pool = ScanWorkerPool(Session, workers=1)
+    # a restarted container: same hostname and pid, another boot id
+    previous = pool.owner.rsplit("-", 1)[0] + "-00000000"
+    assert previous != pool.owner
+    async with Session() as session:
+        await session.execute(update(models.Batch).values(
+            status="running", lease_owner=previous, lease_expires_at=datetime.utcnow() + timedelta(hours=1), attempts=1,
+        ))
+        await session.commit()
+
+    assert await pool.recover() == {"resumed": 0, "requeued": 1, "failed": 0, "scans": 1}
+    await pool.run_until_idle()
+    assert await _statuses(Session) == ["completed"]
+
+
+@pytest.mark.asyncio
+async def test_startup_recovery_fails_legacy_batches_of_a_dead_process(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    events = []
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    pool = ScanWorkerPool(Session, workers=1)
+    dead = pool.owner.replace("api-", "legacy-", 1).rsplit("-", 1)[0] + "-00000000"
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.flush()
+        crashed = models.Scan(project_id=project.id, params_json={"runner": "multiprocessing"}, status="running")
+        live = models.Scan(project_id=project.id, params_json={"runner": "multiprocessing"}, status="running")
+        session.add_all([crashed, live])
+        await session.flush()
+        session.add_all([
+            models.Batch(scan_id=crashed.id, status="running", lease_owner=dead, args_json={"targets": []}),
+            models.Batch(scan_id=crashed.id, status="pending", lease_owner=dead, args_json={"targets": []}),
+            # still run by this process's own legacy pool
+            models.Batch(scan_id=live.id, status="running", lease_owner=default_owner("legacy"), args_json={"targets": []}),
+        ])
+        await session.commit()
+
+    assert await pool.recover() == {"resumed": 0, "requeued": 0, "failed": 2, "scans": 2}
+    assert await _statuses(Session) == ["failed", "failed", "running"]
+    async with Session() as session:
+        assert (await session.get(models.Scan, crashed.id)).status == "completed"
+        assert (await session.get(models.Scan, live.id)).status == "running"
+    assert [e["event"] for e in events] == ["batch_failed", "batch_failed", "scan_complete"]
+
+
+@pytest.mark.asyncio
+async def test_straggler_is_split_when_the_scan_has_spare_slots(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    runs, events = [], []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        runs.append((batch_id, list(targets), nmap_flags))
+        if "10.0.0.6" in targets and "--host-timeout" not in nmap_flags:
+            # a tarpit: the first host finishes, then nothing for a long time
+            (out_dir / f"batch_{batch_id}.xml").write_text(
+                f'<?xml version="1.0"?><nmaprun><host><status state="down"/>'
+                f'<address addr="{targets[0]}" addrtype="ipv4"/></host>'
+            )
+            await asyncio.sleep(60)
+        await asyncio.sleep(0.05)
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+    monkeypatch.setattr(scan_coordinator.settings, "straggler_min_seconds", 0.3)
+    monkeypatch.setattr(scan_coordinator.settings, "straggler_min_samples", 2)
+    monkeypatch.setattr(scan_coordinator.settings, "straggler_host_timeout", 30.0)
+
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=["10.0.0.1-12"],
+            chunk_size=4, concurrency=3, out_dir=tmp_path,
+        )
+    pool = ScanWorkerPool(Session, workers=3, poll_interval=0.05)
+    await pool.start()
+    try:
+        for _ in range(200):
+            async with Session() as session:
+                if (await session.get(models.Scan, scan_id)).status == "completed":
+                    break
+            await asyncio.sleep(0.05)
+    finally:
+        await pool.stop()
+
+    async with Session() as session:
+        batches = (await session.execute(select(models.Batch).order_by(models.Batch.id))).scalars().all()
+    assert [(b.status, b.parent_id, b.args_json["targets"]) for b in batches] == [
+        ("completed", None, ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]),
+        ("split", None, ["10.0.0.5"]),
+        ("completed", None, ["10.0.0.9", "10.0.0.10", "10.0.0.11", "10.0.0.12"]),
+        ("completed", 2, ["10.0.0.6"]),
+        ("completed", 2, ["10.0.0.7"]),
+        ("completed", 2, ["10.0.0.8"]),
+    ]
+    assert all(flags == ["-sS", "--host-timeout", "30s"] for batch_id, _, flags in runs if batch_id > 3)
+    split = next(e for e in events if e["event"] == "batch_split")
+    assert split["batch_id"] == 2 and split["done"] == 1 and split["children"] == [4, 5, 6]
+
+
+@pytest.mark.asyncio
+async def test_claims_share_workers_fairly_between_projects(tmp_path):
+    Session = await _session_factory(tmp_path)
+    async with Session() as session:
+        big = models.Project(name="big", weight=2.0)
+        small = models.Project(name="small")
+        session.add_all([big, small])
+        await session.commit()
+        bulk = await scan_coordinator.start_scan(
+            db=session, project_id=big.id, nmap_flags=[], targets=["10.0.0.1-20"],
+            chunk_size=1, concurrency=20, out_dir=tmp_path,
+        )
+        urgent = await scan_coordinator.start_scan(
+            db=session, project_id=big.id, nmap_flags=[], targets=["10.0.1.1-20"],
+            chunk_size=1, concurrency=20, out_dir=tmp_path, priority=10,
+        )
+        other = await scan_coordinator.start_scan(
+            db=session, project_id=small.id, nmap_flags=[], targets=["10.0.2.1-20"],
+            chunk_size=1, concurrency=20, out_dir=tmp_path,
+        )
+
+    claimed = []
+    async with Session() as session:
+        for _ in range(6):
+            claimed.append((await claim_batch(session, "test", 60, slots=6, scan_cap=3)).scan_id)
+        assert await claim_batch(session, "test", 60, slots=6, scan_cap=3) is None
+    # big (weight 2) holds twice the small project's batches, and its
+    # urgent scan goes first until it reaches the per-scan cap
+    assert claimed == [urgent, urgent, other, urgent, bulk, other]
+
+    pool = ScanWorkerPool(Session, workers=6)
+    scheduler = (await pool.stats())["scheduler"]
+    assert scheduler["running"] == 6
+    assert [(p["project_id"], p["running"], p["usage"]) for p in scheduler["projects"]] == [
+        (big.id, 4, 2.0), (small.id, 2, 2.0),
+    ]
+    assert {s["scan_id"]: s["running"] for s in scheduler["scans"]} == {bulk: 1, urgent: 3, other: 2}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_claims_from_several_processes_respect_the_limits(tmp_path):
+    Session = await _session_factory(tmp_path)
+    scan_id = await _submit(Session, tmp_path, ["10.0.0.1-12"], concurrency=3)
+
+    async def claim(owner):
+        # a session of its own, like a separate API worker or agent
+        async with Session() as session:
+            batch = await claim_batch(session, owner, 60, slots=4)
+            return batch and batch.scan_id
+
+    claimed = await asyncio.gather(*(claim(f"agent-{i}") for i in range(8)))
+    assert claimed.count(scan_id) == 3
+    assert await _statuses(Session) == ["running"] * 3 + ["queued"] * 9
+
+
+@pytest.mark.asyncio
+async def test_rate_budget_is_split_between_running_batches(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    runs, events = [], []
+    gate = asyncio.Event()
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        runs.append((batch_id, nmap_flags))
+        if len(runs) == 3:
+            gate.set()
+        await gate.wait()
+        yield ["Raw packets sent: 20 (880B) | Rcvd: 20 (800B)"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+    monkeypatch.setattr(scan_coordinator.settings, "rate_budget", 900.0)
+    monkeypatch.setattr(scan_coordinator.settings, "rate_subnet_caps", {"10.0.1.0/24": 100.0})
+
+    async with Session() as session:
+        project = models.Project(name="p")
+        session.add(project)
+        await session.commit()
+        await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS", "--max-rate", "500"],
+            targets=["10.0.0.1", "10.0.0.2", "10.0.1.1"], chunk_size=1, concurrency=3, out_dir=tmp_path,
+        )
+    await ScanWorkerPool(Session, workers=3).run_until_idle()
+
+    assert sorted(runs) == [
+        (1, ["-sS", "--max-rate", "300", "-v"]),
+        (2, ["-sS", "--max-rate", "300", "-v"]),
+        (3, ["-sS", "--max-rate", "100", "-v"]),
+    ]
+    async with Session() as session:
+        batches = (await session.execute(select(models.Batch).order_by(models.Batch.id))).scalars().all()
+    assert [b.args_json["rate"]["subnets"] for b in batches] == [[], [], ["10.0.1.0/24"]]
+    assert all(b.args_json["rate"]["actual_rate"] > 0 for b in batches)
+    complete = [e for e in events if e["event"] == "batch_complete"]
+    assert {e["rate"]["max_rate"] for e in complete} == {300, 100}
+
+
+@pytest.mark.asyncio
+async def test_stats_lines_report_batch_and_scan_progress(monkeypatch, tmp_path):
+    Session = await _session_factory(tmp_path)
+    events, seen = [], []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        assert kwargs["stats_every"] == scan_coordinator.settings.stats_every
+        yield [
+            "Stats: 0:00:30 elapsed; 2 hosts completed (1 up), 4 undergoing SYN Stealth Scan",
+            "SYN Stealth Scan Timing: About 50.00% done; ETC: 12:00 (0:00:30 remaining)",
+        ]
+        async with Session() as session:
+            seen.append(await scan_progress(session, scan_id))
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=[f"10.0.0.{i}" for i in range(1, 9)],
+            chunk_size=8, concurrency=1, out_dir=tmp_path,
+        )
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+
+    progress = [e for e in events if e["event"] == "progress"]
+    assert len(progress) == 1
+    # 2 of 8 done plus half of the 4 in progress
+    assert progress[0]["percent"] == 50.0 and progress[0]["eta_seconds"] == 30
+    assert progress[0]["phase"] == "SYN Stealth Scan" and progress[0]["phase_remaining"] == 30
+    assert progress[0]["scan"]["percent"] == 50.0 and progress[0]["scan_id"] == scan_id
+    assert seen[0]["targets"] == 8 and seen[0]["targets_done"] == 4
+    assert seen[0]["running"][0]["progress"]["hosts_up"] == 1
+
+    async with Session() as session:
+        final = await scan_progress(session, scan_id)
+    assert final["percent"] == 100.0 and final["eta_seconds"] is None and final["running"] == []
@@ -0,0 +1,449 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import selectinload
+
+from backend.infra.db import Base
+from backend.infra import models
+from backend.domain import scan_coordinator
+from backend.domain.scan_worker import ScanWorkerPool
+
+XML = """<?xml version="1.0"?>
+<nmaprun>
+<host><status state="up"/><address addr="{addr}" addrtype="ipv4"/>
+<ports><port protocol="tcp" portid="80"><state state="open"/><service name="http"/></port></ports></host>
+<host><status state="up"/><address addr="10.9.9.9" addrtype="ipv4"/><ports/></host>
+</nmaprun>
+"""
+
+
+@pytest.mark.asyncio
+async def test_batch_results_are_parsed_once_and_reported_once(monkeypatch, tmp_path):
+    # file-backed so that concurrent batches really get separate connections
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        (out_dir / f"batch_{batch_id}.xml").write_text(XML.format(addr=targets[0]))
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+
+        scan_id = await scan_coordinator.start_scan(
+            db=session,
+            project_id=project.id,
+            nmap_flags=[],
+            targets=["10.0.0.1", "10.0.0.2"],
+            chunk_size=1,
+            concurrency=2,
+            out_dir=tmp_path,
+        )
+        await ScanWorkerPool(Session, workers=2).run_until_idle()
+
+        completes = [e for e in events if e["event"] == "batch_complete"]
+        assert len(completes) == 2
+        assert all(e["summary"] == {"hosts_up": 2, "open_ports": 1} for e in completes)
+
+        hosts = (await session.execute(
+            select(models.Host).where(models.Host.scan_id == scan_id).options(selectinload(models.Host.ports))
+        )).scalars().all()
+        assert sorted(h.address for h in hosts) == ["10.0.0.1", "10.0.0.2"]
+        assert all([p.port_number for p in h.ports] == [80] for h in hosts)
+
+    await engine.dispose()
+
+
+def _host_xml(addr, ports, product=None):
+    services = (
+        "".join(
+            f'<port protocol="tcp" portid="{p}"><state state="open"/>'
+            f'<service name="svc{p}" product="{product}" version="1.{p}"/></port>' for p in ports
+        ) if product else
+        "".join(f'<port protocol="tcp" portid="{p}"><state state="open"/></port>' for p in ports)
+    )
+    return f'<host><status state="up"/><address addr="{addr}" addrtype="ipv4"/><ports>{services}</ports></host>'
+
+
+@pytest.mark.asyncio
+async def test_service_stage_scans_only_open_ports_and_updates_rows(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    open_ports = {"10.0.0.1": [22, 80], "10.0.0.2": [22, 80], "10.0.0.3": [443], "10.0.0.4": []}
+    service_runs = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        if "-sV" in nmap_flags:
+            service_runs.append((nmap_flags, targets))
+            ports = [int(p) for p in nmap_flags[nmap_flags.index("-p") + 1].split(",")]
+            hosts = "".join(_host_xml(t, ports, product="acme") for t in targets)
+        else:
+            hosts = "".join(_host_xml(t, open_ports[t]) for t in targets)
+        (out_dir / f"batch_{batch_id}.xml").write_text(f'<?xml version="1.0"?><nmaprun>{hosts}</nmaprun>')
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=list(open_ports),
+            chunk_size=4, concurrency=2, out_dir=tmp_path, service_flags=["-sV"],
+        )
+    await ScanWorkerPool(Session, workers=2).run_until_idle()
+
+    # hosts sharing an open-port set share one invocation
+    assert sorted(service_runs) == [
+        (["-sV", "-Pn", "-p", "22,80"], ["10.0.0.1", "10.0.0.2"]),
+        (["-sV", "-Pn", "-p", "443"], ["10.0.0.3"]),
+    ]
+    async with Session() as session:
+        hosts = (await session.execute(
+            select(models.Host).where(models.Host.scan_id == scan_id).options(selectinload(models.Host.ports))
+        )).scalars().all()
+        scan = await session.get(models.Scan, scan_id)
+    assert scan.status == "completed"
+    assert sorted(h.address for h in hosts) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    for h in hosts:
+        assert sorted((p.port_number, p.service_name, p.service_version) for p in h.ports) == [
+            (p, f"svc{p}", f"1.{p}") for p in open_ports[h.address]
+        ]
+        assert all(p.service_product == "acme" for p in h.ports)
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_rescan_reuses_fresh_cached_results(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    scanned = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        scanned.append(list(targets))
+        hosts = "".join(_host_xml(t, [22]) for t in targets if t != "10.0.0.2")
+        (out_dir / f"batch_{batch_id}.xml").write_text(f'<?xml version="1.0"?><nmaprun>{hosts}</nmaprun>')
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        pass
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async def scan(session, project_id, targets, flags, **kwargs):
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project_id, nmap_flags=flags, targets=targets,
+            chunk_size=8, out_dir=tmp_path, **kwargs,
+        )
+        await ScanWorkerPool(Session, workers=1).run_until_idle()
+        return scan_id
+
+    async with Session() as session:
+        project = models.Project(name="proj1", cache_max_age=3600)
+        session.add(project)
+        await session.commit()
+        await scan(session, project.id, ["10.0.0.1-3"], ["-sS", "-p", "22"])
+        # same flags in another order: 10.0.0.1-3 come from the cache
+        second = await scan(session, project.id, ["10.0.0.0/29"], ["-p", "22", "-sS"])
+        # the per-request max-age wins over the project's
+        third = await scan(session, project.id, ["10.0.0.1"], ["-sS", "-p", "22"], cache_max_age=0)
+
+        hosts = (await session.execute(
+            select(models.Host).where(models.Host.scan_id == second).options(selectinload(models.Host.ports))
+        )).scalars().all()
+        params = (await session.get(models.Scan, second)).params_json
+        third_params = (await session.get(models.Scan, third)).params_json
+        cached_by = (await session.execute(
+            select(models.CachedResult.scan_id).where(models.CachedResult.addr_key == "10.0.0.1")
+        )).scalar_one()
+
+    assert scanned == [
+        ["10.0.0.1", "10.0.0.2", "10.0.0.3"],
+        ["10.0.0.0", "10.0.0.4", "10.0.0.5", "10.0.0.6", "10.0.0.7"],
+        ["10.0.0.1"],
+    ]
+    assert params["cache"]["served"] == 3
+    # with the cache off, the third scan neither reads nor writes it
+    assert "cache" not in third_params
+    assert cached_by != third
+    # cached hosts are copied (10.0.0.2 was down), fresh ones ingested as usual
+    assert sorted(h.address for h in hosts) == ["10.0.0.0", "10.0.0.1", "10.0.0.3", "10.0.0.4", "10.0.0.5", "10.0.0.6", "10.0.0.7"]
+    assert all([p.port_number for p in h.ports] == [22] for h in hosts)
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_a_failed_nmap_run_fails_its_batch_and_caches_nothing(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events = []
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        # killed after reporting the first target
+        (out_dir / f"batch_{batch_id}.xml").write_text(f'<?xml version="1.0"?><nmaprun>{_host_xml(targets[0], [22])}</nmaprun>')
+        yield ["[runner] nmap exited with code -9"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1", cache_max_age=3600)
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=["10.0.0.1-4"], out_dir=tmp_path,
+        )
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+
+    async with Session() as session:
+        batch = (await session.execute(select(models.Batch).where(models.Batch.scan_id == scan_id))).scalar_one()
+        cached = (await session.execute(select(func.count()).select_from(models.CachedResult))).scalar_one()
+    assert batch.status == "failed"
+    assert cached == 0
+    assert [e["error"] for e in events if e["event"] == "batch_failed"] == ["nmap exited with code -9"]
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_legacy_runner_ingests_each_chunk_as_it_finishes(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events = []
+
+    def fake_iter_chunks_parallel(jobs, nmap_options, num_processes, stop):
+        assert nmap_options == "-sS -T4" and num_processes == 2
+        # the last chunk finishes first; the first one fails
+        for batch_id, targets, xml_path in reversed(jobs):
+            if targets == ["10.0.0.1"]:
+                yield {"batch_id": batch_id, "error": "Nmap execution failed.", "details": "boom"}
+            else:
+                with open(xml_path, "w") as f:
+                    f.write(XML.format(addr=targets[0]))
+                yield {"batch_id": batch_id}
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "iter_chunks_parallel", fake_iter_chunks_parallel)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS", "-T4"], targets=["10.0.0.1-3"],
+            runner="multiprocessing", chunk_size=1, concurrency=2, out_dir=tmp_path, session_factory=Session,
+        )
+    for _ in range(100):
+        if events and events[-1]["event"] == "scan_complete":
+            break
+        await asyncio.sleep(0.05)
+
+    assert [(e["event"], e["batch_id"]) for e in events[:-1]] == [
+        ("batch_complete", 3), ("batch_complete", 2), ("batch_failed", 1),
+    ]
+    assert events[-1] == {"event": "scan_complete", "scan_id": scan_id}
+    async with Session() as session:
+        statuses = (await session.execute(select(models.Batch.status).order_by(models.Batch.id))).scalars().all()
+        addresses = (await session.execute(
+            select(models.Host.address).where(models.Host.scan_id == scan_id).order_by(models.Host.address)
+        )).scalars().all()
+    assert statuses == ["failed", "completed", "completed"]
+    assert addresses == ["10.0.0.2", "10.0.0.3"]
+
+
+@pytest.mark.asyncio
+async def test_legacy_run_that_breaks_still_ends_its_scan(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events = []
+
+    def fake_iter_chunks_parallel(jobs, nmap_options, num_processes, stop):
+        for batch_id, targets, xml_path in jobs:
+            yield {"batch_id": batch_id}
+
+    async def broken_ingest(*args):
+        raise RuntimeError("database went away")
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "iter_chunks_parallel", fake_iter_chunks_parallel)
+    monkeypatch.setattr(scan_coordinator, "_ingest_results", broken_ingest)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=["-sS"], targets=["10.0.0.1-2"],
+            runner="multiprocessing", chunk_size=1, out_dir=tmp_path, session_factory=Session,
+        )
+    for _ in range(100):
+        if events and events[-1]["event"] == "scan_complete":
+            break
+        await asyncio.sleep(0.05)
+
+    assert [e["event"] for e in events] == ["batch_failed", "batch_failed", "scan_complete"]
+    assert events[0]["error"] == "Legacy run failed database went away"
+    async with Session() as session:
+        statuses = (await session.execute(select(models.Batch.status))).scalars().all()
+    assert statuses == ["failed", "failed"]
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_hosts_are_stored_while_the_batch_runs_and_not_duplicated(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events, stored_mid_run = [], []
+    head = '<?xml version="1.0"?>\n<nmaprun>\n' + _host_xml("10.0.0.1", [22])
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        xml_path = out_dir / f"batch_{batch_id}.xml"
+        xml_path.write_text(head + '<host><status state="up"/>')
+        for _ in range(100):
+            if any(e["event"] == "host_found" for e in events):
+                break
+            await asyncio.sleep(0.02)
+        async with Session() as session:
+            stored_mid_run.append((await session.execute(select(models.Host.address))).scalars().all())
+        xml_path.write_text(head + _host_xml("10.0.0.2", [80, 443]) + "\n</nmaprun>\n")
+        yield ["done"]
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+    monkeypatch.setattr(scan_coordinator.settings, "live_hosts_interval", 0.02)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=["10.0.0.1", "10.0.0.2"],
+            chunk_size=2, concurrency=1, out_dir=tmp_path,
+        )
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+
+    found = [e for e in events if e["event"] == "host_found"]
+    assert [(e["address"], [p["port"] for p in e["ports"]]) for e in found] == [("10.0.0.1", [22]), ("10.0.0.2", [80, 443])]
+    assert stored_mid_run == [["10.0.0.1"]]
+    assert {e["scan_id"] for e in found} == {scan_id}
+    complete = next(e for e in events if e["event"] == "batch_complete")
+    assert complete["summary"] == {"hosts_up": 2, "open_ports": 3}
+
+    async def hosts():
+        async with Session() as session:
+            return (await session.execute(
+                select(models.Host.address, models.Host.batch_id).where(models.Host.scan_id == scan_id).order_by(models.Host.address)
+            )).all()
+
+    assert await hosts() == [("10.0.0.1", 1), ("10.0.0.2", 1)]
+    # a second run of the batch replaces what the first one stored
+    async with Session() as session:
+        await session.execute(update(models.Batch).values(status="queued"))
+        await session.commit()
+    events.clear()
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+    assert await hosts() == [("10.0.0.1", 1), ("10.0.0.2", 1)]
+    async with Session() as session:
+        assert (await session.execute(select(func.count()).select_from(models.Port))).scalar_one() == 3
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_a_failing_live_host_preview_does_not_fail_the_batch(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    events, attempts = [], []
+    xml = '<?xml version="1.0"?>\n<nmaprun>\n' + _host_xml("10.0.0.1", [22]) + _host_xml("10.0.0.2", [80]) + "\n</nmaprun>\n"
+
+    async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+        (out_dir / f"batch_{batch_id}.xml").write_text(xml)
+        for _ in range(100):
+            if attempts:
+                break
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.1)
+        yield ["done"]
+
+    async def broken_store(session_factory, batch, records):
+        attempts.append(len(records))
+        raise OSError("database went away")
+
+    async def fake_broadcast(scan_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(scan_coordinator, "run_nmap_batch", fake_run_nmap_batch)
+    monkeypatch.setattr(scan_coordinator, "_store_live_hosts", broken_store)
+    monkeypatch.setattr(scan_coordinator.ws_manager, "broadcast", fake_broadcast)
+    monkeypatch.setattr(scan_coordinator.settings, "live_hosts_interval", 0.02)
+
+    async with Session() as session:
+        project = models.Project(name="proj1")
+        session.add(project)
+        await session.commit()
+        scan_id = await scan_coordinator.start_scan(
+            db=session, project_id=project.id, nmap_flags=[], targets=["10.0.0.1", "10.0.0.2"],
+            chunk_size=2, concurrency=1, out_dir=tmp_path,
+        )
+    await ScanWorkerPool(Session, workers=1).run_until_idle()
+
+    # the follower gave up after the first error instead of failing the batch
+    assert attempts == [2]
+    assert [e["event"] for e in events if e["event"].startswith("batch_")] == ["batch_start", "batch_complete"]
+    async with Session() as session:
+        assert (await session.execute(select(models.Batch.status))).scalars().all() == ["completed"]
+        addresses = (await session.execute(
+            select(models.Host.address).where(models.Host.scan_id == scan_id).order_by(models.Host.address)
+        )).scalars().all()
+    assert addresses == ["10.0.0.1", "10.0.0.2"]
+
+    await engine.dispose()
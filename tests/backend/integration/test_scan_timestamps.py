@@ -5,6 +5,7 @@ from sqlalchemy import select
 from backend.infra.db import Base
 from backend.infra import models
 from backend.domain import scan_coordinator
+from backend.domain.scan_worker import ScanWorkerPool
 
 
 @pytest.mark.asyncio
@@ -20,8 +21,8 @@ async def test_scan_completion_sets_timestamps(monkeypatch, tmp_path):
         session.add(project)
         await session.commit()
 
-        async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir):
-            yield "done"
+        async def fake_run_nmap_batch(batch_id, targets, nmap_flags, out_dir, **kwargs):
+            yield ["done"]
 
         async def fake_broadcast(scan_id, message):
             pass
@@ -37,6 +38,7 @@ async def test_scan_completion_sets_timestamps(monkeypatch, tmp_path):
             targets=["127.0.0.1"],
             chunk_size=1,
         )
+        await ScanWorkerPool(Session, workers=1).run_until_idle()
 
         batch = (await session.execute(select(models.Batch))).scalars().first()
         assert batch.started_at is not None
@@ -0,0 +1,30 @@
+from backend.infra.batch_queue import pick_scan, project_usage
+
+
+def _scan(project_id, queued=5, running=0, weight=1.0, priority=0, concurrency=None):
+    return {
+        "project_id": project_id, "weight": weight, "priority": priority,
+        "concurrency": concurrency, "queued": queued, "running": running,
+    }
+
+
+def test_least_served_project_goes_first_by_weight():
+    scans = {1: _scan(1, running=2, weight=2.0), 2: _scan(2, running=1)}
+    assert project_usage(scans) == {1: 1.0, 2: 1.0}
+    # equal usage: the heavier project's next batch adds less
+    assert pick_scan(scans) == 1
+    scans[1]["running"] = 3
+    assert pick_scan(scans) == 2
+
+
+def test_priority_orders_scans_within_a_project():
+    scans = {1: _scan(1), 2: _scan(1, priority=5), 3: _scan(2, running=1)}
+    assert pick_scan(scans) == 2
+
+
+def test_limits_skip_scans():
+    scans = {1: _scan(1, running=2, concurrency=2), 2: _scan(2, running=3), 3: _scan(3, queued=0)}
+    assert pick_scan(scans) == 2
+    assert pick_scan(scans, scan_cap=3) is None
+    assert pick_scan(scans, slots=5) is None
+    assert pick_scan(scans, slots=6) == 2
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from backend.domain.batch_sizing import BatchSizer, seconds_per_host
+
+T0 = datetime(2024, 1, 1)
+
+
+def test_seconds_per_host_ignores_unfinished_batches():
+    timings = [
+        (T0, T0 + timedelta(seconds=10), 5),
+        (T0, T0 + timedelta(seconds=30), 15),
+        (T0, None, 100),
+        (None, None, 100),
+    ]
+    assert seconds_per_host(timings) == 2.0
+    assert seconds_per_host([]) is None
+
+
+def test_size_targets_duration_and_shrinks_at_the_tail():
+    sizer = BatchSizer(target_seconds=60, min_size=2, max_size=500)
+    # 60s / 0.5s per host
+    assert sizer.size(0.5, remaining=10_000, slots=4, fallback=256) == 120
+    # no measurement yet: fixed fallback
+    assert sizer.size(None, remaining=10_000, slots=4, fallback=256) == 256
+    # cheap hosts are capped
+    assert sizer.size(0.001, remaining=10_000, slots=4, fallback=256) == 500
+    # tail: half of each slot's share of what is left, never below min_size
+    assert sizer.size(0.5, remaining=400, slots=4, fallback=256) == 50
+    assert sizer.size(0.5, remaining=9, slots=4, fallback=256) == 2
+    assert sizer.size(0.5, remaining=1, slots=4, fallback=256) == 1
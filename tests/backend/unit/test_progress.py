@@ -0,0 +1,27 @@
+from backend.domain.progress import BatchProgress
+
+
+def test_stats_and_timing_lines_update_the_batch():
+    progress = BatchProgress(40)
+    assert not progress.feed("Discovered open port 80/tcp on 10.0.0.1")
+    assert not progress.feed("Stats: garbage")
+    assert progress.feed("Stats: 0:01:05 elapsed; 10 hosts completed (3 up), 20 undergoing SYN Stealth Scan")
+    assert progress.feed("SYN Stealth Scan Timing: About 50.00% done; ETC: 12:34 (0:00:46 remaining)")
+    assert (progress.elapsed, progress.hosts_completed, progress.hosts_up, progress.undergoing) == (65, 10, 3, 20)
+    assert (progress.phase, progress.phase_percent, progress.phase_remaining) == ("SYN Stealth Scan", 50.0, 46)
+    # 10 done plus half of the 20 in progress
+    assert progress.fraction == 0.5
+    data = progress.as_dict()
+    assert data["percent"] == 50.0 and data["eta_seconds"] == 65
+    assert "target_count" not in data
+
+
+def test_a_new_phase_resets_the_phase_percent():
+    progress = BatchProgress(4)
+    progress.feed("Stats: 0:00:10 elapsed; 0 hosts completed (0 up), 4 undergoing Ping Scan")
+    progress.feed("Ping Scan Timing: About 90.00% done; ETC: 12:00 (0:00:01 remaining)")
+    progress.feed("Stats: 0:00:20 elapsed; 1 host completed (1 up), 3 undergoing Service Scan")
+    assert (progress.phase, progress.phase_percent, progress.phase_remaining) == ("Service Scan", 0.0, None)
+    assert progress.fraction == 0.25
+    assert BatchProgress(0).fraction == 0.0
+    assert BatchProgress(4).as_dict()["eta_seconds"] is None
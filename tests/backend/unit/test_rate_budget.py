@@ -0,0 +1,26 @@
+import math
+
+from backend.domain.rate_budget import allocate, touched_subnets, user_max_rate, without_max_rate
+
+
+def test_fair_share_counts_expected_slots_and_free_budget():
+    assert allocate(1000, slots=4, others=[]) == 250
+    # more batches than slots: the share shrinks, and only what is free is given
+    assert allocate(1000, slots=2, others=[(400, []), (400, [])]) == 200
+    assert allocate(1000, slots=2, others=[(500, []), (500, [])], floor=10) == 10
+
+
+def test_subnet_caps_bound_batches_sharing_a_subnet():
+    caps = {"10.1.0.0/16": 300}
+    others = [(200, ["10.1.0.0/16"]), (250, [])]
+    assert allocate(1000, 4, others, ["10.1.0.0/16"], caps) == 100
+    assert allocate(math.inf, 4, [], ["10.1.0.0/16"], caps) == 300
+
+
+def test_flag_helpers():
+    assert user_max_rate(["-sS", "--max-rate", "50"]) == 50
+    assert user_max_rate(["--max-rate=75.5"]) == 75.5
+    assert user_max_rate(["-T4"]) is None
+    assert without_max_rate(["-sS", "--max-rate", "50", "--max-rate=3", "-T4"]) == ["-sS", "-T4"]
+    caps = {"10.1.0.0/16": 1, "192.168.0.0/24": 1, "10.2.0.0/16": 1}
+    assert touched_subnets(["10.1.2.3", "example.org", "192.168.0.9"], caps) == ["10.1.0.0/16", "192.168.0.0/24"]
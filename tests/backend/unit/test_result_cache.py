@@ -0,0 +1,13 @@
+from backend.domain.result_cache import flags_key
+
+
+def test_flags_key_ignores_option_order_but_keeps_values():
+    assert flags_key(["-T4", "-p", "80,443", "-sS"]) == flags_key(["-sS", "-p 80,443", "-T4"])
+    assert flags_key(["-p", "80"]) != flags_key(["-p", "443"])
+    assert flags_key(["-sS"]) != flags_key(["-sS", "-sV"])
+
+
+def test_flags_key_has_a_fixed_length_for_long_port_lists():
+    ports = ",".join(str(p) for p in range(1000, 1200))
+    assert len(flags_key(["-sS", "-p", ports])) == 64
+    assert flags_key(["-sS", "-p", ports]) == flags_key(["-p", ports, "-sS"])
@@ -0,0 +1,70 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from backend.domain.runner import LogWriter, read_line_batches, run_nmap_batch
+
+FAKE_NMAP = Path(__file__).resolve().parents[1] / "fixtures" / "fake_nmap.py"
+
+
+def _reader(*chunks: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    for data in chunks:
+        reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.mark.asyncio
+async def test_line_batches_keep_partial_lines_for_the_next_chunk():
+    batches = [b async for b in read_line_batches(_reader(b"one\ntw", b"o\nthree\n\nfour"))]
+    assert [line for batch in batches for line in batch] == ["one", "two", "three", "", "four"]
+
+
+@pytest.mark.asyncio
+async def test_verbose_output_arrives_in_batches_and_is_logged(monkeypatch, tmp_path):
+    monkeypatch.setenv("FAKE_NMAP_NOISE", str(4 * 1024 * 1024))
+    wrapper = tmp_path / "nmap"
+    wrapper.write_text(f"#!/bin/sh\nexec {sys.executable} {FAKE_NMAP} \"$@\"\n")
+    wrapper.chmod(0o755)
+
+    batches = [b async for b in run_nmap_batch(7, ["10.0.0.1"], ["-vv"], out_dir=tmp_path, nmap_path=str(wrapper))]
+    lines = [line for batch in batches for line in batch]
+    assert lines[-2:] == ["Nmap scan report for 10.0.0.1", "Nmap done: 1 IP addresses"]
+    assert len(batches) < len(lines) / 100
+    stdout_log = (tmp_path / "batch_7.stdout.log").read_text()
+    assert stdout_log.splitlines() == lines
+    assert (tmp_path / "batch_7.stderr.log").stat().st_size > 0
+
+
+@pytest.mark.asyncio
+async def test_log_writer_holds_back_the_reader_when_the_disk_is_slow(tmp_path):
+    writer = LogWriter(tmp_path / "out.log", max_pending=2)
+    disk = threading.Event()
+    real = writer._files[0]
+
+    class SlowFile:
+        def write(self, data):
+            disk.wait()
+            real.write(data)
+
+        def close(self):
+            real.close()
+
+    writer._files[0] = SlowFile()
+
+    async def produce():
+        for i in range(6):
+            await writer.write(0, b"%d\n" % i)
+
+    task = asyncio.create_task(produce())
+    await asyncio.sleep(0.2)
+    # one chunk is being written, two wait, and the reader waits for room
+    assert not task.done() and writer._queue.qsize() == 2
+    disk.set()
+    await asyncio.wait_for(task, timeout=5)
+    await writer.close()
+    assert (tmp_path / "out.log").read_text().split() == [str(i) for i in range(6)]
@@ -0,0 +1,91 @@
+import pytest
+
+from backend.domain.scan_coordinator import chunk
+from backend.domain.target_expander import TargetSet, expand_targets, normalize_targets
+
+
+def test_parses_cidrs_octet_ranges_and_hostnames():
+    targets = TargetSet.parse(["10.0.0.0/30", "192.168.1-2.1,5", "2001:db8::/126", "Scanme.Example.org", "bad host", "10.0.0.300"])
+    assert list(targets) == [
+        "10.0.0.0", "10.0.0.1", "10.0.0.2", "10.0.0.3",
+        "192.168.1.1", "192.168.1.5", "192.168.2.1", "192.168.2.5",
+        "2001:db8::", "2001:db8::1", "2001:db8::2", "2001:db8::3",
+        "scanme.example.org",
+    ]
+    assert targets.rejected == ["bad host", "10.0.0.300"]
+
+
+def test_len_index_and_slices_stay_lazy():
+    targets = TargetSet.parse(["10.0.0.0/8", "10.1-2.*.1-20"])
+    assert len(targets) == 2**24 + 2 * 256 * 20
+    assert targets[0] == "10.0.0.0"
+    assert targets[2**24 - 1] == "10.255.255.255"
+    assert targets[2**24] == "10.1.0.1"
+    assert targets[-1] == "10.2.255.20"
+
+    window = targets[2**24 - 2:2**24 + 2]
+    assert isinstance(window, TargetSet)
+    assert list(window) == ["10.255.255.254", "10.255.255.255", "10.1.0.1", "10.1.0.2"]
+
+    chunks = list(TargetSet.parse(["10.0.0.0/29", "host.local"]).chunks(3))
+    assert [list(c) for c in chunks] == [
+        ["10.0.0.0", "10.0.0.1", "10.0.0.2"],
+        ["10.0.0.3", "10.0.0.4", "10.0.0.5"],
+        ["10.0.0.6", "10.0.0.7", "host.local"],
+    ]
+
+
+def test_ipv6_size_beyond_len():
+    targets = TargetSet.parse(["2001:db8::/64"])
+    assert targets.size == 2**64
+    assert targets[2**64 - 1] == "2001:db8::ffff:ffff:ffff:ffff"
+    with pytest.raises(OverflowError):
+        len(targets)
+
+
+def test_expand_targets_keeps_ip_only_behaviour():
+    assert expand_targets(["192.168.0.0/31", "example.com", "1.2.3.4"]) == ["192.168.0.0", "192.168.0.1", "1.2.3.4"]
+
+
+def test_normalize_merges_overlaps_and_applies_exclusions():
+    targets = normalize_targets(
+        ["10.0.5.7", "10.0.0.0/16", "10.0.5.0/24", "10.1.0-255.*", "web.local", "WEB.local", "2001:db8::1", "nope!"],
+        exclude=["10.0.0.0/24", "10.0.9.9", "web.local"],
+    )
+    assert [(s.first, s.last) for s, _, _ in targets._windows][:2] == [
+        (0x0A000100, 0x0A000908),
+        (0x0A00090A, 0x0A01FFFF),
+    ]
+    assert targets[-1] == "2001:db8::1"
+    assert targets.report == {
+        "requested": 65536 + 256 + 1 + 65536 + 2 + 1,
+        "duplicates_removed": 256 + 1 + 1,
+        "excluded": 256 + 1 + 1,
+        "invalid": 1,
+        "targets": 2 * 65536 - 256 - 1 + 1,
+    }
+    assert targets.rejected == ["nope!"]
+
+
+def test_normalize_handles_many_entries_quickly():
+    entries = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(200_000, 0, -1)]
+    targets = normalize_targets(entries + entries)
+    assert len(targets._windows) == 1
+    assert targets.report["duplicates_removed"] == 200_000
+
+
+def test_membership_and_subtraction_stay_on_ranges():
+    targets = normalize_targets(["10.0.0.0/8", "2001:db8::/120", "Host.local"])
+    assert "10.200.3.4" in targets and "11.0.0.0" not in targets
+    assert "2001:db8::ff" in targets and "2001:db8::100" not in targets
+    assert "host.local" in targets and "other.local" not in targets
+
+    rest = targets.without(["10.0.0.0", "10.0.0.5", "1.1.1.1", "host.local"])
+    assert len(rest) == len(targets) - 3
+    assert list(rest[:5]) == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.6"]
+    assert "host.local" not in rest
+
+
+def test_chunking_handles_sets_larger_than_len_can_report():
+    first = next(chunk(normalize_targets(["2001:db8::/64"]), 256))
+    assert list(first)[:2] == ["2001:db8::", "2001:db8::1"] and first.size == 256
@@ -0,0 +1,208 @@
+import asyncio
+import json
+
+import pytest
+
+from backend.infra.ws_hub import SLOW_CONSUMER_CLOSE, WSConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, blocked: bool = False):
+        self.frames = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+        if not blocked:
+            self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.frames.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_delay_others():
+    manager = WSConnectionManager(queue_size=3, policy="drop_oldest")
+    fast, slow = FakeSocket(), FakeSocket(blocked=True)
+    await manager.connect(1, fast)
+    await manager.connect(1, slow)
+
+    for i in range(10):
+        await manager.broadcast(1, {"event": "line", "batch_id": 1, "line": str(i)})
+        await asyncio.sleep(0)
+    await _settle()
+
+    assert [f["event"] for f in fast.frames] == ["connected"] + ["line"] * 10
+    stats = {c["dropped"]: c for c in manager.stats()["connections"]}
+    assert set(stats) == {0, 7}
+    assert stats[7]["queue_depth"] == 3
+
+    # the blocked client catches up with the newest frames only
+    slow.gate.set()
+    await _settle()
+    assert [f.get("line") for f in slow.frames] == [None, "7", "8", "9"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_folds_lines_and_keeps_events():
+    manager = WSConnectionManager(queue_size=3, policy="coalesce")
+    ws = FakeSocket(blocked=True)
+    await manager.connect(1, ws)
+    await _settle()
+
+    await manager.broadcast(1, {"event": "batch_start", "batch_id": 1, "targets": []})
+    for i in range(6):
+        await manager.broadcast(1, {"event": "line", "batch_id": 1, "line": str(i)})
+    await manager.broadcast(1, {"event": "batch_complete", "batch_id": 1, "summary": {}})
+    ws.gate.set()
+    await _settle()
+
+    events = [f["event"] for f in ws.frames]
+    assert events[0] == "connected"
+    assert "batch_start" in events and events[-1] == "batch_complete"
+    skipped = sum(f["count"] for f in ws.frames if f["event"] == "lines_skipped")
+    lines = sum(1 for f in ws.frames if f["event"] == "line")
+    assert skipped + lines == 6 and skipped > 0
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_client():
+    manager = WSConnectionManager(queue_size=2, policy="disconnect")
+    ws = FakeSocket(blocked=True)
+    await manager.connect(1, ws)
+    await _settle()
+
+    for i in range(4):
+        await manager.broadcast(1, {"event": "line", "batch_id": 1, "line": str(i)})
+    ws.gate.set()
+    await _settle()
+
+    assert ws.closed_with == SLOW_CONSUMER_CLOSE
+    assert manager.stats()["connections"] == []
+
+
+@pytest.mark.asyncio
+async def test_lines_are_coalesced_per_window_and_flushed_before_events():
+    manager = WSConnectionManager(line_window_ms=20, line_window_bytes=1000)
+    ws = FakeSocket()
+    await manager.connect(1, ws)
+
+    for i in range(5):
+        await manager.publish_line(1, 7, f"line {i}")
+    await manager.broadcast(1, {"event": "batch_complete", "batch_id": 7, "summary": {}})
+    await manager.publish_line(1, 8, "late")
+    await asyncio.sleep(0.05)
+
+    frames = ws.frames[1:]
+    assert [f["event"] for f in frames] == ["lines", "batch_complete", "lines"]
+    assert [(l["seq"], l["batch_id"]) for l in frames[0]["lines"]] == [(i, 7) for i in range(1, 6)]
+    assert frames[2]["lines"] == [{"seq": 7, "batch_id": 8, "line": "late"}]
+
+
+@pytest.mark.asyncio
+async def test_line_window_flushes_when_byte_limit_is_reached():
+    manager = WSConnectionManager(line_window_ms=10_000, line_window_bytes=10)
+    ws = FakeSocket()
+    await manager.connect(1, ws)
+
+    for line in ("12345", "67890", "x"):
+        await manager.publish_line(1, 1, line)
+    await _settle()
+
+    assert [[l["line"] for l in f["lines"]] for f in ws.frames[1:]] == [["12345", "67890"]]
+    manager.flush_lines(1)
+    await _settle()
+    assert ws.frames[-1]["lines"][0]["line"] == "x"
+
+
+@pytest.mark.asyncio
+async def test_reconnect_with_since_replays_missed_events():
+    manager = WSConnectionManager(line_window_ms=0)
+    await manager.broadcast(1, {"event": "batch_start", "batch_id": 1, "targets": []})
+    for i in range(3):
+        await manager.publish_line(1, 1, f"line {i}")
+    await manager.broadcast(1, {"event": "batch_complete", "batch_id": 1, "summary": {}})
+
+    ws = FakeSocket()
+    await manager.connect(1, ws, since=2)
+    await manager.publish_line(1, 1, "live")
+    await _settle()
+
+    assert ws.frames[0] == {"event": "connected", "scan_id": 1, "seq": 5}
+    assert [f["seq"] for f in ws.frames[1:]] == [3, 4, 5, 6]
+    assert ws.frames[-1]["line"] == "live"
+
+
+@pytest.mark.asyncio
+async def test_replay_trims_lines_frame_and_reports_truncation():
+    manager = WSConnectionManager(line_window_ms=10_000, replay_scan_bytes=200)
+    for i in range(3):
+        await manager.publish_line(1, 1, f"line {i}")
+    manager.flush_lines(1)
+
+    ws = FakeSocket()
+    await manager.connect(1, ws, since=2)
+    await _settle()
+    assert [l["line"] for l in ws.frames[1]["lines"]] == ["line 2"]
+
+    for i in range(20):
+        await manager.broadcast(1, {"event": "batch_start", "batch_id": i, "targets": []})
+    late = FakeSocket()
+    await manager.connect(1, late, since=0)
+    await _settle()
+    assert late.frames[1]["event"] == "replay_truncated"
+    assert late.frames[2]["seq"] == late.frames[1]["first_seq"]
+
+
+@pytest.mark.asyncio
+async def test_global_cap_evicts_finished_scans_first():
+    manager = WSConnectionManager(line_window_ms=0, replay_total_bytes=780)
+    await manager.broadcast(1, {"event": "scan_complete", "scan_id": 1})
+    # stopped scans are finished too
+    await manager.broadcast(4, {"event": "scan_stopped", "scan_id": 4})
+    await manager.broadcast(2, {"event": "batch_start", "batch_id": 1, "targets": []})
+    for i in range(8):
+        await manager.publish_line(3, 1, "x" * 40)
+
+    replay = manager.stats()["replay"]
+    assert replay["bytes"] <= 780
+    scans = {s["scan_id"]: s for s in replay["scans"]}
+    assert 1 not in scans and 4 not in scans
+    assert scans[2]["bytes"] > 0 and scans[3]["last_seq"] == 8
+
+
+@pytest.mark.asyncio
+async def test_replay_backlog_does_not_lift_the_live_queue_bound():
+    manager = WSConnectionManager(queue_size=3, policy="drop_oldest", line_window_ms=0)
+    for i in range(10):
+        await manager.publish_line(1, 1, f"old {i}")
+
+    ws = FakeSocket(blocked=True)
+    await manager.connect(1, ws, since=0)
+    await _settle()
+    # the whole replay is queued beyond the bound ("connected" is being sent)
+    assert manager.stats()["connections"][0]["queue_depth"] == 10
+    ws.gate.set()
+    await _settle()
+    assert len(ws.frames) == 11
+
+    ws.gate.clear()
+    for i in range(10):
+        await manager.publish_line(1, 1, f"live {i}")
+        await asyncio.sleep(0)
+    await _settle()
+    stats = manager.stats()["connections"][0]
+    assert stats["queue_depth"] == 3 and stats["dropped"] == 6
+    ws.gate.set()
+    await _settle()
+    assert [f["line"] for f in ws.frames[11:]] == ["live 0", "live 7", "live 8", "live 9"]
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from backend.infra.ws_hub import WSConnectionManager  # noqa: E402
+from backend.infra.ws_pubsub import RedisPubSub  # noqa: E402
+
+from test_ws_hub import FakeSocket  # noqa: E402
+
+
+def _manager(server) -> WSConnectionManager:
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    return WSConnectionManager(line_window_ms=10, pubsub=RedisPubSub(client=client))
+
+
+async def _wait_for(predicate, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.asyncio
+async def test_events_reach_clients_on_other_workers():
+    server = fakeredis.FakeServer()
+    producer, worker_a, worker_b = _manager(server), _manager(server), _manager(server)
+    for m in (producer, worker_a, worker_b):
+        await m.start()
+    try:
+        ws = FakeSocket()
+        await worker_a.connect(7, ws)
+        other = FakeSocket()
+        await worker_b.connect(8, other)
+
+        await producer.broadcast(7, {"event": "batch_start", "batch_id": 1, "targets": ["10.0.0.1"]})
+        for i in range(3):
+            await producer.publish_line(7, 1, f"line {i}")
+        await producer.broadcast(7, {"event": "batch_complete", "batch_id": 1, "summary": {}})
+        await _wait_for(lambda: ws.frames and ws.frames[-1]["event"] == "batch_complete")
+
+        assert [f["event"] for f in ws.frames] == ["connected", "batch_start", "lines", "batch_complete"]
+        assert [l["seq"] for l in ws.frames[2]["lines"]] == [2, 3, 4]
+        assert ws.frames[-1]["seq"] == 5
+        # only channels with local clients are subscribed
+        assert worker_a.stats()["subscriptions"] == [7]
+        assert worker_b.stats()["subscriptions"] == [8]
+        assert [f["event"] for f in other.frames] == ["connected"]
+        assert 7 not in {s["scan_id"] for s in worker_b.stats()["replay"]["scans"]}
+    finally:
+        for m in (producer, worker_a, worker_b):
+            await m.close()
+
+
+@pytest.mark.asyncio
+async def test_producers_share_sequence_numbers():
+    server = fakeredis.FakeServer()
+    agent_1, agent_2, api = _manager(server), _manager(server), _manager(server)
+    for m in (agent_1, agent_2, api):
+        await m.start()
+    try:
+        ws = FakeSocket()
+        await api.connect(3, ws)
+        await agent_1.broadcast(3, {"event": "batch_start", "batch_id": 1, "targets": []})
+        await agent_2.broadcast(3, {"event": "batch_start", "batch_id": 2, "targets": []})
+        await _wait_for(lambda: len(ws.frames) == 3)
+        assert sorted(f["seq"] for f in ws.frames[1:]) == [1, 2]
+    finally:
+        for m in (agent_1, agent_2, api):
+            await m.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_reports_events_this_worker_never_received():
+    server = fakeredis.FakeServer()
+    producer, worker_a, worker_b = _manager(server), _manager(server), _manager(server)
+    for m in (producer, worker_a, worker_b):
+        await m.start()
+    try:
+        ws = FakeSocket()
+        await worker_a.connect(5, ws)
+        await producer.broadcast(5, {"event": "batch_start", "batch_id": 1, "targets": []})
+        await _wait_for(lambda: len(ws.frames) == 2)
+        # the client drops; worker_a unsubscribes and misses seq 2..4
+        worker_a.disconnect(5, ws)
+        await _wait_for(lambda: worker_a.stats()["subscriptions"] == [])
+        for i in range(3):
+            await producer.broadcast(5, {"event": "batch_start", "batch_id": i + 2, "targets": []})
+        for _ in range(150):
+            if await producer.pubsub.latest_seq(5) == 4:
+                break
+            await asyncio.sleep(0.02)
+
+        for manager in (worker_a, worker_b):
+            again = FakeSocket()
+            await manager.connect(5, again, since=1)
+            await _wait_for(lambda: len(again.frames) == 2)
+            assert again.frames[0]["event"] == "connected" and again.frames[0]["seq"] == 4
+            assert again.frames[1] == {"event": "replay_truncated", "scan_id": 5, "since": 1, "first_seq": None}
+
+        await producer.broadcast(5, {"event": "scan_complete", "scan_id": 5})
+        await _wait_for(lambda: again.frames[-1]["event"] == "scan_complete")
+        assert again.frames[-1]["seq"] == 5
+        # what arrived since is replayable again
+        late = FakeSocket()
+        await worker_b.connect(5, late, since=4)
+        await _wait_for(lambda: len(late.frames) == 2)
+        assert [f["event"] for f in late.frames] == ["connected", "scan_complete"]
+    finally:
+        for m in (producer, worker_a, worker_b):
+            await m.close()
+
+
+@pytest.mark.asyncio
+async def test_outbox_drops_the_oldest_frames_while_redis_lags():
+    pubsub = RedisPubSub(client=fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer()), outbox_size=3)
+    manager = WSConnectionManager(line_window_ms=0, pubsub=pubsub)
+    # not started: nothing drains the outbox, as when Redis hangs
+    for i in range(5):
+        await manager.broadcast(1, {"event": "batch_start", "batch_id": i, "targets": []})
+    assert manager.stats()["pubsub"] == {"outbox": 3, "dropped": 2}
+    assert [pubsub._outbox.get_nowait()[1]["batch_id"] for _ in range(3)] == [2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_close_cleans_up_when_queued_frames_cannot_go_out(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    closed = []
+    real_aclose = client.aclose
+
+    async def aclose():
+        closed.append(True)
+        await real_aclose()
+
+    monkeypatch.setattr(client, "aclose", aclose)
+    pubsub = RedisPubSub(client=client)
+    pubsub.CLOSE_TIMEOUT = 0.1
+    await pubsub.start()
+    publisher = pubsub._tasks[0]
+    # a publisher stuck on an unreachable Redis never drains the outbox
+    publisher.cancel()
+    await asyncio.gather(publisher, return_exceptions=True)
+    pubsub.publish(1, {"event": "batch_start", "batch_id": 1, "targets": []})
+
+    await pubsub.close()
+    assert closed == [True] and pubsub._tasks == []
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+from backend.domain.parse_pool import ParsePool
+from backend.domain.xml_parser import HostFollower, iter_nmap_hosts, parse_nmap_xml, read_nmap_host_chunk
+
+XML = """<?xml version="1.0"?>
+<nmaprun>
+<host><status state="up"/><address addr="10.0.0.1" addrtype="ipv4"/>
+<hostnames><hostname name="a.example"/></hostnames>
+<ports>
+<port protocol="tcp" portid="22"><state state="open"/><service name="ssh" product="OpenSSH" version="9.6"/></port>
+<port protocol="tcp" portid="23"><state state="closed"/></port>
+</ports></host>
+<host><status state="down"/><address addr="10.0.0.2" addrtype="ipv4"/></host>
+<host><status state="up"/><address addr="10.0.0.3" addrtype="ipv4"/><ports/></host>
+</nmaprun>
+"""
+
+
+def test_iter_nmap_hosts_streams_records_from_path(tmp_path: Path):
+    xml_path = tmp_path / "batch.xml"
+    xml_path.write_text(XML)
+
+    hosts = list(iter_nmap_hosts(xml_path))
+    assert [h.address for h in hosts] == ["10.0.0.1", "10.0.0.3"]
+    assert hosts[0].hostname == "a.example"
+    assert [(p.port_number, p.service_product) for p in hosts[0].ports] == [(22, "OpenSSH")]
+
+    everything = list(iter_nmap_hosts(xml_path, up_only=False))
+    assert [h.status for h in everything] == ["up", "down", "up"]
+
+
+def test_iter_nmap_hosts_stops_cleanly_on_truncated_xml(tmp_path: Path):
+    xml_path = tmp_path / "partial.xml"
+    xml_path.write_text(XML[: XML.index("<host><status state=\"down\"")] + "<host><status")
+
+    assert [h.address for h in iter_nmap_hosts(xml_path)] == ["10.0.0.1"]
+
+
+def test_host_follower_returns_hosts_as_the_file_grows(tmp_path: Path):
+    xml_path = tmp_path / "growing.xml"
+    follower = HostFollower(xml_path)
+    assert follower.poll() == []
+
+    cut = XML.index("<host><status state=\"down\"")
+    xml_path.write_text(XML[:cut - 20])
+    assert follower.poll() == []
+    with xml_path.open("a") as f:
+        f.write(XML[cut - 20:cut + 10])
+    hosts = follower.poll()
+    assert [(h.address, [p.port_number for p in h.ports]) for h in hosts] == [("10.0.0.1", [22])]
+    with xml_path.open("a") as f:
+        f.write(XML[cut + 10:])
+    assert [h.address for h in follower.poll()] == ["10.0.0.3"]
+    assert follower.poll() == [] and follower.offset == len(XML)
+
+    broken = HostFollower()
+    assert broken.feed(b"<nmaprun><host></nmaprun>") == [] and broken.failed
+    assert broken.feed(XML.encode()) == []
+
+
+def test_host_follower_poll_waits_for_one_still_running(tmp_path: Path):
+    xml_path = tmp_path / "batch.xml"
+    xml_path.write_text(XML)
+    follower = HostFollower(xml_path, read_size=64)
+    entered, release = threading.Event(), threading.Event()
+    feed = follower.feed
+
+    def slow_feed(data):
+        entered.set()
+        release.wait(5)
+        return feed(data)
+
+    follower.feed = slow_feed
+    results = []
+    first = threading.Thread(target=lambda: results.append(follower.poll()))
+    first.start()
+    assert entered.wait(5)
+    second = threading.Thread(target=lambda: results.append(follower.poll()))
+    second.start()
+    second.join(0.1)
+    assert second.is_alive()  # blocked behind the first poll
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert [h.address for h in results[0]] == ["10.0.0.1", "10.0.0.3"]
+    assert results[1] == [] and not follower.failed
+
+def test_parse_nmap_xml_keeps_text_input_and_filters_portless_hosts():
+    hosts = parse_nmap_xml(XML)
+    assert [h.address for h in hosts] == ["10.0.0.1"]
+    assert hosts[0].ports[0].service_name == "ssh"
+    assert parse_nmap_xml("") == []
+
+
+@pytest.mark.asyncio
+async def test_parse_pool_parses_in_another_process_while_the_loop_runs(tmp_path: Path):
+    host = (
+        '<host><status state="up"/><address addr="10.0.{}.{}" addrtype="ipv4"/>'
+        '<ports><port protocol="tcp" portid="80"><state state="open"/></port></ports></host>\n'
+    )
+    xml_path = tmp_path / "big.xml"
+    xml_path.write_text("<nmaprun>\n" + "".join(host.format(i // 250, i % 250) for i in range(20000)) + "</nmaprun>\n")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    pool = ParsePool(workers=1, chunk_hosts=3000)
+    task = asyncio.create_task(ticker())
+    try:
+        chunks = [chunk async for chunk in pool.chunks(xml_path)]
+    finally:
+        task.cancel()
+        pool.shutdown()
+    # bounded lists, never the whole file at once
+    assert [len(chunk.records) for chunk in chunks] == [3000] * 6 + [2000]
+    assert chunks[-1].records[-1].address == "10.0.79.249" and chunks[-1].records[-1].ports[0].port_number == 80
+    assert ticks > 5
+    assert await ParsePool(workers=0).hosts(tmp_path / "missing.xml") == []
+
+
+def test_read_nmap_host_chunk_resumes_at_the_returned_offset(tmp_path: Path):
+    xml_path = tmp_path / "batch.xml"
+    xml_path.write_text(XML)
+    seen, offset = [], 0
+    while offset is not None:
+        # tiny reads: the </host> tags straddle read boundaries
+        chunk, offset = read_nmap_host_chunk(xml_path, offset, max_hosts=1, with_ports=True, read_size=5)
+        seen.append(([h.address for h in chunk.records], chunk.seen))
+    # the down host is not up; the portless one is counted but not sent
+    assert seen == [(["10.0.0.1"], 1), ([], 0), ([], 1), ([], 0)]
+
+    xml_path.write_text(XML[: XML.index("<host><status state=\"down\"")] + "<host><status")
+    chunk, offset = read_nmap_host_chunk(xml_path, 0, max_hosts=10)
+    assert [h.address for h in chunk.records] == ["10.0.0.1"] and offset is None
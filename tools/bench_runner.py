@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare how fast nmap output is drained by the runner's pipe readers.
+
+Runs the fake nmap from ``tests/backend/fixtures`` with ``FAKE_NMAP_NOISE``
+so it writes as fast as the pipe allows, once per mode:
+
+* ``readline`` – the previous approach: ``readline()`` per line, a
+  synchronous log write and a separate decode for every line.
+* ``chunked``  – ``backend.domain.runner.run_nmap_batch``: large reads,
+  bulk line splitting and a background log writer, yielding line batches.
+
+Usage::
+
+    python tools/bench_runner.py --mb 64 256
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from backend.domain.runner import run_nmap_batch  # noqa: E402
+
+FAKE_NMAP = REPO_ROOT / "tests" / "backend" / "fixtures" / "fake_nmap.py"
+
+
+async def run_readline(cmd: list[str], out_dir: Path) -> int:
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    lines = 0
+    with (out_dir / "stdout.log").open("wb") as out_f, (out_dir / "stderr.log").open("wb") as err_f:
+        async def drain_stderr():
+            while line := await proc.stderr.readline():
+                err_f.write(line)
+
+        stderr_task = asyncio.create_task(drain_stderr())
+        while line := await proc.stdout.readline():
+            out_f.write(line)
+            line.decode(errors="ignore").rstrip("\n")
+            lines += 1
+        await stderr_task
+    await proc.wait()
+    return lines
+
+
+async def measure(mode: str, mb: int) -> tuple[int, float]:
+    os.environ["FAKE_NMAP_NOISE"] = str(mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = Path(tmp)
+        wrapper = out_dir / "nmap"
+        wrapper.write_text(f"#!/bin/sh\nexec {sys.executable} {FAKE_NMAP} \"$@\"\n")
+        wrapper.chmod(0o755)
+        start = time.perf_counter()
+        if mode == "readline":
+            count = await run_readline([str(wrapper), "-vv", "-oX", str(out_dir / "out.xml"), "10.0.0.1"], out_dir)
+        else:
+            count = 0
+            async for batch in run_nmap_batch(1, ["10.0.0.1"], ["-vv"], out_dir=out_dir, nmap_path=str(wrapper)):
+                count += len(batch)
+        return count, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, nargs="+", default=[64])
+    args = parser.parse_args()
+
+    print(f"{'reader':<9} {'MB':>5} {'lines':>9} {'seconds':>8} {'MB/s':>8}")
+    for mb in args.mb:
+        for mode in ("readline", "chunked"):
+            count, elapsed = asyncio.run(measure(mode, mb))
+            print(f"{mode:<9} {mb:>5} {count:>9} {elapsed:>8.2f} {mb / elapsed:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
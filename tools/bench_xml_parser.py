@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Compare peak RSS and throughput of the Nmap XML parsers.
+
+Generates a synthetic ``-oX`` document and parses it in a fresh child process
+per mode, so each measurement gets its own peak RSS:
+
+* ``tree``   – the previous approach: ``read_text`` + ``ET.fromstring`` and a
+  list holding every host.
+* ``stream`` – ``backend.domain.xml_parser.iter_nmap_hosts``.
+
+Usage::
+
+    python tools/bench_xml_parser.py --hosts 200000 --ports 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def write_xml(path: Path, hosts: int, ports: int) -> None:
+    with path.open("w") as f:
+        f.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap" args="nmap -sV">\n')
+        for i in range(hosts):
+            addr = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            f.write(f'<host><status state="up" reason="syn-ack"/>'
+                    f'<address addr="{addr}" addrtype="ipv4"/>'
+                    f'<hostnames><hostname name="h{i}.example" type="PTR"/></hostnames><ports>')
+            for p in range(ports):
+                f.write(f'<port protocol="tcp" portid="{20 + p}"><state state="open" reason="syn-ack"/>'
+                        f'<service name="svc{p}" product="prod" version="1.{p}" method="probed"/></port>')
+            f.write('</ports><times srtt="100" rttvar="50" to="100000"/></host>\n')
+        f.write('<runstats><finished elapsed="1.0"/><hosts up="%d" down="0" total="%d"/></runstats>\n'
+                '</nmaprun>\n' % (hosts, hosts))
+
+
+def run_tree(path: Path) -> int:
+    from backend.domain.xml_parser import _host_record
+
+    root = ET.fromstring(path.read_text())
+    hosts = [r for r in (_host_record(h) for h in root.findall("host")) if r is not None and r.ports]
+    return len(hosts)
+
+
+def run_stream(path: Path) -> int:
+    from backend.domain.xml_parser import iter_nmap_hosts
+
+    return sum(1 for r in iter_nmap_hosts(path) if r.ports)
+
+
+def child(mode: str, path: Path) -> None:
+    start = time.perf_counter()
+    count = {"tree": run_tree, "stream": run_stream}[mode](path)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode},{count},{elapsed:.3f},{peak_kb}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=100_000)
+    parser.add_argument("--ports", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], Path(args.child[1]))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.xml"
+        write_xml(path, args.hosts, args.ports)
+        size_mb = path.stat().st_size / 1e6
+        print(f"{args.hosts} hosts x {args.ports} open ports, {size_mb:.1f} MB")
+        print(f"{'parser':<8} {'hosts':>9} {'seconds':>8} {'hosts/s':>10} {'peak RSS':>10}")
+        for mode in ("tree", "stream"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(path)],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip()
+            _, count, elapsed, peak_kb = out.split(",")
+            rate = int(count) / float(elapsed)
+            print(f"{mode:<8} {count:>9} {float(elapsed):>8.2f} {rate:>10.0f} {int(peak_kb) / 1024:>8.0f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())